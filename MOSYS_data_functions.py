@@ -1,20 +1,149 @@
+import asyncio
+import os
+import threading
+import time
 import pandas as pd
 import pyodbc
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime
 
 # Centralize the connection string
 CONNECTION_STRING = (
 	"DSN=STAAMP_DB;ArrayFetchOn=1;ArrayBufferSize=8;TransportHint=TCP;DecimalSymbol=,;;")
 
+# DSN used by calls in the current context instead of the one above (see use_dsn)
+_dsn = ContextVar('mosys_dsn', default=None)
+
+# Where lookups are answered, in order: 'mirror' (local copy, see mosys_mirror.py), 'live' (ODBC).
+# Keys not found in one source are looked up in the next.
+MOSYS_SOURCE_ORDER = [
+	source.strip() for source in os.environ.get('MOSYS_SOURCE_ORDER', 'mirror,live').split(',')
+	if source.strip()
+]
+
+# Per-source lookup counters: {source: {'hits': n, 'misses': n, 'errors': n, 'short_circuited': n}}
+SOURCE_STATS = {}
+_stats_lock = threading.Lock()
+
+# Seconds; a hung STAAMP server must not block page requests indefinitely
+CONNECT_TIMEOUT = int(os.environ.get('MOSYS_CONNECT_TIMEOUT', 5))
+QUERY_TIMEOUT = int(os.environ.get('MOSYS_QUERY_TIMEOUT', 30))
+
+
+class CircuitOpenError(Exception):
+	"""Raised instead of calling MOSYS while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+	"""
+	Stops calling MOSYS after `failure_threshold` consecutive failures.
+
+	While open, calls fail fast with CircuitOpenError. After `reset_timeout`
+	seconds one call is let through (half-open); its success closes the
+	breaker, its failure opens it again.
+	"""
+
+	def __init__(self, failure_threshold=3, reset_timeout=30.0):
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.state = 'closed'
+		self.failures = 0
+		self.opened_at = None
+		self.opened_count = 0
+		self.rejected = 0
+		self._probing = False
+		self._lock = threading.Lock()
+
+	def allow(self):
+		"""True if a call may go to MOSYS now."""
+		with self._lock:
+			if self.state == 'closed':
+				return True
+			if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+				self.state = 'half_open'
+			if self.state == 'half_open' and not self._probing:
+				self._probing = True
+				return True
+			self.rejected += 1
+			return False
+
+	def record_success(self):
+		with self._lock:
+			self.state = 'closed'
+			self.failures = 0
+			self._probing = False
+
+	def record_failure(self):
+		with self._lock:
+			self.failures += 1
+			self._probing = False
+			if self.state == 'half_open' or self.failures >= self.failure_threshold:
+				if self.state != 'open':
+					self.opened_count += 1
+				self.state = 'open'
+				self.opened_at = time.monotonic()
+
+	def stats(self):
+		with self._lock:
+			return {
+				'state': self.state,
+				'consecutive_failures': self.failures,
+				'open_for_seconds': round(time.monotonic() - self.opened_at, 1) if self.state != 'closed' else None,
+				'opened_count': self.opened_count,
+				'rejected_calls': self.rejected,
+				'failure_threshold': self.failure_threshold,
+				'reset_timeout': self.reset_timeout,
+			}
+
+
+BREAKER = CircuitBreaker(
+	failure_threshold=int(os.environ.get('MOSYS_BREAKER_FAILURES', 3)),
+	reset_timeout=float(os.environ.get('MOSYS_BREAKER_RESET', 30))
+)
+
+# Breakers of the other DSNs, so one plant's STAAMP outage doesn't block the others
+_breakers = {}
+
+
+@contextmanager
+def use_dsn(dsn):
+	"""Send MOSYS calls made in this context (thread or task) to another ODBC DSN, e.g. another plant's."""
+	token = _dsn.set(dsn or None)
+	try:
+		yield
+	finally:
+		_dsn.reset(token)
+
+
+def connection_string():
+	"""CONNECTION_STRING with the DSN of the current context."""
+	dsn = _dsn.get()
+	if not dsn:
+		return CONNECTION_STRING
+	return f"DSN={dsn};" + CONNECTION_STRING.split(';', 1)[1]
+
+
+def breaker():
+	"""Circuit breaker of the current context's DSN (BREAKER for the default one)."""
+	dsn = _dsn.get()
+	if not dsn:
+		return BREAKER
+	with _stats_lock:
+		if dsn not in _breakers:
+			_breakers[dsn] = CircuitBreaker(BREAKER.failure_threshold, BREAKER.reset_timeout)
+		return _breakers[dsn]
+
 
 @contextmanager
 def pervasive_connection(readonly: bool = True):
 	"""A context manager for handling database connections."""
-	conn_str = f"{CONNECTION_STRING}readonly={'True' if readonly else 'False'};"
+	conn_str = f"{connection_string()}readonly={'True' if readonly else 'False'};"
 	conn = None
 	try:
-		conn = pyodbc.connect(conn_str)
+		conn = pyodbc.connect(conn_str, timeout=CONNECT_TIMEOUT)
+		conn.timeout = QUERY_TIMEOUT
 		yield conn
 	except pyodbc.Error as e:
 		print(f"Database connection error: {e}")
@@ -25,9 +154,24 @@ def pervasive_connection(readonly: bool = True):
 
 
 def get_pervasive(query: str, params: tuple = None) -> pd.DataFrame:
-	"""Executes a read-only query and returns a cleaned pandas DataFrame."""
-	with pervasive_connection(readonly=True) as conn:
-		df = pd.read_sql(query, conn, params=params)
+	"""
+	Executes a read-only query and returns a cleaned pandas DataFrame.
+	Raises CircuitOpenError without touching MOSYS while the DSN's breaker is open.
+	"""
+	circuit = breaker()
+	if not circuit.allow():
+		raise CircuitOpenError('MOSYS circuit breaker is open')
+	try:
+		with pervasive_connection(readonly=True) as conn:
+			df = pd.read_sql(query, conn, params=params)
+	except pyodbc.ProgrammingError:
+		# Bad SQL says nothing about server health
+		circuit.record_success()
+		raise
+	except Exception:
+		circuit.record_failure()
+		raise
+	circuit.record_success()
 	
 	# More efficient whitespace stripping
 	for col in df.select_dtypes(include=['object']).columns:
@@ -36,6 +180,47 @@ def get_pervasive(query: str, params: tuple = None) -> pd.DataFrame:
 	return df
 
 
+def _strip(value):
+	return value.strip() if isinstance(value, str) else value
+
+
+def iter_pervasive(query: str, params: tuple = None, chunksize: int = 5000, as_frame: bool = False):
+	"""
+	Stream a read-only query in batches of at most `chunksize` rows.
+
+	Yields lists of dicts (or DataFrames with as_frame=True) with strings
+	stripped, reading with cursor.fetchmany, so memory stays bounded by one
+	batch however large the result is. The connection stays open until the
+	generator is exhausted or closed. Subject to the breaker like get_pervasive.
+	"""
+	circuit = breaker()
+	if not circuit.allow():
+		raise CircuitOpenError('MOSYS circuit breaker is open')
+	healthy = False
+	try:
+		with pervasive_connection(readonly=True) as conn:
+			cursor = conn.cursor()
+			cursor.execute(query, params or ())
+			columns = [column[0] for column in cursor.description]
+			while True:
+				rows = cursor.fetchmany(chunksize)
+				if not healthy:
+					healthy = True
+					circuit.record_success()
+				if not rows:
+					break
+				batch = [dict(zip(columns, map(_strip, row))) for row in rows]
+				yield pd.DataFrame(batch, columns=columns) if as_frame else batch
+	except pyodbc.ProgrammingError:
+		# Bad SQL says nothing about server health
+		if not healthy:
+			circuit.record_success()
+		raise
+	except Exception:
+		circuit.record_failure()
+		raise
+
+
 def parse_mosys_date(date_value):
 	"""Parse MOSYS date (YYYYMMDD format) to Python date object."""
 	if date_value is None:
@@ -84,17 +269,37 @@ def get_niezgodnosc_details(nr_niezgodnosci: str) -> dict:
 	return {'data_niezgodnosci': None, 'nr_zamowienia': None}
 
 
-def get_nc_history(nr_niezgodnosci: str) -> list:
-	"""
-	Get history of updates for a given nr_niezgodnosci.
-	Returns: list of dicts with keys: data_wpisu, godzina_wpisu, tekst_wpisu, typ_uwagi
-	"""
-	if not nr_niezgodnosci:
-		return []
-	
-	# Strip whitespace from the parameter
-	nr_niezgodnosci = str(nr_niezgodnosci).strip()
-	
+def _count(source, key, n=1):
+	with _stats_lock:
+		stats = SOURCE_STATS.setdefault(source, {'hits': 0, 'misses': 0, 'errors': 0, 'short_circuited': 0})
+		stats[key] += n
+
+
+def join_notes(row):
+	"""Join NOTE_01..NOTE_10 of a NOTCOJAN row (dict or Series) with spaces."""
+	notes = []
+	for i in range(1, 11):
+		note = None
+		# Try different column name formats
+		for col_name in [f'NOTE_{i:02d}', f'NOTE{i:02d}', f'NOTE_{i}', f'NOTE{i}']:
+			if col_name in row:
+				note = row[col_name]
+				break
+		if note and str(note).strip():
+			notes.append(str(note).strip())
+	return ' '.join(notes)
+
+
+def format_ora(ora):
+	"""Format MOSYS time (HHMM or HHMMSS) as HH:MM."""
+	if ora and len(str(ora)) >= 4:
+		godzina_str = str(ora).zfill(6)[:4]
+		return f"{godzina_str[:2]}:{godzina_str[2:4]}"
+	return '-'
+
+
+def _live_nc_history(nr_niezgodnosci: str) -> list:
+	"""NC history straight from NOTCOJAN over ODBC. Raises on connection errors."""
 	query = '''
 		SELECT NOTCOJAN.DATA, NOTCOJAN.ORA,
 		NOTCOJAN.NOTE_01, NOTCOJAN.NOTE_02, NOTCOJAN.NOTE_03, NOTCOJAN.NOTE_04, NOTCOJAN.NOTE_05,
@@ -104,86 +309,112 @@ def get_nc_history(nr_niezgodnosci: str) -> list:
 		WHERE NOTCOJAN.NUMERO_NC = ?
 		ORDER BY NOTCOJAN.DATA ASC, NOTCOJAN.ORA ASC
 	'''
-	try:
-		df = get_pervasive(query, (nr_niezgodnosci,))
-		if df.empty:
-			return []
-		
-		history = []
-		for _, row in df.iterrows():
-			# Join all NOTE columns with space separator
-			# Try both NOTE_01 and NOTE01 formats
-			notes = []
-			for i in range(1, 11):
-				note = None
-				# Try different column name formats
-				for col_name in [f'NOTE_{i:02d}', f'NOTE{i:02d}', f'NOTE_{i}', f'NOTE{i}']:
-					if col_name in row.index:
-						note = row[col_name]
-						break
-				if note and str(note).strip():
-					notes.append(str(note).strip())
-			tekst = ' '.join(notes)
-			
-			# Parse date
-			data_wpisu = parse_mosys_date(row['DATA'])
-			
-			# Format time (ORA might be HHMM or HHMMSS format)
-			godzina = row.get('ORA', '')
-			if godzina and len(str(godzina)) >= 4:
-				godzina_str = str(godzina).zfill(6)[:4]
-				godzina_wpisu = f"{godzina_str[:2]}:{godzina_str[2:4]}"
-			else:
-				godzina_wpisu = '-'
-			
+	history = []
+	for batch in iter_pervasive(query, (nr_niezgodnosci,), chunksize=1000):
+		for row in batch:
 			history.append({
-				'data_wpisu': data_wpisu,
-				'godzina_wpisu': godzina_wpisu,
-				'tekst_wpisu': tekst,
-				'typ_uwagi': row.get('TIPO_NOTA', '')
+				'data_wpisu': parse_mosys_date(row['DATA']),
+				'godzina_wpisu': format_ora(row.get('ORA', '')),
+				'tekst_wpisu': join_notes(row),
+				'typ_uwagi': row.get('TIPO_NOTA') or ''
 			})
-		
-		return history
-	except Exception as e:
-		print(f"Error fetching NC history for {nr_niezgodnosci}: {e}")
-		return []
+	return history
 
-def get_part_number(nr_zamowienia: str) -> str:
+
+def get_nc_history(nr_niezgodnosci: str) -> list:
 	"""
-	Get kod_detalu (part number) for a given production order.
-	Returns: part_number string or None
+	Get history of updates for a given nr_niezgodnosci.
+	Returns: list of dicts with keys: data_wpisu, godzina_wpisu, tekst_wpisu, typ_uwagi
+	(plus 'stale': True when live MOSYS failed and an outdated mirror was used)
 	"""
-	if not nr_zamowienia:
-		return None
+	if not nr_niezgodnosci:
+		return []
+	
+	# Strip whitespace from the parameter
+	nr_niezgodnosci = str(nr_niezgodnosci).strip()
 	
+	live_failed = False
+	for source in MOSYS_SOURCE_ORDER:
+		try:
+			if source == 'mirror':
+				from mosys_mirror import mirror_nc_history
+				history = mirror_nc_history(nr_niezgodnosci)
+			elif source == 'live':
+				history = _live_nc_history(nr_niezgodnosci)
+			else:
+				continue
+		except CircuitOpenError:
+			_count(source, 'short_circuited')
+			live_failed = live_failed or source == 'live'
+			continue
+		except Exception as e:
+			_count(source, 'errors')
+			live_failed = live_failed or source == 'live'
+			print(f"Error fetching NC history for {nr_niezgodnosci} from {source}: {e}")
+			continue
+		if history:
+			_count(source, 'hits')
+			return history
+		_count(source, 'misses')
+	
+	# Live MOSYS is down: an outdated mirror beats no history at all
+	if live_failed and 'mirror' in MOSYS_SOURCE_ORDER:
+		try:
+			from mosys_mirror import mirror_nc_history
+			return mirror_nc_history(nr_niezgodnosci, allow_stale=True)
+		except Exception as e:
+			print(f"Error fetching stale NC history for {nr_niezgodnosci}: {e}")
+	
+	return []
+
+
+def _live_part_number(nr_zamowienia: str) -> str:
+	"""ARTICOLO for a COMMESSA straight from COLLAUDO over ODBC. Raises on connection errors."""
 	query = '''
 		SELECT COLLAUDO.ARTICOLO
 		FROM STAAMPDB.COLLAUDO COLLAUDO
 		WHERE COLLAUDO.COMMESSA = ?
 	'''
-	try:
-		df = get_pervasive(query, (nr_zamowienia,))
-		if not df.empty:
-			return df.iloc[0]['ARTICOLO']
-	except Exception as e:
-		print(f"Error fetching part number for {nr_zamowienia}: {e}")
-	
+	df = get_pervasive(query, (nr_zamowienia,))
+	if not df.empty:
+		return df.iloc[0]['ARTICOLO']
 	return None
 
 
-def get_batch_niezgodnosc_details(nr_niezgodnosci_list: list) -> dict:
+def get_part_number(nr_zamowienia: str) -> str:
 	"""
-	Batch fetch data for multiple nr_niezgodnosci values.
-	Returns: {nr_niezgodnosci: {'data_niezgodnosci': date, 'nr_zamowienia': str, 'kod_detalu': str}}
+	Get kod_detalu (part number) for a given production order.
+	Returns: part_number string or None
 	"""
-	if not nr_niezgodnosci_list:
-		return {}
+	if not nr_zamowienia:
+		return None
 	
-	# Filter out empty/None values
-	nr_list = [nr for nr in nr_niezgodnosci_list if nr]
-	if not nr_list:
-		return {}
+	for source in MOSYS_SOURCE_ORDER:
+		try:
+			if source == 'mirror':
+				from mosys_mirror import mirror_part_number
+				part = mirror_part_number(nr_zamowienia)
+			elif source == 'live':
+				part = _live_part_number(nr_zamowienia)
+			else:
+				continue
+		except CircuitOpenError:
+			_count(source, 'short_circuited')
+			continue
+		except Exception as e:
+			_count(source, 'errors')
+			print(f"Error fetching part number for {nr_zamowienia} from {source}: {e}")
+			continue
+		if part:
+			_count(source, 'hits')
+			return part
+		_count(source, 'misses')
 	
+	return None
+
+
+def _live_batch_details(nr_list: list) -> dict:
+	"""Batch NC details straight from NOTCOJAN/COLLAUDO over ODBC. Raises on connection errors."""
 	result = {}
 	
 	# First query: get DATA and COMMESSA for all nr_niezgodnosci
@@ -193,41 +424,226 @@ def get_batch_niezgodnosc_details(nr_niezgodnosci_list: list) -> dict:
 		FROM STAAMPDB.NOTCOJAN NOTCOJAN
 		WHERE NOTCOJAN.NUMERO_NC IN ({placeholders})
 	'''
+	df = get_pervasive(query, tuple(nr_list))
 	
-	try:
-		df = get_pervasive(query, tuple(nr_list))
+	# Build intermediate results
+	commessa_to_fetch = set()
+	for _, row in df.iterrows():
+		nr = row['NUMERO_NC']
+		result[nr] = {
+			'data_niezgodnosci': parse_mosys_date(row['DATA']),
+			'nr_zamowienia': row['COMMESSA'],
+			'kod_detalu': None
+		}
+		if row['COMMESSA']:
+			commessa_to_fetch.add(row['COMMESSA'])
+	
+	# Second query: get ARTICOLO for all COMMESSA values
+	if commessa_to_fetch:
+		placeholders = ','.join(['?' for _ in commessa_to_fetch])
+		query = f'''
+			SELECT COLLAUDO.COMMESSA, COLLAUDO.ARTICOLO
+			FROM STAAMPDB.COLLAUDO COLLAUDO
+			WHERE COLLAUDO.COMMESSA IN ({placeholders})
+		'''
+		df_parts = get_pervasive(query, tuple(commessa_to_fetch))
 		
-		# Build intermediate results
-		commessa_to_fetch = set()
-		for _, row in df.iterrows():
-			nr = row['NUMERO_NC']
-			result[nr] = {
-				'data_niezgodnosci': parse_mosys_date(row['DATA']),
-				'nr_zamowienia': row['COMMESSA'],
-				'kod_detalu': None
-			}
-			if row['COMMESSA']:
-				commessa_to_fetch.add(row['COMMESSA'])
+		# Map COMMESSA to ARTICOLO
+		commessa_to_articolo = dict(zip(df_parts['COMMESSA'], df_parts['ARTICOLO']))
 		
-		# Second query: get ARTICOLO for all COMMESSA values
-		if commessa_to_fetch:
-			placeholders = ','.join(['?' for _ in commessa_to_fetch])
-			query = f'''
-				SELECT COLLAUDO.COMMESSA, COLLAUDO.ARTICOLO
-				FROM STAAMPDB.COLLAUDO COLLAUDO
-				WHERE COLLAUDO.COMMESSA IN ({placeholders})
-			'''
-			df_parts = get_pervasive(query, tuple(commessa_to_fetch))
-			
-			# Map COMMESSA to ARTICOLO
-			commessa_to_articolo = dict(zip(df_parts['COMMESSA'], df_parts['ARTICOLO']))
-			
-			# Update results with kod_detalu
-			for nr, data in result.items():
-				if data['nr_zamowienia'] in commessa_to_articolo:
-					data['kod_detalu'] = commessa_to_articolo[data['nr_zamowienia']]
+		# Update results with kod_detalu
+		for nr, data in result.items():
+			if data['nr_zamowienia'] in commessa_to_articolo:
+				data['kod_detalu'] = commessa_to_articolo[data['nr_zamowienia']]
 	
-	except Exception as e:
-		print(f"Error in batch fetch: {e}")
+	return result
+
+
+def get_batch_niezgodnosc_details(nr_niezgodnosci_list: list) -> dict:
+	"""
+	Batch fetch data for multiple nr_niezgodnosci values.
+	Sources are tried in MOSYS_SOURCE_ORDER; each one only gets the keys still missing.
+	Returns: {nr_niezgodnosci: {'data_niezgodnosci': date, 'nr_zamowienia': str, 'kod_detalu': str}}
+	"""
+	if not nr_niezgodnosci_list:
+		return {}
+	
+	# Filter out empty/None values
+	nr_list = list(dict.fromkeys(nr for nr in nr_niezgodnosci_list if nr))
+	if not nr_list:
+		return {}
+	
+	result = {}
+	partial = {}
+	for source in MOSYS_SOURCE_ORDER:
+		remaining = [nr for nr in nr_list if nr not in result]
+		if not remaining:
+			break
+		try:
+			if source == 'mirror':
+				from mosys_mirror import mirror_batch_details
+				found = mirror_batch_details(remaining)
+				# No mirrored COLLAUDO row for the order: live MOSYS may know the part
+				partial.update((nr, data) for nr, data in found.items() if data['kod_detalu'] is None)
+				found = {nr: data for nr, data in found.items() if data['kod_detalu'] is not None}
+			elif source == 'live':
+				found = _live_batch_details(remaining)
+			else:
+				continue
+		except CircuitOpenError:
+			_count(source, 'short_circuited')
+			continue
+		except Exception as e:
+			_count(source, 'errors')
+			print(f"Error in batch fetch from {source}: {e}")
+			continue
+		_count(source, 'hits', len(found))
+		_count(source, 'misses', len(remaining) - len(found))
+		result.update(found)
+	
+	# Without a live source the mirror's partial details are all there is; with one,
+	# they are left out so the reports are asked for again once live MOSYS answers
+	if 'live' not in MOSYS_SOURCE_ORDER:
+		for nr, data in partial.items():
+			result.setdefault(nr, data)
 	
-	return result
\ No newline at end of file
+	return result
+
+
+def find_niezgodnosc(nr_niezgodnosci: str) -> tuple:
+	"""
+	(details, answered) for one NC, for validating it at entry time.
+	details come from the first source that has the NC; a mirror hit without a
+	part (no mirrored COLLAUDO row) still counts, live MOSYS is only asked to
+	fill in kod_detalu. answered is False when a source failed or was
+	short-circuited, so (None, False) means "can't tell" and (None, True)
+	means MOSYS doesn't know the NC.
+	"""
+	nr = str(nr_niezgodnosci).strip()
+	partial = None
+	answered = True
+	for source in MOSYS_SOURCE_ORDER:
+		try:
+			if source == 'mirror':
+				from mosys_mirror import mirror_batch_details
+				found = mirror_batch_details([nr]).get(nr)
+			elif source == 'live':
+				found = _live_batch_details([nr]).get(nr)
+			else:
+				continue
+		except CircuitOpenError:
+			_count(source, 'short_circuited')
+			answered = False
+			continue
+		except Exception as e:
+			_count(source, 'errors')
+			answered = False
+			print(f"Error checking NC {nr} in {source}: {e}")
+			continue
+		if found is None:
+			_count(source, 'misses')
+			continue
+		_count(source, 'hits')
+		if found.get('kod_detalu') or source != 'mirror':
+			return found, True
+		partial = partial or found
+	if partial is not None:
+		return partial, True
+	return None, answered
+
+
+# Async client: the blocking lookups above run on a bounded thread pool so
+# asyncio jobs (sync, prefetch) can overlap many lookups against STAAMP.
+ASYNC_MAX_CONCURRENCY = int(os.environ.get('MOSYS_ASYNC_CONCURRENCY', 4))
+ASYNC_BATCH_SIZE = 500
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+	global _executor
+	with _executor_lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(max_workers=ASYNC_MAX_CONCURRENCY, thread_name_prefix='mosys')
+		return _executor
+
+
+class AsyncMosysClient:
+	"""
+	asyncio front-end for the MOSYS lookups.
+
+	At most `max_concurrency` lookups run at once (on the shared executor);
+	a key already being fetched is not queried again - later callers await
+	the in-flight lookup. Create one client per event loop.
+	"""
+
+	def __init__(self, max_concurrency=None, batch_size=ASYNC_BATCH_SIZE):
+		self.batch_size = batch_size
+		self._semaphore = asyncio.Semaphore(max_concurrency or ASYNC_MAX_CONCURRENCY)
+		self._in_flight = {}
+		self.coalesced = 0
+
+	async def _run(self, func, *args):
+		async with self._semaphore:
+			loop = asyncio.get_running_loop()
+			# Executor threads don't inherit context variables (e.g. the DSN of use_dsn)
+			return await loop.run_in_executor(_get_executor(), copy_context().run, func, *args)
+
+	def _start(self, keys, func, *args):
+		"""Start func(*args) as a task registered under every key in `keys`."""
+		task = asyncio.ensure_future(self._run(func, *args))
+		for key in keys:
+			self._in_flight[key] = task
+
+		def _done(_):
+			for key in keys:
+				if self._in_flight.get(key) is task:
+					del self._in_flight[key]
+		task.add_done_callback(_done)
+		return task
+
+	async def _single(self, kind, value, func):
+		key = (_dsn.get(), kind, value)
+		task = self._in_flight.get(key)
+		if task is None:
+			task = self._start([key], func, value)
+		else:
+			self.coalesced += 1
+		# shield: one cancelled caller must not cancel the lookup others await
+		return await asyncio.shield(task)
+
+	async def get_part_number(self, nr_zamowienia: str) -> str:
+		if not nr_zamowienia:
+			return None
+		return await self._single('part', nr_zamowienia, get_part_number)
+
+	async def get_nc_history(self, nr_niezgodnosci: str) -> list:
+		if not nr_niezgodnosci:
+			return []
+		return await self._single('history', str(nr_niezgodnosci).strip(), get_nc_history)
+
+	async def get_batch_niezgodnosc_details(self, nr_niezgodnosci_list: list) -> dict:
+		"""Like get_batch_niezgodnosc_details; batches of `batch_size` keys run concurrently."""
+		nr_list = list(dict.fromkeys(nr for nr in nr_niezgodnosci_list or [] if nr))
+		if not nr_list:
+			return {}
+
+		tasks = set()
+		new = []
+		for nr in nr_list:
+			task = self._in_flight.get((_dsn.get(), 'details', nr))
+			if task is None:
+				new.append(nr)
+			else:
+				self.coalesced += 1
+				tasks.add(task)
+		for start in range(0, len(new), self.batch_size):
+			chunk = new[start:start + self.batch_size]
+			tasks.add(self._start([(_dsn.get(), 'details', nr) for nr in chunk], get_batch_niezgodnosc_details, chunk))
+
+		wanted = set(nr_list)
+		result = {}
+		for found in await asyncio.gather(*(asyncio.shield(task) for task in tasks)):
+			result.update({nr: data for nr, data in found.items() if nr in wanted})
+		return result
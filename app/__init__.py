@@ -1,7 +1,9 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from app.site_routing import SiteSession
+
+db = SQLAlchemy(session_options={'class_': SiteSession})
 
 
 def create_app(config_class='app.config.Config'):
@@ -9,22 +11,53 @@ def create_app(config_class='app.config.Config'):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Per-plant databases become binds, so this runs before db.init_app
+    from app.services import sites
+    sites.init_app(app)
+
     # Initialize extensions
     db.init_app(app)
 
+    from app.services import enrichment, compression, assets
+    enrichment.init_app(app)
+    compression.init_app(app)
+    assets.init_app(app)
+
     # Register blueprints
     from app.routes.main import bp as main_bp
     from app.routes.reports import bp as reports_bp
     from app.routes.operators import bp as operators_bp
     from app.routes.categories import bp as categories_bp
+    from app.routes.analytics import bp as analytics_bp
 
     app.register_blueprint(main_bp)
     app.register_blueprint(reports_bp, url_prefix='/reports')
     app.register_blueprint(operators_bp, url_prefix='/operators')
     app.register_blueprint(categories_bp, url_prefix='/categories')
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
 
-    # Create database tables if they don't exist
+    # Create database tables, columns and indexes if they don't exist
     with app.app_context():
-        db.create_all()
+        from app.schema import upgrade_schema
+        from app.services import archive
+        from app.services.change_log import install_triggers
+        from app.services.defect_types import intern_missing_defect_types
+        from app.services.rollup import ensure_rollup
+        from app.services.anomalies import ensure_anomalies
+        from app.services.recommended_rates import ensure_recommended_rates
+        archive.init_app(app)
+        # Every plant's database gets the same schema, triggers and derived tables
+        for site in sites.site_keys():
+            with sites.activate(site):
+                upgrade_schema(sites.engine(), db.metadata, backup_dir=sites.backup_dir())
+                install_triggers(sites.engine())
+                intern_missing_defect_types()
+                ensure_rollup()
+                ensure_anomalies()
+                ensure_recommended_rates()
+
+        # After the startup rebuilds, so only request-time queries are guarded
+        from app.services import query_guard
+        query_guard.init_app(app)
 
     return app
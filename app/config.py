@@ -9,3 +9,50 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{BASE_DIR / 'scrap_data.db'}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # One database per plant (app.services.sites); without the file one database is served
+    SITES_FILE = os.environ.get('SCRAP_SITES_FILE', BASE_DIR / 'sites.json')
+    DEFAULT_SITE = os.environ.get('SCRAP_DEFAULT_SITE')     # first site of the file when unset
+    FEDERATION_WORKERS = 4              # sites queried at once by cross-plant views
+
+    # MOSYS enrichment of saved reports (app.services.enrichment)
+    MOSYS_ENRICHMENT_ASYNC = True
+    MOSYS_BATCH_SIZE = 500
+    # Dashboard pages ahead whose rows are enriched in the background (0 disables)
+    MOSYS_PREFETCH_PAGES = 3
+
+    # Parquet snapshot for analytics (app.services.snapshot / app.services.columnar)
+    SNAPSHOT_DIR = BASE_DIR / 'snapshot'
+
+    # Scrap-rate anomaly detection (app.services.anomalies)
+    ANOMALY_ALPHA = 0.1             # EWMA weight of the newest report
+    ANOMALY_Z_THRESHOLD = 3.0       # flag reports this many std devs above the running mean
+    ANOMALY_MIN_SAMPLES = 10        # reports per part/defect type before flagging starts
+    ANOMALY_MIN_STD = 0.005         # floor for the std dev (0.5 pp) so stable series don't flag noise
+
+    # Recommended rate index (app.services.recommended_rates)
+    RECOMMENDED_RATE_PERCENTILE = 50    # percentile of historical parts/hour used as the recommendation
+    RECOMMENDED_RATE_MIN_SAMPLES = 3    # reports per part/instruction before a rate is recommended
+
+    # Per-year archive databases of old reports (app.services.archive / archive_reports.py)
+    ARCHIVE_DIR = BASE_DIR / 'archive'
+    ARCHIVE_AFTER_DAYS = 730
+
+    # Form autocomplete of NC / instruction / part numbers (app.services.autocomplete)
+    AUTOCOMPLETE_MIRROR_REFRESH = 60    # seconds between checks of the MOSYS mirror for new keys
+
+    # NC timeline analytics (app.services.nc_timeline)
+    NC_TIMELINE_MIRROR_REFRESH = 300    # seconds between passes over newly mirrored NOTCOJAN rows
+
+    # Response compression (app.services.compression); brotli is used when installed
+    COMPRESS_ENABLED = True
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 500             # bytes; smaller responses are sent as they are
+
+    # Slow-query log and per-request query budgets (app.services.query_guard)
+    SLOW_QUERY_MS = 200                 # statements at least this slow are logged with their plan
+    SLOW_QUERY_LOG = BASE_DIR / 'logs' / 'slow_queries.jsonl'
+    QUERY_BUDGET_COUNT = 100            # statements per request (None = no limit)
+    QUERY_BUDGET_MS = 2000              # database time per request in ms (None = no limit)
+    QUERY_BUDGET_MODE = 'log'           # 'log' or 'reject' (503 once the budget is spent)
+    QUERY_BUDGET_EXEMPT = ('main.events', 'static', 'dist_asset')
@@ -2,12 +2,34 @@ from app.models.models import (
     DaneRaportu,
     BrakiDefektyRaportu,
     Operator,
-    KategoriaZrodlaDanych
+    KategoriaZrodlaDanych,
+    SekwencjaNumerow,
+    DefektTyp,
+    DefektAlias,
+    RaportDzienny,
+    StatystykaBrakow,
+    ObserwacjaBrakow,
+    AlarmBrakow,
+    WydajnoscZalecana,
+    ZmianaDanych,
+    ArchiwumRaportow,
+    HistoriaNiezgodnosci
 )
 
 __all__ = [
     'DaneRaportu',
     'BrakiDefektyRaportu',
     'Operator',
-    'KategoriaZrodlaDanych'
+    'KategoriaZrodlaDanych',
+    'SekwencjaNumerow',
+    'DefektTyp',
+    'DefektAlias',
+    'RaportDzienny',
+    'StatystykaBrakow',
+    'ObserwacjaBrakow',
+    'AlarmBrakow',
+    'WydajnoscZalecana',
+    'ZmianaDanych',
+    'ArchiwumRaportow',
+    'HistoriaNiezgodnosci'
 ]
@@ -1,3 +1,6 @@
+from sqlalchemy import case
+from sqlalchemy.ext.hybrid import hybrid_property
+
 from app import db
 
 
@@ -8,6 +11,9 @@ class KategoriaZrodlaDanych(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     opis_kategorii = db.Column(db.String, unique=True)
     koszt_pracy = db.Column(db.Float, nullable=True)
+    # Maintained by triggers (app.services.change_log)
+    created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f'<Kategoria {self.opis_kategorii}>'
@@ -22,6 +28,9 @@ class Operator(db.Model):
     imie_nazwisko = db.Column(db.String)
     dzial_id = db.Column(db.Integer, db.ForeignKey('dzialy.id'))
     dzial = db.relationship("KategoriaZrodlaDanych")
+    # Maintained by triggers (app.services.change_log)
+    created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f'<Operator {self.nr_operatora} - {self.imie_nazwisko}>'
@@ -35,7 +44,7 @@ class DaneRaportu(db.Model):
     nr_raportu = db.Column(db.String)
     operator_id = db.Column(db.Integer, db.ForeignKey('operatorzy.id'))
     operator = db.relationship("Operator")
-    nr_niezgodnosci = db.Column(db.String)
+    nr_niezgodnosci = db.Column(db.String, index=True)
     # MOSYS cached data columns
     data_niezgodnosci = db.Column(db.Date, nullable=True)
     nr_zamowienia = db.Column(db.String, nullable=True)
@@ -52,40 +61,232 @@ class DaneRaportu(db.Model):
     czas_pracy = db.Column(db.Float)
     uwagi = db.Column(db.String, nullable=True)
     uwagi_do_wydajnosci = db.Column(db.String, nullable=True)
-    data_selekcji = db.Column(db.Date)
+    data_selekcji = db.Column(db.Date, index=True)
+    # Maintained by triggers (app.services.change_log)
+    created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True, index=True)
 
     @property
     def total_defects(self):
         """Calculate total defects for this report."""
         return sum(d.ilosc for d in self.braki_defekty) if self.braki_defekty else 0
 
-    @property
+    @hybrid_property
     def rzeczywista_wydajnosc(self):
         """Calculate actual performance (parts per hour)."""
         if self.czas_pracy and self.czas_pracy > 0:
             return self.ilosc_detali_sprawdzonych / self.czas_pracy
         return 0
 
-    @property
+    @rzeczywista_wydajnosc.expression
+    def rzeczywista_wydajnosc(cls):
+        return case((cls.czas_pracy > 0, cls.ilosc_detali_sprawdzonych * 1.0 / cls.czas_pracy), else_=0)
+
+    @hybrid_property
     def efektywnosc(self):
         """Calculate efficiency percentage."""
         if self.zalecana_wydajnosc and self.zalecana_wydajnosc > 0 and self.rzeczywista_wydajnosc:
             return (self.rzeczywista_wydajnosc / self.zalecana_wydajnosc) * 100
         return 0
 
+    @efektywnosc.expression
+    def efektywnosc(cls):
+        return case(
+            ((cls.zalecana_wydajnosc > 0) & (cls.czas_pracy > 0),
+             cls.ilosc_detali_sprawdzonych * 100.0 / cls.czas_pracy / cls.zalecana_wydajnosc),
+            else_=0
+        )
+
     def __repr__(self):
         return f'<Raport {self.nr_raportu}>'
 
 
+class SekwencjaNumerow(db.Model):
+    """Counters used to allocate sequential business numbers (e.g. nr_raportu)."""
+    __tablename__ = 'sekwencje'
+
+    nazwa = db.Column(db.String, primary_key=True)
+    wartosc = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<Sekwencja {self.nazwa}={self.wartosc}>'
+
+
+class DefektTyp(db.Model):
+    """Canonical defect type; free-text defect names are interned to these IDs."""
+    __tablename__ = 'defect_types'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nazwa = db.Column(db.String, unique=True, nullable=False)
+    aliasy = db.relationship("DefektAlias", back_populates="typ", cascade="all, delete-orphan")
+
+    def __repr__(self):
+        return f'<DefektTyp {self.nazwa}>'
+
+
+class DefektAlias(db.Model):
+    """Normalized spelling variant mapped to a defect type."""
+    __tablename__ = 'defect_type_aliases'
+
+    id = db.Column(db.Integer, primary_key=True)
+    alias = db.Column(db.String, unique=True, nullable=False)
+    defekt_typ_id = db.Column(db.Integer, db.ForeignKey('defect_types.id'), nullable=False)
+    typ = db.relationship("DefektTyp", back_populates="aliasy")
+
+    def __repr__(self):
+        return f'<DefektAlias {self.alias}>'
+
+
 class BrakiDefektyRaportu(db.Model):
     """Defects/issues related to reports."""
     __tablename__ = 'braki_defekty_raportow'
+    __table_args__ = (
+        # Covering index: defect aggregations per report never touch the table
+        db.Index('ix_braki_raport_typ_ilosc', 'raport_id', 'defekt_typ_id', 'ilosc'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     raport_id = db.Column(db.Integer, db.ForeignKey('dane_z_raportow.id'))
     raport = db.relationship("DaneRaportu", back_populates="braki_defekty")
     defekt = db.Column(db.String)
+    defekt_typ_id = db.Column(db.Integer, db.ForeignKey('defect_types.id'), nullable=True)
+    typ = db.relationship("DefektTyp")
     ilosc = db.Column(db.Integer)
 
     def __repr__(self):
         return f'<Defekt {self.defekt}: {self.ilosc}>'
+
+
+class RaportDzienny(db.Model):
+    """Daily rollup of reports per operator, part and order (app.services.rollup)."""
+    __tablename__ = 'raporty_dzienne'
+    __table_args__ = (
+        db.Index('ix_raporty_dzienne_grain', 'data_selekcji', 'operator_id', 'kod_detalu', 'nr_zamowienia'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    data_selekcji = db.Column(db.Date)
+    operator_id = db.Column(db.Integer)
+    kod_detalu = db.Column(db.String)
+    nr_zamowienia = db.Column(db.String)
+    raporty = db.Column(db.Integer, nullable=False, default=0)
+    ilosc_detali = db.Column(db.Integer, nullable=False, default=0)
+    czas_pracy = db.Column(db.Float, nullable=False, default=0)
+    braki = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<RaportDzienny {self.data_selekcji} op={self.operator_id} {self.kod_detalu}>'
+
+
+class StatystykaBrakow(db.Model):
+    """Running (EWMA) scrap-rate statistics per part or defect type (app.services.anomalies)."""
+    __tablename__ = 'statystyki_brakow'
+
+    rodzaj = db.Column(db.String, primary_key=True)     # 'kod_detalu' or 'defekt'
+    klucz = db.Column(db.String, primary_key=True)      # part code or defect type id
+    n = db.Column(db.Integer, nullable=False, default=0)
+    srednia = db.Column(db.Float, nullable=False, default=0)
+    wariancja = db.Column(db.Float, nullable=False, default=0)
+    ostatni_raport_id = db.Column(db.Integer, nullable=False, default=0)    # last folded report (informational)
+
+    def __repr__(self):
+        return f'<StatystykaBrakow {self.rodzaj}={self.klucz} n={self.n}>'
+
+
+class ObserwacjaBrakow(db.Model):
+    """A report already folded into a series' running statistics (counted once, in any order)."""
+    __tablename__ = 'obserwacje_brakow'
+
+    raport_id = db.Column(db.Integer, primary_key=True)
+    rodzaj = db.Column(db.String, primary_key=True)
+    klucz = db.Column(db.String, primary_key=True)
+
+    def __repr__(self):
+        return f'<ObserwacjaBrakow raport={self.raport_id} {self.rodzaj}={self.klucz}>'
+
+
+class AlarmBrakow(db.Model):
+    """Report whose scrap rate deviated from the running statistics of its part/defect type."""
+    __tablename__ = 'alarmy_brakow'
+    __table_args__ = (
+        db.Index('ix_alarmy_brakow_raport', 'raport_id'),
+        db.Index('ix_alarmy_brakow_data', 'data_selekcji'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    raport_id = db.Column(db.Integer, db.ForeignKey('dane_z_raportow.id'), nullable=False)
+    rodzaj = db.Column(db.String, nullable=False)
+    klucz = db.Column(db.String, nullable=False)
+    data_selekcji = db.Column(db.Date)
+    wskaznik = db.Column(db.Float, nullable=False)      # scrap rate of the report
+    oczekiwany = db.Column(db.Float, nullable=False)    # running mean before the report
+    odchylenie = db.Column(db.Float, nullable=False)    # z-score against the running std dev
+
+    def __repr__(self):
+        return f'<AlarmBrakow raport={self.raport_id} {self.rodzaj}={self.klucz} z={self.odchylenie:.1f}>'
+
+
+class WydajnoscZalecana(db.Model):
+    """Recommended parts/hour per part and instruction, from historical reports (app.services.recommended_rates)."""
+    __tablename__ = 'wydajnosci_zalecane'
+
+    kod_detalu = db.Column(db.String, primary_key=True)     # '' = every part of the instruction
+    nr_instrukcji = db.Column(db.String, primary_key=True)
+    n = db.Column(db.Integer, nullable=False, default=0)
+    p25 = db.Column(db.Float, nullable=False)
+    p50 = db.Column(db.Float, nullable=False)
+    p75 = db.Column(db.Float, nullable=False)
+    zalecana = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<WydajnoscZalecana {self.kod_detalu}/{self.nr_instrukcji}: {self.zalecana:.0f}>'
+
+
+class ZmianaDanych(db.Model):
+    """Append-only change log of reports, operators and departments, written by triggers."""
+    __tablename__ = 'dziennik_zmian'
+    __table_args__ = (
+        db.Index('ix_dziennik_zmian_tabela', 'tabela', 'id'),
+        {'sqlite_autoincrement': True},     # ids are never reused, so they work as a cursor
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tabela = db.Column(db.String, nullable=False)
+    rekord_id = db.Column(db.Integer, nullable=False)
+    operacja = db.Column(db.String, nullable=False)     # 'INSERT', 'UPDATE', 'DELETE' or 'ARCHIVE'
+    zmieniono = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ZmianaDanych {self.id} {self.operacja} {self.tabela}#{self.rekord_id}>'
+
+
+class ArchiwumRaportow(db.Model):
+    """Per-year archive database of old reports and their defects (app.services.archive)."""
+    __tablename__ = 'archiwa_raportow'
+
+    rok = db.Column(db.Integer, primary_key=True)
+    plik = db.Column(db.String, nullable=False)         # file name inside ARCHIVE_DIR
+    od_daty = db.Column(db.Date)
+    do_daty = db.Column(db.Date)
+    raporty = db.Column(db.Integer, nullable=False, default=0)
+    zarchiwizowano = db.Column(db.DateTime)
+    w_toku = db.Column(db.Boolean, nullable=False, default=False)   # set while reports are being moved
+
+    def __repr__(self):
+        return f'<ArchiwumRaportow {self.rok}: {self.raporty}>'
+
+
+class HistoriaNiezgodnosci(db.Model):
+    """Per-NC summary of the mirrored MOSYS notes (NOTCOJAN), kept by app.services.nc_timeline."""
+    __tablename__ = 'historia_niezgodnosci'
+
+    nr_niezgodnosci = db.Column(db.String, primary_key=True)
+    otwarta = db.Column(db.Date)                        # date of the first note
+    ostatni_wpis = db.Column(db.Date)
+    wpisy = db.Column(db.Integer, nullable=False, default=0)
+    nr_zamowienia = db.Column(db.String)                # COMMESSA of the first note
+    kod_detalu = db.Column(db.String)                   # its ARTICOLO
+    ostatni_rowid = db.Column(db.Integer, nullable=False, default=0)   # newest mosys_notcojan rowid read
+
+    def __repr__(self):
+        return f'<HistoriaNiezgodnosci {self.nr_niezgodnosci}: {self.wpisy} wpisów>'
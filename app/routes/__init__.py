@@ -2,5 +2,6 @@ from app.routes.main import bp as main_bp
 from app.routes.reports import bp as reports_bp
 from app.routes.operators import bp as operators_bp
 from app.routes.categories import bp as categories_bp
+from app.routes.analytics import bp as analytics_bp
 
-__all__ = ['main_bp', 'reports_bp', 'operators_bp', 'categories_bp']
+__all__ = ['main_bp', 'reports_bp', 'operators_bp', 'categories_bp', 'analytics_bp']
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context
+from datetime import datetime
+from app.services.filters import ReportFilter
+from app.services.pareto import pareto, next_dimension, DIMENSIONS, DRILL_ORDER
+from app.services import pivot as pivot_engine
+from app.services import anomalies, nc_timeline, kpis
+
+bp = Blueprint('analytics', __name__)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _pareto_args():
+    """Read group_by, drill-down filters (f_<dimension>) and date range from the query string."""
+    group_by = request.args.get('group_by', 'defekt')
+    if group_by not in DIMENSIONS:
+        group_by = 'defekt'
+    filters = {dim: request.args.get(f'f_{dim}') for dim in DIMENSIONS if request.args.get(f'f_{dim}')}
+    return (group_by, filters,
+            _parse_date(request.args.get('date_from')),
+            _parse_date(request.args.get('date_to')))
+
+
+@bp.route('/pareto')
+def pareto_view():
+    """Pareto chart of defects with drill-down."""
+    group_by, filters, date_from, date_to = _pareto_args()
+    data = pareto(group_by, filters, date_from, date_to)
+    return render_template(
+        'analytics/pareto.html',
+        data=data,
+        group_by=group_by,
+        filters=filters,
+        dimensions=DIMENSIONS,
+        drill_order=DRILL_ORDER,
+        drill_to=next_dimension(group_by, filters),
+        date_from=date_from.isoformat() if date_from else '',
+        date_to=date_to.isoformat() if date_to else ''
+    )
+
+
+@bp.route('/api/pareto')
+def api_pareto():
+    """Pareto rows as JSON; same parameters as the page plus optional limit."""
+    group_by, filters, date_from, date_to = _pareto_args()
+    limit = request.args.get('limit', type=int)
+    return jsonify(pareto(group_by, filters, date_from, date_to, limit))
+
+
+def _pivot_args():
+    """Read dims, measures and ReportFilter arguments (no date range means all dates)."""
+    dimensions = [d for d in request.args.get('dims', 'miesiac').split(',') if d]
+    measures = [m for m in request.args.get('measures', 'parts,hours,defects,scrap_pct').split(',') if m]
+    return dimensions, measures, ReportFilter.from_args(request.args, default_preset='all')
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _stream_json(result):
+    names = result['dimensions'] + result['measures']
+    head = {key: result[key] for key in ('dimensions', 'measures', 'source')}
+    yield json.dumps(head, ensure_ascii=False)[:-1] + ', "rows": ['
+    for i, row in enumerate(result['rows']):
+        yield (',' if i else '') + json.dumps(dict(zip(names, row)), ensure_ascii=False, default=_json_default)
+    yield ']}'
+
+
+def _stream_csv(result):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(result['dimensions'] + result['measures'])
+    for i, row in enumerate(result['rows'], 1):
+        writer.writerow(row)
+        if i % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@bp.route('/pivot')
+def pivot_view():
+    """Ad hoc cross-tab builder."""
+    dimensions, measures, report_filter = _pivot_args()
+    try:
+        result = pivot_engine.pivot(dimensions, measures, report_filter)
+        error = None
+    except ValueError as e:
+        result, error = None, str(e)
+    return render_template(
+        'analytics/pivot.html',
+        result=result,
+        error=error,
+        selected_dims=dimensions,
+        selected_measures=measures,
+        dimensions=pivot_engine.DIMENSIONS,
+        measures=pivot_engine.MEASURES,
+        date_from=report_filter.date_from.isoformat() if report_filter.date_from else '',
+        date_to=report_filter.date_to.isoformat() if report_filter.date_to else '',
+        filters=report_filter.text
+    )
+
+
+@bp.route('/api/pivot')
+def api_pivot():
+    """
+    Pivot rows streamed as JSON (default) or CSV (format=csv).
+    Parameters: dims=a,b  measures=x,y  plus the dashboard filter arguments.
+    """
+    dimensions, measures, report_filter = _pivot_args()
+    try:
+        result = pivot_engine.pivot(dimensions, measures, report_filter)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('format') == 'csv':
+        return Response(stream_with_context(_stream_csv(result)), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=pivot.csv'})
+    return Response(stream_with_context(_stream_json(result)), mimetype='application/json')
+
+
+def _anomaly_args():
+    rodzaj = request.args.get('rodzaj')
+    return (_parse_date(request.args.get('date_from')), _parse_date(request.args.get('date_to')),
+            rodzaj if rodzaj in anomalies.KINDS else None)
+
+
+@bp.route('/anomalies')
+def anomalies_view():
+    """Reports whose scrap rate jumped above the running statistics of their part or defect."""
+    date_from, date_to, rodzaj = _anomaly_args()
+    return render_template(
+        'analytics/anomalies.html',
+        alarms=anomalies.recent_alarms(date_from, date_to, rodzaj),
+        kinds=anomalies.KINDS,
+        rodzaj=rodzaj or '',
+        date_from=date_from.isoformat() if date_from else '',
+        date_to=date_to.isoformat() if date_to else ''
+    )
+
+
+@bp.route('/api/anomalies')
+def api_anomalies():
+    """Alarms as JSON; parameters date_from, date_to, rodzaj (kod_detalu/defekt), limit."""
+    date_from, date_to, rodzaj = _anomaly_args()
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    return jsonify(anomalies.recent_alarms(date_from, date_to, rodzaj, limit))
+
+
+def _timeline_args():
+    group_by = request.args.get('group_by', 'kod_detalu')
+    if group_by not in nc_timeline.DIMENSIONS:
+        group_by = 'kod_detalu'
+    return (group_by,
+            _parse_date(request.args.get('date_from')),
+            _parse_date(request.args.get('date_to')),
+            request.args.get('kod_detalu', '').strip() or None,
+            request.args.get('nr_zamowienia', '').strip() or None)
+
+
+@bp.route('/nc-timeline')
+def nc_timeline_view():
+    """Time from NC opening to sorting and sorting duration per part or order."""
+    group_by, date_from, date_to, kod_detalu, nr_zamowienia = _timeline_args()
+    return render_template(
+        'analytics/nc_timeline.html',
+        data=nc_timeline.timeline(group_by, date_from, date_to, kod_detalu, nr_zamowienia, limit=100),
+        group_by=group_by,
+        dimensions=nc_timeline.DIMENSIONS,
+        kod_detalu=kod_detalu or '',
+        nr_zamowienia=nr_zamowienia or '',
+        date_from=date_from.isoformat() if date_from else '',
+        date_to=date_to.isoformat() if date_to else ''
+    )
+
+
+@bp.route('/api/nc-timeline')
+def api_nc_timeline():
+    """Timeline distributions as JSON; same parameters as the page plus optional limit."""
+    group_by, date_from, date_to, kod_detalu, nr_zamowienia = _timeline_args()
+    limit = request.args.get('limit', type=int)
+    return jsonify(nc_timeline.timeline(group_by, date_from, date_to, kod_detalu, nr_zamowienia, limit))
+
+
+@bp.route('/sites')
+def sites_view():
+    """KPIs of every plant's database side by side, with the combined total."""
+    report_filter = ReportFilter.from_args(request.args)
+    return render_template(
+        'analytics/sites.html',
+        data=kpis.federated_kpis(report_filter),
+        preset=report_filter.preset,
+        date_from=report_filter.date_from.isoformat() if report_filter.date_from else '',
+        date_to=report_filter.date_to.isoformat() if report_filter.date_to else ''
+    )
+
+
+@bp.route('/api/sites')
+def api_sites():
+    """Per-site and combined KPIs as JSON; takes the dashboard filter arguments."""
+    return jsonify(kpis.federated_kpis(ReportFilter.from_args(request.args)))
@@ -1,6 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from app import db
-from app.models import KategoriaZrodlaDanych
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from app.models import KategoriaZrodlaDanych, DefektTyp, BrakiDefektyRaportu
+from app.services import anomalies
+from app.services.defect_types import merge_defect_types, add_defect_alias
+from app.services.reference import get_categories
+from app.signals import send_reference_change
 
 bp = Blueprint('categories', __name__)
 
@@ -8,8 +14,7 @@ bp = Blueprint('categories', __name__)
 @bp.route('/')
 def index():
     """List all categories and show add form."""
-    categories = KategoriaZrodlaDanych.query.all()
-    return render_template('categories/index.html', categories=categories)
+    return render_template('categories/index.html', categories=get_categories())
 
 
 @bp.route('/add', methods=['POST'])
@@ -29,6 +34,7 @@ def add():
         )
         db.session.add(category)
         db.session.commit()
+        send_reference_change('dzialy')
         flash('Kategoria dodana pomyślnie!', 'success')
 
     except Exception as e:
@@ -55,6 +61,7 @@ def edit(category_id):
             category.opis_kategorii = opis_kategorii
             category.koszt_pracy = float(koszt_pracy) if koszt_pracy else None
             db.session.commit()
+            send_reference_change('dzialy')
             flash('Kategoria zaktualizowana pomyślnie!', 'success')
             return redirect(url_for('categories.index'))
 
@@ -72,9 +79,60 @@ def delete(category_id):
     try:
         db.session.delete(category)
         db.session.commit()
+        send_reference_change('dzialy')
         flash(f'Kategoria "{category.opis_kategorii}" została usunięta.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Błąd usuwania: {str(e)}', 'error')
     
     return redirect(url_for('categories.index'))
+
+
+@bp.route('/defects')
+def defect_types():
+    """Defect type dictionary with aliases and usage counts."""
+    usage = dict(
+        (typ_id, (rows, qty)) for typ_id, rows, qty in db.session.query(
+            BrakiDefektyRaportu.defekt_typ_id,
+            func.count(BrakiDefektyRaportu.id),
+            func.coalesce(func.sum(BrakiDefektyRaportu.ilosc), 0)
+        ).group_by(BrakiDefektyRaportu.defekt_typ_id)
+    )
+    types = DefektTyp.query.options(selectinload(DefektTyp.aliasy)).order_by(DefektTyp.nazwa).all()
+    return render_template('categories/defect_types.html', types=types, usage=usage)
+
+
+@bp.route('/defects/<int:typ_id>/merge', methods=['POST'])
+def merge_defect_type(typ_id):
+    """Merge a defect type (spelling variant) into another one."""
+    try:
+        target = DefektTyp.query.filter_by(nazwa=(request.form.get('target') or '').strip()).first()
+        if target is None:
+            raise ValueError('Nieznany typ defektu.')
+        target = merge_defect_types(typ_id, target.id)
+        db.session.commit()
+        # The merged type's reports now belong to the target: replay both series as one
+        anomalies.rebuild([('defekt', str(typ_id)), ('defekt', str(target.id))])
+        send_reference_change('defect_types')
+        flash(f'Defekt scalony z "{target.nazwa}".', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Błąd scalania: {str(e)}', 'error')
+
+    return redirect(url_for('categories.defect_types'))
+
+
+@bp.route('/defects/<int:typ_id>/alias', methods=['POST'])
+def add_alias(typ_id):
+    """Add a spelling variant to a defect type."""
+    DefektTyp.query.get_or_404(typ_id)
+    try:
+        add_defect_alias(typ_id, request.form.get('alias'))
+        db.session.commit()
+        send_reference_change('defect_types')
+        flash('Alias dodany pomyślnie!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Błąd: {str(e)}', 'error')
+
+    return redirect(url_for('categories.defect_types'))
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, jsonify, current_app, Response, stream_with_context
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func
-from datetime import datetime, timedelta
 from app import db
-from app.models import DaneRaportu, BrakiDefektyRaportu
+from app.models import DaneRaportu, Operator
+from app.services.enrichment import apply_mosys_data
+from app.services.filters import ReportFilter
+from app.services.prefetch import prefetch_pages
+from app.services import reference, live, change_log, archive, query_guard, kpis
+from app.services.anomalies import alarms_for_reports, series_labels
+from app.signals import send_mosys_enriched
 
 bp = Blueprint('main', __name__)
 
@@ -16,213 +20,143 @@ def index():
     page = request.args.get('page', 1, type=int)
     per_page = 50
     
-    # Sorting params
-    sort_by = request.args.get('sort', 'data_selekcji')
-    order = request.args.get('order', 'desc')
-    
-    # Date range filter with smart defaults
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    preset = request.args.get('preset', 'last_month')  # Default to last month
-    
-    # Apply preset if no custom dates
-    if not date_from and not date_to:
-        today = datetime.now().date()
-        if preset == 'last_week':
-            date_from = today - timedelta(days=7)
-        elif preset == 'last_month':
-            date_from = today - timedelta(days=30)
-        elif preset == 'this_month':
-            # First day of current month
-            date_from = today.replace(day=1)
-        elif preset == 'previous_month':
-            # First day of previous month
-            first_of_this_month = today.replace(day=1)
-            last_of_prev_month = first_of_this_month - timedelta(days=1)
-            date_from = last_of_prev_month.replace(day=1)
-            date_to = last_of_prev_month
-        elif preset == 'last_quarter':
-            date_from = today - timedelta(days=90)
-        elif preset == 'this_year':
-            # First day of current year
-            date_from = today.replace(month=1, day=1)
-        elif preset == 'previous_year':
-            # Previous year (Jan 1 to Dec 31)
-            date_from = today.replace(year=today.year - 1, month=1, day=1)
-            date_to = today.replace(year=today.year - 1, month=12, day=31)
-        elif preset == 'last_year':
-            date_from = today - timedelta(days=365)
-        # preset == 'all' leaves date_from empty
-    else:
-        # Parse custom date strings
-        if date_from:
-            date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
-        if date_to:
-            date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
-    
-    # Text filters
-    filters = {
-        'data_selekcji': date_from if date_from else '',
-        'operator': request.args.get('filter_operator', ''),
-        'nr_raportu': request.args.get('filter_nr_raportu', ''),
-        'nr_niezgodnosci': request.args.get('filter_nr_niezgodnosci', ''),
-        'data_nc': request.args.get('filter_data_nc', ''),
-        'commessa': request.args.get('filter_commessa', ''),
-        'kod_detalu': request.args.get('filter_kod_detalu', ''),
-        'nr_instrukcji': request.args.get('filter_nr_instrukcji', ''),
-    }
+    # Date range (custom or preset), text filters and sorting
+    report_filter = ReportFilter.from_args(request.args)
+    filters = report_filter.template_filters()
     
     # Build query with eager loading to avoid N+1
-    query = DaneRaportu.query.options(
-        joinedload(DaneRaportu.operator),
+    base_query = report_filter.apply(DaneRaportu.query)
+    query = report_filter.order_query(base_query.options(
+        joinedload(DaneRaportu.operator).joinedload(Operator.dzial),
         joinedload(DaneRaportu.braki_defekty)
-    )
-    
-    # Apply date range filter
-    if date_from:
-        query = query.filter(DaneRaportu.data_selekcji >= date_from)
-    if date_to:
-        query = query.filter(DaneRaportu.data_selekcji <= date_to)
-    
-    # Apply text filters
-    if filters['nr_raportu']:
-        query = query.filter(DaneRaportu.nr_raportu.ilike(f"%{filters['nr_raportu']}%"))
-    if filters['nr_niezgodnosci']:
-        query = query.filter(DaneRaportu.nr_niezgodnosci.ilike(f"%{filters['nr_niezgodnosci']}%"))
-    if filters['data_nc']:
-        query = query.filter(DaneRaportu.data_niezgodnosci.ilike(f"%{filters['data_nc']}%"))
-    if filters['commessa']:
-        query = query.filter(DaneRaportu.nr_zamowienia.ilike(f"%{filters['commessa']}%"))
-    if filters['kod_detalu']:
-        query = query.filter(DaneRaportu.kod_detalu.ilike(f"%{filters['kod_detalu']}%"))
-    if filters['nr_instrukcji']:
-        query = query.filter(DaneRaportu.nr_instrukcji.ilike(f"%{filters['nr_instrukcji']}%"))
-    
-    # Apply sorting
-    valid_sort_columns = ['data_selekcji', 'nr_raportu', 'nr_niezgodnosci', 'data_niezgodnosci',
-                          'nr_zamowienia', 'kod_detalu', 'nr_instrukcji', 
-                          'ilosc_detali_sprawdzonych', 'czas_pracy', 'zalecana_wydajnosc']
-    if sort_by in valid_sort_columns:
-        column = getattr(DaneRaportu, sort_by)
-        if order == 'desc':
-            query = query.order_by(column.desc())
-        else:
-            query = query.order_by(column.asc())
-    else:
-        query = query.order_by(DaneRaportu.data_selekcji.desc())
-    
-    # Pre-compute stats with SQL for efficiency (on filtered data)
-    stats_query = db.session.query(
-        func.count(DaneRaportu.id),
-        func.coalesce(func.sum(DaneRaportu.ilosc_detali_sprawdzonych), 0),
-        func.coalesce(func.sum(DaneRaportu.czas_pracy), 0)
-    )
-    
-    # Apply same date filters to stats
-    if date_from:
-        stats_query = stats_query.filter(DaneRaportu.data_selekcji >= date_from)
-    if date_to:
-        stats_query = stats_query.filter(DaneRaportu.data_selekcji <= date_to)
-    
-    # Apply same text filters to stats
-    if filters['nr_raportu']:
-        stats_query = stats_query.filter(DaneRaportu.nr_raportu.ilike(f"%{filters['nr_raportu']}%"))
-    if filters['nr_niezgodnosci']:
-        stats_query = stats_query.filter(DaneRaportu.nr_niezgodnosci.ilike(f"%{filters['nr_niezgodnosci']}%"))
-    if filters['data_nc']:
-        stats_query = stats_query.filter(DaneRaportu.data_niezgodnosci.ilike(f"%{filters['data_nc']}%"))
-    if filters['commessa']:
-        stats_query = stats_query.filter(DaneRaportu.nr_zamowienia.ilike(f"%{filters['commessa']}%"))
-    if filters['kod_detalu']:
-        stats_query = stats_query.filter(DaneRaportu.kod_detalu.ilike(f"%{filters['kod_detalu']}%"))
-    if filters['nr_instrukcji']:
-        stats_query = stats_query.filter(DaneRaportu.nr_instrukcji.ilike(f"%{filters['nr_instrukcji']}%"))
-    
-    stats_result = stats_query.first()
-    
-    # Get total defects with SQL (sum from braki_defekty_raportow)
-    defects_query = db.session.query(
-        func.coalesce(func.sum(BrakiDefektyRaportu.ilosc), 0)
-    ).join(DaneRaportu, BrakiDefektyRaportu.raport_id == DaneRaportu.id)
-    
-    # Apply same date filters to defects
-    if date_from:
-        defects_query = defects_query.filter(DaneRaportu.data_selekcji >= date_from)
-    if date_to:
-        defects_query = defects_query.filter(DaneRaportu.data_selekcji <= date_to)
-    
-    # Apply same text filters to defects
-    if filters['nr_raportu']:
-        defects_query = defects_query.filter(DaneRaportu.nr_raportu.ilike(f"%{filters['nr_raportu']}%"))
-    if filters['nr_niezgodnosci']:
-        defects_query = defects_query.filter(DaneRaportu.nr_niezgodnosci.ilike(f"%{filters['nr_niezgodnosci']}%"))
-    if filters['data_nc']:
-        defects_query = defects_query.filter(DaneRaportu.data_niezgodnosci.ilike(f"%{filters['data_nc']}%"))
-    if filters['commessa']:
-        defects_query = defects_query.filter(DaneRaportu.nr_zamowienia.ilike(f"%{filters['commessa']}%"))
-    if filters['kod_detalu']:
-        defects_query = defects_query.filter(DaneRaportu.kod_detalu.ilike(f"%{filters['kod_detalu']}%"))
-    if filters['nr_instrukcji']:
-        defects_query = defects_query.filter(DaneRaportu.nr_instrukcji.ilike(f"%{filters['nr_instrukcji']}%"))
-    
-    total_defects = defects_query.scalar() or 0
+    ))
     
-    # Calculate averages
-    avg_scrap_rate = 0
-    avg_productivity = 0
+    # Archived years are included only when the date range reaches them
+    with archive.scope(report_filter.date_from, report_filter.date_to) as archived:
+        # Pre-compute stats with SQL for efficiency (on filtered data)
+        stats = kpis.derive(kpis.totals(report_filter))
     
-    if stats_result[0] > 0:  # If there are any reports
-        # Average scrap rate = (total defects / total parts checked) * 100
-        if stats_result[1] > 0:
-            avg_scrap_rate = (total_defects / stats_result[1]) * 100
+        # Paginate results
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
         
-        # Average productivity = total parts checked / total hours worked
-        if stats_result[2] > 0:
-            avg_productivity = stats_result[1] / stats_result[2]
-    
-    stats = {
-        'count': stats_result[0],
-        'parts_checked': stats_result[1],
-        'hours_worked': stats_result[2],
-        'total_defects': total_defects,
-        'average_scrap_rate': avg_scrap_rate,
-        'average_productivity': avg_productivity
-    }
-    
-    # Paginate results
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Warm the next pages in the background
+        prefetch_pages(report_filter, base_query, page, per_page)
+        
+        # Archived reports are read-only
+        live = archive.live_ids(r.id for r in pagination.items) if archived else None
     
     # Lazy load missing MOSYS data
     reports_needing_mosys = [r for r in pagination.items 
-                             if r.data_niezgodnosci is None and r.nr_niezgodnosci]
+                             if r.data_niezgodnosci is None and r.nr_niezgodnosci
+                             and (live is None or r.id in live)]
     
     if reports_needing_mosys:
         try:
             from MOSYS_data_functions import get_batch_niezgodnosc_details
             nr_list = [r.nr_niezgodnosci for r in reports_needing_mosys]
             mosys_data = get_batch_niezgodnosc_details(nr_list)
-            
-            for report in reports_needing_mosys:
-                if report.nr_niezgodnosci in mosys_data:
-                    data = mosys_data[report.nr_niezgodnosci]
-                    report.data_niezgodnosci = data.get('data_niezgodnosci')
-                    report.nr_zamowienia = data.get('nr_zamowienia')
-                    report.kod_detalu = data.get('kod_detalu')
+            updated = apply_mosys_data(reports_needing_mosys, mosys_data)
             
             db.session.commit()
+            send_mosys_enriched(r.nr_niezgodnosci for r in updated)
         except Exception as e:
             print(f"MOSYS lazy load error: {e}")
             db.session.rollback()
     
+    # Scrap-rate alarms of the rows on this page
+    alarms = alarms_for_reports(r.id for r in pagination.items)
+    
     return render_template(
         'dashboard/index.html',
         reports=pagination.items,
         pagination=pagination,
+        alarms=alarms,
+        alarm_labels=series_labels([a for items in alarms.values() for a in items]),
         stats=stats,
-        sort_by=sort_by,
-        order=order,
+        sort_by=report_filter.sort_by,
+        order=report_filter.order,
         filters=filters,
-        preset=preset,
-        date_from=date_from.isoformat() if isinstance(date_from, datetime) or hasattr(date_from, 'isoformat') else '',
-        date_to=date_to.isoformat() if isinstance(date_to, datetime) or hasattr(date_to, 'isoformat') else ''
+        preset=report_filter.preset,
+        date_from=report_filter.date_from.isoformat() if report_filter.date_from else '',
+        date_to=report_filter.date_to.isoformat() if report_filter.date_to else ''
     )
+
+
+@bp.route('/mosys/status')
+def mosys_status():
+    """MOSYS source order, per-source hit counters, breaker state and mirror staleness as JSON."""
+    status = {}
+    try:
+        import MOSYS_data_functions as mosys
+        status['source_order'] = mosys.MOSYS_SOURCE_ORDER
+        status['sources'] = mosys.SOURCE_STATS
+        status['breaker'] = mosys.BREAKER.stats()
+    except Exception as e:
+        status['error'] = str(e)
+    try:
+        from mosys_mirror import mirror_stats
+        status['mirror'] = mirror_stats()
+    except Exception as e:
+        status['mirror_error'] = str(e)
+    return jsonify(status)
+
+
+@bp.route('/query-log')
+def query_log():
+    """Recent slow queries and query-budget overruns of this process as JSON (?kind=slow|budget)."""
+    kind = request.args.get('kind')
+    return jsonify(query_guard.recent(request.args.get('limit', 50, type=int),
+                                      kind if kind in ('slow', 'budget') else None))
+
+
+@bp.route('/api/reference')
+def api_reference():
+    """Operators and departments for browser-side selects; cacheable via ETag."""
+    tag = reference.etag()
+    if request.if_none_match.contains(tag):
+        response = current_app.response_class(status=304)
+    else:
+        tag, payload = reference.as_json()
+        response = jsonify(payload)
+    response.set_etag(tag)
+    response.cache_control.no_cache = True
+    # The site comes from a cookie, so the same URL serves every plant
+    response.vary.add('Cookie')
+    return response
+
+
+@bp.route('/api/events')
+def events():
+    """
+    Server-Sent Events for the dashboard: report changes with KPI deltas for
+    the filter in the query string (same arguments as the dashboard) and
+    MOSYS enrichment of visible rows. Resumes from Last-Event-ID.
+    """
+    report_filter = ReportFilter.from_args(request.args)
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+    return Response(
+        stream_with_context(live.stream(report_filter, last_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@bp.route('/api/changes')
+def changes():
+    """
+    Change feed: log entries after the `since` cursor (0 = from the start,
+    'latest' = only the current cursor), optionally limited to `tables`
+    (comma-separated: dane_z_raportow, operatorzy, dzialy). Timestamps are UTC.
+    """
+    since = request.args.get('since', '0')
+    if since == 'latest':
+        return jsonify({'changes': [], 'cursor': change_log.latest_cursor(), 'has_more': False})
+    if not since.isdigit():
+        return jsonify({'error': 'Parametr since musi być liczbą lub "latest".'}), 400
+    tables = [t for t in request.args.get('tables', '').split(',') if t]
+    unknown = [t for t in tables if t not in change_log.TABLES]
+    if unknown:
+        return jsonify({'error': f'Nieznane tabele: {", ".join(unknown)}'}), 400
+    limit = request.args.get('limit', 500, type=int)
+    return jsonify(change_log.changes_since(int(since), tables, limit))
@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from app import db
-from app.models import Operator, KategoriaZrodlaDanych
+from app.models import Operator
+from app.services.operator_stats import get_operator_ranking, WINDOWS, DEFAULT_WINDOW
+from app.services.reference import get_operators, get_categories
+from app.signals import send_reference_change
 
 bp = Blueprint('operators', __name__)
 
@@ -8,9 +11,22 @@ bp = Blueprint('operators', __name__)
 @bp.route('/')
 def index():
     """List all operators and show add form."""
-    operators = Operator.query.all()
-    categories = KategoriaZrodlaDanych.query.all()
-    return render_template('operators/index.html', operators=operators, categories=categories)
+    return render_template('operators/index.html', operators=get_operators(), categories=get_categories())
+
+
+@bp.route('/ranking')
+def ranking():
+    """Operator productivity leaderboard for a rolling window."""
+    window = request.args.get('window', DEFAULT_WINDOW, type=int)
+    data = get_operator_ranking(window)
+    return render_template('operators/ranking.html', data=data, windows=WINDOWS)
+
+
+@bp.route('/api/ranking')
+def api_ranking():
+    """Leaderboard as JSON: ?window=7|30|90."""
+    window = request.args.get('window', DEFAULT_WINDOW, type=int)
+    return jsonify(get_operator_ranking(window))
 
 
 @bp.route('/add', methods=['POST'])
@@ -32,6 +48,7 @@ def add():
         )
         db.session.add(operator)
         db.session.commit()
+        send_reference_change('operatorzy')
         flash('Operator dodany pomyślnie!', 'success')
 
     except Exception as e:
@@ -45,7 +62,7 @@ def add():
 def edit(operator_id):
     """Edit an operator."""
     operator = Operator.query.get_or_404(operator_id)
-    categories = KategoriaZrodlaDanych.query.all()
+    categories = get_categories()
     
     if request.method == 'POST':
         try:
@@ -61,6 +78,7 @@ def edit(operator_id):
             operator.imie_nazwisko = imie_nazwisko
             operator.dzial_id = int(dzial_id)
             db.session.commit()
+            send_reference_change('operatorzy')
             flash('Operator zaktualizowany pomyślnie!', 'success')
             return redirect(url_for('operators.index'))
 
@@ -78,6 +96,7 @@ def delete(operator_id):
     try:
         db.session.delete(operator)
         db.session.commit()
+        send_reference_change('operatorzy')
         flash(f'Operator {operator.imie_nazwisko} został usunięty.', 'success')
     except Exception as e:
         db.session.rollback()
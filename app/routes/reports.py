@@ -1,7 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 from app import db
 from app.models import DaneRaportu, BrakiDefektyRaportu, Operator
+from app.services import archive, autocomplete, enrichment, recommended_rates
+from app.services.bulk_reports import parse_report_row, bulk_create_reports
+from app.services.defect_types import resolve_defect_types
+from app.services.numbering import allocate_report_numbers
+from app.services.reference import get_operators, get_operator_ids
+from app.services.report_changes import apply_report_edit, report_snapshot
+from app.signals import ReportChange, send_report_changes
 
 bp = Blueprint('reports', __name__)
 
@@ -9,46 +17,55 @@ bp = Blueprint('reports', __name__)
 @bp.route('/<int:report_id>')
 def view(report_id):
     """View single report details."""
-    report = DaneRaportu.query.get_or_404(report_id)
-    
-    # Get related reports with same nr_niezgodnosci
-    related_reports = []
-    if report.nr_niezgodnosci:
-        related_reports = DaneRaportu.query.filter(
-            DaneRaportu.nr_niezgodnosci == report.nr_niezgodnosci,
-            DaneRaportu.id != report.id
-        ).order_by(DaneRaportu.data_selekcji.desc()).all()
+    # Archived reports (and related ones in archived years) are read through the archive
+    with archive.scope() as archived:
+        report = DaneRaportu.query.get_or_404(report_id)
     
-    # Calculate aggregate stats for this report + related reports
-    all_reports = [report] + related_reports
-    parts_checked = sum(r.ilosc_detali_sprawdzonych or 0 for r in all_reports)
-    hours_worked = sum(r.czas_pracy or 0 for r in all_reports)
-    total_defects = sum(r.total_defects or 0 for r in all_reports)
+        # Get related reports with same nr_niezgodnosci
+        related_reports = []
+        if report.nr_niezgodnosci:
+            related_reports = DaneRaportu.query.options(
+                joinedload(DaneRaportu.operator).joinedload(Operator.dzial),
+                joinedload(DaneRaportu.braki_defekty)
+            ).filter(
+                DaneRaportu.nr_niezgodnosci == report.nr_niezgodnosci,
+                DaneRaportu.id != report.id
+            ).order_by(DaneRaportu.data_selekcji.desc()).all()
     
-    # Calculate averages
-    avg_scrap_rate = (total_defects / parts_checked * 100) if parts_checked > 0 else 0
-    avg_productivity = (parts_checked / hours_worked) if hours_worked > 0 else 0
+        # Calculate aggregate stats for this report + related reports
+        all_reports = [report] + related_reports
+        parts_checked = sum(r.ilosc_detali_sprawdzonych or 0 for r in all_reports)
+        hours_worked = sum(r.czas_pracy or 0 for r in all_reports)
+        total_defects = sum(r.total_defects or 0 for r in all_reports)
     
-    stats = {
-        'parts_checked': parts_checked,
-        'total_defects': total_defects,
-        'hours_worked': hours_worked,
-        'average_scrap_rate': avg_scrap_rate,
-        'average_productivity': avg_productivity
-    }
+        # Calculate averages
+        avg_scrap_rate = (total_defects / parts_checked * 100) if parts_checked > 0 else 0
+        avg_productivity = (parts_checked / hours_worked) if hours_worked > 0 else 0
     
-    # Fetch NC history from MOSYS
-    nc_history = []
-    if report.nr_niezgodnosci:
-        try:
-            from MOSYS_data_functions import get_nc_history
-            nc_history = get_nc_history(report.nr_niezgodnosci)
-        except Exception as e:
-            import traceback
-            print(f"Error fetching NC history: {e}")
-            print(traceback.format_exc())
+        stats = {
+            'parts_checked': parts_checked,
+            'total_defects': total_defects,
+            'hours_worked': hours_worked,
+            'average_scrap_rate': avg_scrap_rate,
+            'average_productivity': avg_productivity
+        }
     
-    return render_template('reports/view.html', report=report, related_reports=related_reports, stats=stats, nc_history=nc_history)
+        # Fetch NC history from MOSYS
+        nc_history = []
+        if report.nr_niezgodnosci:
+            try:
+                from MOSYS_data_functions import get_nc_history
+                nc_history = get_nc_history(report.nr_niezgodnosci)
+            except Exception as e:
+                import traceback
+                print(f"Error fetching NC history: {e}")
+                print(traceback.format_exc())
+        
+        # Archived reports are read-only
+        read_only = archived and report.id not in archive.live_ids([report.id])
+        
+        return render_template('reports/view.html', report=report, related_reports=related_reports,
+                               stats=stats, nc_history=nc_history, read_only=read_only)
 
 
 @bp.route('/create', methods=['GET', 'POST'])
@@ -56,14 +73,8 @@ def create():
     """Create new report form."""
     if request.method == 'POST':
         try:
-            # Get next report number
-            max_report = db.session.query(DaneRaportu).order_by(DaneRaportu.id.desc()).first()
-            if max_report and max_report.nr_raportu and max_report.nr_raportu.isdigit():
-                next_nr = int(max_report.nr_raportu) + 1
-            elif max_report:
-                next_nr = max_report.id + 1
-            else:
-                next_nr = 1
+            # Reserve next report number (atomic, see app.services.numbering)
+            next_nr = allocate_report_numbers(1)
 
             # Parse date
             data_selekcji = None
@@ -91,16 +102,22 @@ def create():
             defekt_names = request.form.getlist('defekt_nazwa[]')
             defekt_ilosci = request.form.getlist('defekt_ilosc[]')
             
+            type_ids = resolve_defect_types(defekt_names)
+            defects = []
             for name, ilosc in zip(defekt_names, defekt_ilosci):
                 if name and ilosc:
                     defekt = BrakiDefektyRaportu(
                         raport_id=report.id,
                         defekt=name,
+                        defekt_typ_id=type_ids.get(name),
                         ilosc=int(ilosc)
                     )
                     db.session.add(defekt)
+                    defects.append((name, int(ilosc)))
 
+            change = ReportChange('created', report.id, after=report_snapshot(report, defects))
             db.session.commit()
+            send_report_changes([change])
             flash(f'Raport #{next_nr} został pomyślnie zapisany!', 'success')
             return redirect(url_for('main.index'))
 
@@ -108,10 +125,132 @@ def create():
             db.session.rollback()
             flash(f'Błąd zapisu do bazy danych: {str(e)}', 'error')
 
-    operators = Operator.query.all()
+    operators = get_operators()
     return render_template('reports/create.html', operators=operators)
 
 
+BULK_FORM_FIELDS = (
+    'operator_id', 'data_selekcji', 'nr_niezgodnosci', 'nr_instrukcji',
+    'selekcja_na_biezaco', 'ilosc_detali_sprawdzonych', 'zalecana_wydajnosc',
+    'czas_pracy', 'defekty', 'uwagi', 'uwagi_do_wydajnosci'
+)
+
+
+def _save_bulk(rows):
+    """
+    Validate and insert many reports in one transaction.
+    Returns (created, errors); errors maps row index -> list of messages.
+    """
+    operator_ids = get_operator_ids()
+    parsed = []
+    errors = {}
+    for idx, row in enumerate(rows):
+        values, defects, row_errors = parse_report_row(row, operator_ids)
+        if row_errors:
+            errors[idx] = row_errors
+        parsed.append((values, defects))
+
+    if errors or not parsed:
+        return [], errors
+
+    created = bulk_create_reports(parsed)
+    db.session.commit()
+    send_report_changes([
+        ReportChange('created', report_id,
+                     after=report_snapshot(dict(values, id=report_id, nr_raportu=nr), defects))
+        for (report_id, nr), (values, defects) in zip(created, parsed)
+    ])
+
+    # One batch for all NCs of the submission, resolved in the background
+    enrichment.enqueue([values['nr_niezgodnosci'] for values, _ in parsed])
+    return created, errors
+
+
+@bp.route('/bulk', methods=['GET', 'POST'])
+def bulk():
+    """Enter many reports at once (end-of-shift entry)."""
+    rows = []
+    errors = {}
+    if request.method == 'POST':
+        columns = {field: request.form.getlist(f'{field}[]') for field in BULK_FORM_FIELDS}
+        count = max(len(values) for values in columns.values())
+        for idx in range(count):
+            row = {field: (values[idx] if idx < len(values) else '') for field, values in columns.items()}
+            # Skip untouched rows (operator and date are pre-filled from the previous row)
+            if any(row[field] for field in BULK_FORM_FIELDS
+                   if field not in ('operator_id', 'data_selekcji', 'selekcja_na_biezaco')):
+                rows.append(row)
+
+        try:
+            created, errors = _save_bulk(rows)
+            if created:
+                flash(f'Zapisano {len(created)} raportów (#{created[0][1]} - #{created[-1][1]}).', 'success')
+                return redirect(url_for('main.index'))
+            if not rows:
+                flash('Nie wprowadzono żadnych raportów.', 'error')
+            else:
+                flash(f'Popraw błędy w {len(errors)} wierszach - nic nie zostało zapisane.', 'error')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Błąd zapisu do bazy danych: {str(e)}', 'error')
+
+    operators = get_operators()
+    return render_template('reports/bulk.html', operators=operators, rows=rows, errors=errors)
+
+
+@bp.route('/api/bulk', methods=['POST'])
+def api_bulk():
+    """
+    JSON bulk create: {"reports": [{...report fields..., "defekty": [{"defekt", "ilosc"}]}]}.
+    All-or-nothing; returns 201 with created numbers or 400 with per-row errors.
+    """
+    payload = request.get_json(silent=True) or {}
+    rows = payload.get('reports')
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'error': 'Oczekiwano niepustej listy "reports".'}), 400
+
+    try:
+        created, errors = _save_bulk(rows)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Błąd zapisu do bazy danych: {str(e)}'}), 500
+
+    if errors:
+        return jsonify({'errors': {str(idx): msgs for idx, msgs in errors.items()}}), 400
+    return jsonify({
+        'created': [{'id': report_id, 'nr_raportu': nr} for report_id, nr in created]
+    }), 201
+
+
+@bp.route('/api/recommended-rate')
+def api_recommended_rate():
+    """Recommended parts/hour for nr_instrukcji (+ kod_detalu or nr_niezgodnosci); 404 when unknown."""
+    result = recommended_rates.lookup(
+        request.args.get('nr_instrukcji', '').strip(),
+        kod_detalu=request.args.get('kod_detalu', '').strip() or None,
+        nr_niezgodnosci=request.args.get('nr_niezgodnosci', '').strip() or None,
+    )
+    if result is None:
+        return jsonify({'error': 'Brak danych historycznych.'}), 404
+    return jsonify(result)
+
+
+@bp.route('/api/autocomplete/<field>')
+def api_autocomplete(field):
+    """Known nr_niezgodnosci / nr_instrukcji / kod_detalu values starting with ?q=."""
+    try:
+        items = autocomplete.suggest(field, request.args.get('q', ''), request.args.get('limit', 10, type=int))
+    except KeyError:
+        return jsonify({'error': f'Nieznane pole: {field}'}), 404
+    return jsonify({'field': field, 'items': items})
+
+
+@bp.route('/api/nc-check')
+def api_nc_check():
+    """Whether MOSYS knows ?nr= (known: true / false / null when MOSYS is unavailable)."""
+    return jsonify(autocomplete.check_nc(request.args.get('nr', '')))
+
+
 @bp.route('/<int:report_id>/edit', methods=['GET', 'POST'])
 def edit(report_id):
     """Edit existing report."""
@@ -119,36 +258,32 @@ def edit(report_id):
     
     if request.method == 'POST':
         try:
-            # Update report fields
+            values = {
+                'operator_id': int(request.form['operator_id']) if request.form.get('operator_id') else None,
+                'nr_niezgodnosci': request.form.get('nr_niezgodnosci', ''),
+                'nr_instrukcji': request.form.get('nr_instrukcji', ''),
+                'selekcja_na_biezaco': request.form.get('selekcja_na_biezaco') == 'on',
+                'ilosc_detali_sprawdzonych': int(request.form.get('ilosc_detali_sprawdzonych', 0)),
+                'zalecana_wydajnosc': float(request.form['zalecana_wydajnosc']) if request.form.get('zalecana_wydajnosc') else None,
+                'czas_pracy': float(request.form.get('czas_pracy', 0)),
+                'uwagi': request.form.get('uwagi', ''),
+                'uwagi_do_wydajnosci': request.form.get('uwagi_do_wydajnosci', ''),
+            }
             if request.form.get('data_selekcji'):
-                report.data_selekcji = datetime.strptime(request.form['data_selekcji'], '%Y-%m-%d').date()
-            
-            report.operator_id = int(request.form['operator_id']) if request.form.get('operator_id') else None
-            report.nr_niezgodnosci = request.form.get('nr_niezgodnosci', '')
-            report.nr_instrukcji = request.form.get('nr_instrukcji', '')
-            report.selekcja_na_biezaco = request.form.get('selekcja_na_biezaco') == 'on'
-            report.ilosc_detali_sprawdzonych = int(request.form.get('ilosc_detali_sprawdzonych', 0))
-            report.zalecana_wydajnosc = float(request.form['zalecana_wydajnosc']) if request.form.get('zalecana_wydajnosc') else None
-            report.czas_pracy = float(request.form.get('czas_pracy', 0))
-            report.uwagi = request.form.get('uwagi', '')
-            report.uwagi_do_wydajnosci = request.form.get('uwagi_do_wydajnosci', '')
-
-            # Update defects - remove old ones and add new
-            BrakiDefektyRaportu.query.filter_by(raport_id=report.id).delete()
-            
+                values['data_selekcji'] = datetime.strptime(request.form['data_selekcji'], '%Y-%m-%d').date()
+
             defekt_names = request.form.getlist('defekt_nazwa[]')
             defekt_ilosci = request.form.getlist('defekt_ilosc[]')
-            
-            for name, ilosc in zip(defekt_names, defekt_ilosci):
-                if name and ilosc:
-                    defekt = BrakiDefektyRaportu(
-                        raport_id=report.id,
-                        defekt=name,
-                        ilosc=int(ilosc)
-                    )
-                    db.session.add(defekt)
+            defects = [(name, int(ilosc)) for name, ilosc in zip(defekt_names, defekt_ilosci) if name and ilosc]
+
+            # Write only what differs from the stored report
+            change = apply_report_edit(report, values, defects)
+            if change is None:
+                flash(f'Raport #{report.nr_raportu} - brak zmian do zapisania.', 'info')
+                return redirect(url_for('main.index'))
 
             db.session.commit()
+            send_report_changes([change])
             flash(f'Raport #{report.nr_raportu} został zaktualizowany!', 'success')
             return redirect(url_for('main.index'))
 
@@ -156,7 +291,7 @@ def edit(report_id):
             db.session.rollback()
             flash(f'Błąd zapisu: {str(e)}', 'error')
 
-    operators = Operator.query.all()
+    operators = get_operators()
     return render_template('reports/edit.html', report=report, operators=operators)
 
 
@@ -165,8 +300,10 @@ def delete(report_id):
     """Delete a report."""
     report = DaneRaportu.query.get_or_404(report_id)
     try:
+        change = ReportChange('deleted', report.id, before=report_snapshot(report))
         db.session.delete(report)
         db.session.commit()
+        send_report_changes([change])
         flash(f'Raport #{report.nr_raportu} został usunięty.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,77 @@
+"""
+Startup schema upgrades for existing SQLite databases.
+
+db.create_all() only creates missing tables. Nullable columns and indexes
+added to models later are applied here, so an existing scrap_data.db keeps
+working without running a migration script first. Data migrations still
+live in the migrate_*.py scripts.
+"""
+from sqlalchemy import inspect, text
+
+
+# Indexes replaced by later ones (e.g. by migrate_defect_types.py); dropped on upgrade
+OBSOLETE_INDEXES = ('ix_braki_raport_defekt_ilosc',)
+
+
+def _column_ddl(column, dialect):
+    ddl = f'{column.name} {column.type.compile(dialect)}'
+    for fk in column.foreign_keys:
+        ddl += f' REFERENCES {fk.column.table.name} ({fk.column.name})'
+    return ddl
+
+
+def _snapshot(engine, backup_dir=None):
+    """Pre-migration backup of a file database (see db_backup.py); a failure is reported, not fatal."""
+    if not engine.url.database or engine.url.database == ':memory:':
+        return
+    try:
+        from db_backup import snapshot_before
+        snapshot_before('migration', db_path=engine.url.database, backup_dir=backup_dir)
+    except Exception as e:
+        print(f"Pre-migration snapshot error: {e}")
+
+
+def upgrade_schema(engine, metadata, backup_dir=None):
+    """
+    Create missing tables, add missing nullable columns, create missing indexes
+    and drop obsolete ones. When an existing database is about to change, a
+    pre-migration snapshot goes to backup_dir (default db_backup.BACKUP_DIR)
+    before the first DDL statement.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    pending = False
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            pending = True
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(
+                    f'Kolumna {table.name}.{column.name} wymaga migracji (NOT NULL).'
+                )
+            missing.append((table, column))
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        pending = pending or any(index.name not in indexes for index in table.indexes) \
+            or any(name in indexes for name in OBSOLETE_INDEXES)
+
+    if tables and (missing or pending):
+        _snapshot(engine, backup_dir)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table, column in missing:
+            conn.execute(text(
+                f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, engine.dialect)}'
+            ))
+            print(f'Schema: added column {table.name}.{column.name}')
+
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
@@ -0,0 +1 @@
+"""Domain services shared by routes and maintenance scripts."""
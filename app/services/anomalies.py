@@ -0,0 +1,339 @@
+"""
+Scrap-rate anomaly detection.
+
+A report's scrap rate (defects / parts checked) is compared with running
+statistics of its part (kod_detalu) and, for every defect type it lists,
+with the rate of that defect in earlier reports where it was recorded.
+The statistics are an exponentially weighted mean and variance per series
+(statystyki_brakow), so each new report costs O(1) per series instead of
+a pass over history. Reports more than ANOMALY_Z_THRESHOLD standard
+deviations above the mean are stored in alarmy_brakow.
+
+kod_detalu only arrives from MOSYS after a report is saved, so part series
+are fed on mosys_enriched, in whatever order enrichment finishes;
+obserwacje_brakow records each (report, series) pair already folded, so a
+report is counted exactly once however late it arrives. rebuild() replays
+all reports (or some series, e.g. after a defect-type merge) in id order
+(backfill, or after changing the ANOMALY_* settings).
+"""
+import math
+import threading
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+from app import db
+from app.models import DaneRaportu, BrakiDefektyRaportu, DefektTyp, StatystykaBrakow, ObserwacjaBrakow, AlarmBrakow
+from app.services import archive
+from app.signals import report_changed, mosys_enriched
+
+KINDS = {
+    'kod_detalu': 'Kod detalu',
+    'defekt': 'Defekt',
+}
+
+# Serializes read-modify-write of the running statistics within the process
+_lock = threading.Lock()
+
+
+def _params():
+    config = current_app.config
+    return (config.get('ANOMALY_ALPHA', 0.1), config.get('ANOMALY_Z_THRESHOLD', 3.0),
+            config.get('ANOMALY_MIN_SAMPLES', 10), config.get('ANOMALY_MIN_STD', 0.005))
+
+
+def _score(state, rate, params):
+    """z-score of `rate` against the state when it is an anomaly, else None."""
+    _, threshold, min_samples, min_std = params
+    if state.n < min_samples:
+        return None
+    z = (rate - state.srednia) / max(math.sqrt(state.wariancja), min_std)
+    return z if z >= threshold else None
+
+
+def _fold(state, report_id, rate, params):
+    """Add one observation to the exponentially weighted mean/variance."""
+    alpha = params[0]
+    if state.n == 0:
+        state.srednia, state.wariancja = rate, 0.0
+    else:
+        diff = rate - state.srednia
+        increment = alpha * diff
+        state.srednia += increment
+        state.wariancja = (1 - alpha) * (state.wariancja + diff * increment)
+    state.n += 1
+    state.ostatni_raport_id = report_id
+
+
+def _new_state(rodzaj, klucz):
+    return StatystykaBrakow(rodzaj=rodzaj, klucz=klucz, n=0, srednia=0.0, wariancja=0.0, ostatni_raport_id=0)
+
+
+def _report_rows(condition=None):
+    """
+    Yield (id, kod_detalu, data_selekcji, parts, {defekt_typ_id: ilosc}) in id order,
+    streamed in one pass over reports left-joined with their summed defects.
+    """
+    query = select(
+        DaneRaportu.id, DaneRaportu.kod_detalu, DaneRaportu.data_selekcji,
+        DaneRaportu.ilosc_detali_sprawdzonych,
+        BrakiDefektyRaportu.defekt_typ_id, func.sum(BrakiDefektyRaportu.ilosc),
+    ).outerjoin(
+        BrakiDefektyRaportu, BrakiDefektyRaportu.raport_id == DaneRaportu.id
+    ).group_by(DaneRaportu.id, BrakiDefektyRaportu.defekt_typ_id).order_by(DaneRaportu.id)
+    if condition is not None:
+        query = query.where(condition)
+    rows = db.session.execute(query.execution_options(yield_per=2000))
+    for report_id, group in groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        _, kod_detalu, data_selekcji, parts = group[0][:4]
+        defects = {typ_id: qty or 0 for *_, typ_id, qty in group if qty}
+        yield report_id, kod_detalu, data_selekcji, parts, defects
+
+
+def _series(row, kinds):
+    """(rodzaj, klucz, rate) of every series a report belongs to."""
+    _, kod_detalu, _, parts, defects = row
+    if not parts or parts <= 0:
+        return []
+    series = []
+    if 'kod_detalu' in kinds and kod_detalu:
+        series.append(('kod_detalu', kod_detalu, sum(defects.values()) / parts))
+    if 'defekt' in kinds:
+        series.extend(('defekt', str(typ_id), qty / parts)
+                      for typ_id, qty in defects.items() if typ_id is not None)
+    return series
+
+
+def _process(rows, get_state, params, observed, kinds=tuple(KINDS), only=None):
+    """
+    Score and fold each report row into the series it hasn't been folded into
+    yet (`observed`: {(raport_id, rodzaj, klucz)}, updated in place), limited
+    to the `only` series when given. Returns (new AlarmBrakow objects, new
+    observation keys).
+    """
+    alarms = []
+    folded = []
+    for row in rows:
+        report_id, _, data_selekcji = row[:3]
+        for rodzaj, klucz, rate in _series(row, kinds):
+            key = (report_id, rodzaj, klucz)
+            if key in observed or (only is not None and (rodzaj, klucz) not in only):
+                continue
+            observed.add(key)
+            folded.append(key)
+            state = get_state(rodzaj, klucz)
+            z = _score(state, rate, params)
+            if z is not None:
+                alarms.append(AlarmBrakow(
+                    raport_id=report_id, rodzaj=rodzaj, klucz=klucz, data_selekcji=data_selekcji,
+                    wskaznik=rate, oczekiwany=state.srednia, odchylenie=z
+                ))
+            _fold(state, report_id, rate, params)
+    return alarms, folded
+
+
+def _store_observations(folded):
+    if folded:
+        db.session.execute(insert(ObserwacjaBrakow), [
+            {'raport_id': raport_id, 'rodzaj': rodzaj, 'klucz': klucz} for raport_id, rodzaj, klucz in folded
+        ])
+
+
+def _stored_state(rodzaj, klucz):
+    state = db.session.get(StatystykaBrakow, (rodzaj, klucz))
+    if state is None:
+        state = _new_state(rodzaj, klucz)
+        db.session.add(state)
+    return state
+
+
+def observe_reports(report_ids, kinds=tuple(KINDS)):
+    """Feed new reports into the running statistics and commit. Returns the alarms raised."""
+    report_ids = list(report_ids)
+    if not report_ids:
+        return []
+    params = _params()
+    with _lock:
+        alarms = []
+        for start in range(0, len(report_ids), 500):
+            chunk = report_ids[start:start + 500]
+            observed = set(db.session.query(
+                ObserwacjaBrakow.raport_id, ObserwacjaBrakow.rodzaj, ObserwacjaBrakow.klucz
+            ).filter(ObserwacjaBrakow.raport_id.in_(chunk)))
+            rows = list(_report_rows(DaneRaportu.id.in_(chunk)))
+            new_alarms, folded = _process(rows, _stored_state, params, observed, kinds)
+            alarms.extend(new_alarms)
+            _store_observations(folded)
+        db.session.add_all(alarms)
+        db.session.commit()
+    return alarms
+
+
+def rescore_report(report_id):
+    """
+    Re-check an edited report against the current statistics and commit.
+
+    Running statistics cannot take an old observation back, so they are
+    left as they are; rebuild() recomputes them exactly.
+    """
+    params = _params()
+    with _lock:
+        db.session.execute(delete(AlarmBrakow).where(AlarmBrakow.raport_id == report_id))
+        alarms = []
+        for row in _report_rows(DaneRaportu.id == report_id):
+            for rodzaj, klucz, rate in _series(row, KINDS):
+                state = db.session.get(StatystykaBrakow, (rodzaj, klucz))
+                z = _score(state, rate, params) if state else None
+                if z is not None:
+                    alarms.append(AlarmBrakow(
+                        raport_id=report_id, rodzaj=rodzaj, klucz=klucz, data_selekcji=row[2],
+                        wskaznik=rate, oczekiwany=state.srednia, odchylenie=z
+                    ))
+        db.session.add_all(alarms)
+        db.session.commit()
+    return alarms
+
+
+def _series_condition(model, series):
+    return or_(*(and_(model.rodzaj == rodzaj, model.klucz == klucz) for rodzaj, klucz in series))
+
+
+def _reports_in(series):
+    """Condition selecting the reports that belong to any of the (rodzaj, klucz) series."""
+    parts = [klucz for rodzaj, klucz in series if rodzaj == 'kod_detalu']
+    types = [int(klucz) for rodzaj, klucz in series if rodzaj == 'defekt']
+    return or_(
+        DaneRaportu.kod_detalu.in_(parts),
+        DaneRaportu.id.in_(select(BrakiDefektyRaportu.raport_id).where(BrakiDefektyRaportu.defekt_typ_id.in_(types))),
+    )
+
+
+def rebuild(series=None):
+    """
+    Recompute statistics and alarms from every report and commit; with
+    `series` ([(rodzaj, klucz)]) only those series are replayed and replaced.
+    Returns (series, alarms).
+    """
+    params = _params()
+    states = {}
+    only = set(series) if series is not None else None
+    if only == set():
+        return 0, 0
+
+    def get_state(rodzaj, klucz):
+        state = states.get((rodzaj, klucz))
+        if state is None:
+            state = states[(rodzaj, klucz)] = _new_state(rodzaj, klucz)
+        return state
+
+    with _lock:
+        # Archived years feed the statistics too; the scope ends before anything is written
+        with archive.scope():
+            rows = _report_rows(_reports_in(only) if only else None)
+            alarms, folded = _process(rows, get_state, params, set(), only=only)
+        for model in (AlarmBrakow, StatystykaBrakow, ObserwacjaBrakow):
+            db.session.execute(delete(model).where(_series_condition(model, only)) if only else delete(model))
+        db.session.add_all(states.values())
+        db.session.add_all(alarms)
+        _store_observations(folded)
+        db.session.commit()
+    return len(states), len(alarms)
+
+
+def ensure_anomalies():
+    """
+    Backfill on first start (reports exist but no statistics yet), or when the
+    statistics predate obserwacje_brakow. Returns True if rebuilt.
+    """
+    has_state = db.session.query(StatystykaBrakow.rodzaj).limit(1).first() is not None
+    has_observations = db.session.query(ObserwacjaBrakow.raport_id).limit(1).first() is not None
+    has_reports = db.session.query(DaneRaportu.id).limit(1).first() is not None
+    if (has_state and has_observations) or not has_reports:
+        db.session.rollback()
+        return False
+    rebuild()
+    return True
+
+
+def alarms_for_reports(report_ids):
+    """{raport_id: [AlarmBrakow]} for the given reports (e.g. one dashboard page)."""
+    result = {}
+    report_ids = list(report_ids)
+    if not report_ids:
+        return result
+    for alarm in AlarmBrakow.query.filter(AlarmBrakow.raport_id.in_(report_ids)).order_by(
+            AlarmBrakow.odchylenie.desc()):
+        result.setdefault(alarm.raport_id, []).append(alarm)
+    return result
+
+
+def series_labels(alarms):
+    """Display name of each alarm's series (defect type names instead of ids)."""
+    type_ids = {int(a.klucz) for a in alarms if a.rodzaj == 'defekt'}
+    names = dict(db.session.query(DefektTyp.id, DefektTyp.nazwa).filter(DefektTyp.id.in_(type_ids))) if type_ids else {}
+    return {
+        (a.rodzaj, a.klucz): names.get(int(a.klucz), a.klucz) if a.rodzaj == 'defekt' else a.klucz
+        for a in alarms
+    }
+
+
+def recent_alarms(date_from=None, date_to=None, rodzaj=None, limit=500):
+    """Newest alarms joined with their report, as plain dicts."""
+    query = db.session.query(AlarmBrakow, DaneRaportu.nr_raportu, DaneRaportu.nr_niezgodnosci).join(
+        DaneRaportu, AlarmBrakow.raport_id == DaneRaportu.id
+    )
+    if date_from:
+        query = query.filter(AlarmBrakow.data_selekcji >= date_from)
+    if date_to:
+        query = query.filter(AlarmBrakow.data_selekcji <= date_to)
+    if rodzaj in KINDS:
+        query = query.filter(AlarmBrakow.rodzaj == rodzaj)
+    rows = query.order_by(AlarmBrakow.data_selekcji.desc(), AlarmBrakow.id.desc()).limit(limit).all()
+    labels = series_labels([alarm for alarm, _, _ in rows])
+    return [{
+        'raport_id': alarm.raport_id,
+        'nr_raportu': nr_raportu,
+        'nr_niezgodnosci': nr_niezgodnosci,
+        'data_selekcji': alarm.data_selekcji.isoformat() if alarm.data_selekcji else None,
+        'rodzaj': alarm.rodzaj,
+        'klucz': alarm.klucz,
+        'nazwa': labels[(alarm.rodzaj, alarm.klucz)],
+        'wskaznik': alarm.wskaznik,
+        'oczekiwany': alarm.oczekiwany,
+        'odchylenie': alarm.odchylenie,
+    } for alarm, nr_raportu, nr_niezgodnosci in rows]
+
+
+def _on_report_changed(sender, change, **kwargs):
+    try:
+        if change.action == 'created':
+            observe_reports([change.report_id])
+        elif change.action == 'updated':
+            rescore_report(change.report_id)
+        elif change.action == 'deleted':
+            db.session.execute(delete(AlarmBrakow).where(AlarmBrakow.raport_id == change.report_id))
+            db.session.commit()
+    except Exception as e:
+        print(f"Anomaly detection error: {e}")
+        db.session.rollback()
+
+
+def _on_mosys_enriched(sender, nr_list, **kwargs):
+    try:
+        report_ids = []
+        for start in range(0, len(nr_list), 500):
+            report_ids.extend(db.session.scalars(
+                select(DaneRaportu.id)
+                .where(DaneRaportu.nr_niezgodnosci.in_(nr_list[start:start + 500]),
+                       DaneRaportu.kod_detalu.isnot(None))
+            ))
+        observe_reports(sorted(report_ids), kinds=('kod_detalu',))
+    except Exception as e:
+        print(f"Anomaly detection error: {e}")
+        db.session.rollback()
+
+
+report_changed.connect(_on_report_changed)
+mosys_enriched.connect(_on_mosys_enriched)
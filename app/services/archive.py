@@ -0,0 +1,260 @@
+"""
+Archive of old reports in per-year SQLite databases.
+
+archive_reports() moves reports (with their defects) dated before a cutoff
+into ARCHIVE_DIR/raporty_<year>.db and records each year in
+archiwa_raportow. The live dane_z_raportow then holds only the working set.
+
+Reads that need archived years run inside scope(date_from, date_to): the
+archive files of the overlapping years are ATTACHed to the session's
+connection and TEMP views named dane_z_raportow / braki_defekty_raportow
+(main table UNION ALL the archives) shadow the live tables, so the
+unchanged ORM queries see both. Outside a scope, or when the range touches
+no archived year, queries stay on the live tables. Archived reports are
+read-only. The daily rollup keeps archived days (app.services.rollup reads
+through a scope).
+
+Each site of a multi-plant setup has its own archive directory
+(app.services.sites.archive_dir). SQLite attaches at most 10 databases per
+connection by default.
+"""
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import ArchiwumRaportow
+from app.services import sites
+
+ARCHIVED_TABLES = ('dane_z_raportow', 'braki_defekty_raportow')
+ARCHIVE_INDEXES = {
+    'dane_z_raportow': 'data_selekcji',
+    'braki_defekty_raportow': 'raport_id',
+}
+FILE_PATTERN = re.compile(r'raporty_(\d{4})\.db$')
+
+
+def archive_file(year):
+    return f'raporty_{year}.db'
+
+
+def _alias(year):
+    return f'arch_{year}'
+
+
+def _columns(execute, schema, table):
+    """[(name, type)] of a table in an attached schema."""
+    return [(row[1], row[2]) for row in execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _attach_on_connect(engine, archive_dir):
+    @event.listens_for(engine, 'connect')
+    def _attach_archives(dbapi_connection, connection_record):
+        if not archive_dir.is_dir():
+            return
+        for path in sorted(archive_dir.glob('raporty_*.db')):
+            match = FILE_PATTERN.search(path.name)
+            if not match:
+                continue
+            try:
+                dbapi_connection.execute(f'ATTACH DATABASE ? AS {_alias(match.group(1))}', (str(path),))
+            except Exception as e:
+                print(f"Archive attach error ({path.name}): {e}")
+
+
+def init_app(app):
+    """Attach existing archive files to every new connection (outside any transaction), per site."""
+    for site in sites.site_keys():
+        with sites.activate(site):
+            _attach_on_connect(sites.engine(), sites.archive_dir())
+
+
+def archives(date_from=None, date_to=None):
+    """Finished archive years overlapping [date_from, date_to] (open ends allowed)."""
+    query = ArchiwumRaportow.query.filter(ArchiwumRaportow.w_toku.is_(False))
+    if date_from:
+        query = query.filter(ArchiwumRaportow.do_daty >= date_from)
+    if date_to:
+        query = query.filter(ArchiwumRaportow.od_daty <= date_to)
+    return query.order_by(ArchiwumRaportow.rok).all()
+
+
+def _attached(conn, entries):
+    """Aliases of the archive years available on this connection, attaching missing ones."""
+    existing = {row[1] for row in conn.exec_driver_sql('PRAGMA database_list')}
+    archive_dir = sites.archive_dir()
+    aliases = []
+    for entry in entries:
+        alias = _alias(entry.rok)
+        if alias not in existing:
+            path = archive_dir / entry.plik
+            if not path.exists():
+                print(f"Archive file missing: {path}")
+                continue
+            try:
+                conn.exec_driver_sql(f'ATTACH DATABASE ? AS {alias}', (str(path),))
+            except OperationalError as e:
+                print(f"Archive attach error ({entry.plik}): {e}")
+                continue
+        aliases.append(alias)
+    return aliases
+
+
+def _select_list(columns, available=None):
+    """Quoted column list; columns missing from `available` are selected as NULL."""
+    return ', '.join(f'"{c}"' if available is None or c in available else f'NULL AS "{c}"' for c in columns)
+
+
+def _union_view(execute, table, aliases):
+    columns = [name for name, _ in _columns(execute, 'main', table)]
+    parts = [f'SELECT {_select_list(columns)} FROM main.{table}']
+    for alias in aliases:
+        available = {name for name, _ in _columns(execute, alias, table)}
+        parts.append(f'SELECT {_select_list(columns, available)} FROM {alias}.{table}')
+    execute(f'CREATE TEMP VIEW {table} AS ' + ' UNION ALL '.join(parts))
+
+
+def include_archives(conn, archive_dir):
+    """
+    Attach every archive file to a plain sqlite3 connection and shadow the
+    live tables with the union views for its lifetime (used by scripts that
+    read the database directly, e.g. export_snapshot.py). Returns the years.
+    """
+    archive_dir = Path(archive_dir)
+    years = []
+    for path in sorted(archive_dir.glob('raporty_*.db')) if archive_dir.is_dir() else []:
+        match = FILE_PATTERN.search(path.name)
+        if match:
+            conn.execute(f'ATTACH DATABASE ? AS {_alias(match.group(1))}', (str(path),))
+            years.append(int(match.group(1)))
+    if years:
+        for table in ARCHIVED_TABLES:
+            _union_view(conn.execute, table, [_alias(year) for year in years])
+    return years
+
+
+@contextmanager
+def scope(date_from=None, date_to=None):
+    """
+    Make queries in this block include the archive years overlapping the
+    range. Yields True when archives are in play. Do not commit inside.
+    """
+    entries = archives(date_from, date_to)
+    if not entries:
+        yield False
+        return
+    conn = db.session.connection()
+    if conn.info.get('archive_scope'):
+        # Nested scope: the views of the outer one are already there
+        yield True
+        return
+    aliases = _attached(conn, entries)
+    if not aliases:
+        yield False
+        return
+    for table in ARCHIVED_TABLES:
+        _union_view(conn.exec_driver_sql, table, aliases)
+    conn.info['archive_scope'] = True
+    try:
+        yield True
+    finally:
+        conn.info.pop('archive_scope', None)
+        try:
+            for table in ARCHIVED_TABLES:
+                conn.exec_driver_sql(f'DROP VIEW IF EXISTS temp.{table}')
+        except Exception as e:
+            print(f"Archive scope cleanup error: {e}")
+
+
+def live_ids(ids):
+    """The subset of report ids still stored in the live table (archived ones are read-only)."""
+    ids = list(ids)
+    if not ids:
+        return set()
+    placeholders = ', '.join('?' * len(ids))
+    rows = db.session.connection().exec_driver_sql(
+        f'SELECT id FROM main.dane_z_raportow WHERE id IN ({placeholders})', tuple(ids)
+    )
+    return {row[0] for row in rows}
+
+
+def _prepare_archive(conn, alias):
+    """Create the archived tables (same DDL as live) and add columns the live tables gained since."""
+    execute = conn.execute
+    for table in ARCHIVED_TABLES:
+        ddl = execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        execute(re.sub(rf'^CREATE TABLE "?{table}"?', f'CREATE TABLE IF NOT EXISTS {alias}.{table}', ddl))
+        archived = {name for name, _ in _columns(execute, alias, table)}
+        for name, type_ in _columns(execute, 'main', table):
+            if name not in archived:
+                execute(f'ALTER TABLE {alias}.{table} ADD COLUMN "{name}" {type_}')
+        execute(f'CREATE INDEX IF NOT EXISTS {alias}.ix_{table}_{ARCHIVE_INDEXES[table]} '
+                f'ON {table} ({ARCHIVE_INDEXES[table]})')
+
+
+def archive_reports(conn, cutoff, archive_dir):
+    """
+    Move reports with data_selekcji < cutoff into per-year archive files.
+
+    `conn` is a sqlite3 connection to the live database; every year is moved
+    in its own transaction. Returns [(year, reports, defect_rows)].
+    """
+    conn.isolation_level = None
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    cutoff = cutoff.isoformat()
+
+    years = [int(row[0]) for row in conn.execute(
+        "SELECT DISTINCT substr(data_selekcji, 1, 4) FROM main.dane_z_raportow "
+        "WHERE data_selekcji < ? ORDER BY 1", (cutoff,)
+    )]
+    summary = []
+    for year in years:
+        alias = _alias(year)
+        path = archive_dir / archive_file(year)
+        conn.execute(f'ATTACH DATABASE ? AS {alias}', (str(path),))
+        try:
+            _prepare_archive(conn, alias)
+            columns = _select_list([name for name, _ in _columns(conn.execute, 'main', 'dane_z_raportow')])
+            defect_columns = _select_list([name for name, _ in _columns(conn.execute, 'main', 'braki_defekty_raportow')])
+            selected = ('SELECT id FROM main.dane_z_raportow '
+                        'WHERE data_selekcji >= ? AND data_selekcji < ?')
+            bounds = (f'{year}-01-01', min(f'{year + 1}-01-01', cutoff))
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # w_toku makes the change-log triggers record ARCHIVE instead of DELETE
+                conn.execute(
+                    "INSERT INTO archiwa_raportow (rok, plik, raporty, w_toku) VALUES (?, ?, 0, 1) "
+                    "ON CONFLICT(rok) DO UPDATE SET w_toku = 1", (year, path.name)
+                )
+                reports = conn.execute(
+                    f'INSERT OR REPLACE INTO {alias}.dane_z_raportow ({columns}) '
+                    f'SELECT {columns} FROM main.dane_z_raportow WHERE id IN ({selected})', bounds
+                ).rowcount
+                defects = conn.execute(
+                    f'INSERT OR REPLACE INTO {alias}.braki_defekty_raportow ({defect_columns}) '
+                    f'SELECT {defect_columns} FROM main.braki_defekty_raportow WHERE raport_id IN ({selected})', bounds
+                ).rowcount
+                conn.execute(f'DELETE FROM main.braki_defekty_raportow WHERE raport_id IN ({selected})', bounds)
+                conn.execute(f'DELETE FROM main.dane_z_raportow WHERE id IN ({selected})', bounds)
+                conn.execute(
+                    f"UPDATE archiwa_raportow SET w_toku = 0, "
+                    f"raporty = (SELECT count(*) FROM {alias}.dane_z_raportow), "
+                    f"od_daty = (SELECT min(data_selekcji) FROM {alias}.dane_z_raportow), "
+                    f"do_daty = (SELECT max(data_selekcji) FROM {alias}.dane_z_raportow), "
+                    f"zarchiwizowano = ? WHERE rok = ?",
+                    (datetime.now().isoformat(sep=' '), year)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.execute(f'DETACH DATABASE {alias}')
+        summary.append((year, reports, defects))
+    return summary
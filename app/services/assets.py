@@ -0,0 +1,69 @@
+"""
+Built static assets (see build_assets.py).
+
+build_assets.py compiles the Tailwind CSS used by the templates into
+app/static/dist/app.<hash>.css (plus .gz / .br copies) and records the
+file name in dist/manifest.json. Templates link it through
+asset_url('app.css'); the fingerprinted files are served with a one-year
+immutable Cache-Control and, when the browser accepts it, precompressed.
+Without a build asset_url() returns None and base.html falls back to the
+Tailwind CDN script (development only - it needs internet access).
+"""
+import json
+import mimetypes
+from pathlib import Path
+
+from flask import abort, request, send_from_directory, url_for
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+MAX_AGE = 365 * 24 * 3600
+
+# Content-Encoding -> suffix of the precompressed copy
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+def init_app(app):
+    dist_dir = Path(app.static_folder) / DIST
+    state = {'manifest': None, 'mtime': None}
+
+    def manifest():
+        path = dist_dir / MANIFEST
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return {}
+        # Re-read after a rebuild without restarting the app
+        if mtime != state['mtime']:
+            state['manifest'] = json.loads(path.read_text(encoding='utf-8'))
+            state['mtime'] = mtime
+        return state['manifest']
+
+    def asset_url(name):
+        built = manifest().get(name)
+        return url_for('dist_asset', filename=built) if built else None
+
+    @app.context_processor
+    def inject_asset_url():
+        return {'asset_url': asset_url}
+
+    def dist_asset(filename):
+        """A fingerprinted file: cached for a year, precompressed copy when accepted."""
+        if filename == MANIFEST or filename.endswith(tuple(s for _, s in PRECOMPRESSED)):
+            abort(404)
+        encoding = None
+        served = filename
+        for candidate, suffix in PRECOMPRESSED:
+            if candidate in request.accept_encodings and (dist_dir / (filename + suffix)).is_file():
+                encoding, served = candidate, filename + suffix
+                break
+        response = send_from_directory(dist_dir, served, max_age=MAX_AGE,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    app.add_url_rule(f'{app.static_url_path}/{DIST}/<path:filename>', 'dist_asset', dist_asset)
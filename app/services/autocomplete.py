@@ -0,0 +1,230 @@
+"""
+Prefix autocomplete of NC, instruction and part numbers for the report forms.
+
+Each field has an in-memory PrefixIndex: one sorted list searched with
+bisect, so a keystroke costs O(log n + limit) without touching the
+database. The indexes are built on first use from the reports (archived
+years included) and the MOSYS mirror, then kept current incrementally:
+report_changed and mosys_enriched add the values they carry, and new
+mirror rows are picked up by rowid at most every
+AUTOCOMPLETE_MIRROR_REFRESH seconds. Values of deleted reports stay
+suggestible until the next restart. Each site (app.services.sites) has its
+own indexes.
+
+check_nc() validates an NC at entry time: NCs found in the mirror or
+already enriched on a report are known to MOSYS without a query; others
+are looked up once through find_niezgodnosc (mirror, then live) and
+remembered. An NC no source could be asked about is reported as unknown
+(None), not as missing.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.models import DaneRaportu
+from app.services import archive
+from app.signals import report_changed, mosys_enriched
+from app.site_routing import current_site
+
+FIELDS = {
+    'nr_niezgodnosci': 'Numer niezgodności',
+    'nr_instrukcji': 'Numer instrukcji',
+    'kod_detalu': 'Kod detalu',
+}
+
+MAX_LIMIT = 50
+
+# Above this many new values an index is re-sorted instead of inserted into
+RESORT_THRESHOLD = 1000
+
+
+class PrefixIndex:
+    """Case-insensitive sorted set of strings with prefix search."""
+
+    def __init__(self, values=()):
+        self._entries = sorted({(value.upper(), value) for value in values if value})
+        self._values = {value for _, value in self._entries}
+
+    def add(self, values):
+        new = {value for value in values if value and value not in self._values}
+        if not new:
+            return 0
+        if len(new) > RESORT_THRESHOLD:
+            self._entries = sorted(self._entries + [(value.upper(), value) for value in new])
+        else:
+            for value in new:
+                insort(self._entries, (value.upper(), value))
+        self._values |= new
+        return len(new)
+
+    def search(self, prefix, limit=10):
+        """Up to `limit` values starting with prefix (case-insensitive), in order."""
+        key = prefix.upper()
+        result = []
+        for i in range(bisect_left(self._entries, (key,)), len(self._entries)):
+            folded, value = self._entries[i]
+            if not folded.startswith(key) or len(result) >= limit:
+                break
+            result.append(value)
+        return result
+
+    def __contains__(self, value):
+        return value in self._values
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _SiteState:
+    """Indexes and mirror position of one site."""
+
+    def __init__(self):
+        self.indexes = None
+        self.confirmed = set()          # NC numbers known to MOSYS
+        self.mirror_after = (0, 0)      # last mirror rowids read (mosys_notcojan, mosys_collaudo)
+        self.mirror_checked = 0.0
+
+
+_lock = threading.Lock()
+_states = {}
+
+
+def _state():
+    """State of the active site (call under _lock)."""
+    return _states.setdefault(current_site(), _SiteState())
+
+
+def _distinct(column, *conditions):
+    query = select(column).distinct().where(column.isnot(None), column != '', *conditions)
+    return [value for value in db.session.scalars(query)]
+
+
+def _mirror_keys(state):
+    """New (nc, parts) from the mirror since the last call; empty when it is unavailable."""
+    try:
+        from mosys_mirror import mirror_new_keys
+        nc, parts, state.mirror_after = mirror_new_keys(state.mirror_after)
+    except Exception as e:
+        print(f"Autocomplete mirror read error: {e}")
+        return set(), set()
+    return nc, parts
+
+
+def _build(state):
+    with archive.scope():
+        values = {name: _distinct(getattr(DaneRaportu, name)) for name in FIELDS}
+        enriched = _distinct(DaneRaportu.nr_niezgodnosci, DaneRaportu.data_niezgodnosci.isnot(None))
+    db.session.rollback()
+    mirror_nc, mirror_parts = _mirror_keys(state)
+    state.mirror_checked = time.monotonic()
+    state.confirmed.update(enriched, mirror_nc)
+    state.indexes = {
+        'nr_niezgodnosci': PrefixIndex(values['nr_niezgodnosci'] + list(mirror_nc)),
+        'nr_instrukcji': PrefixIndex(values['nr_instrukcji']),
+        'kod_detalu': PrefixIndex(values['kod_detalu'] + list(mirror_parts)),
+    }
+
+
+def _refresh_mirror(state):
+    if time.monotonic() - state.mirror_checked < current_app.config.get('AUTOCOMPLETE_MIRROR_REFRESH', 60):
+        return
+    state.mirror_checked = time.monotonic()
+    nc, parts = _mirror_keys(state)
+    state.confirmed.update(nc)
+    state.indexes['nr_niezgodnosci'].add(nc)
+    state.indexes['kod_detalu'].add(parts)
+
+
+def _ready():
+    """The active site's state, indexes built on first use and new mirror keys pulled when due (call under _lock)."""
+    state = _state()
+    if state.indexes is None:
+        _build(state)
+    else:
+        _refresh_mirror(state)
+    return state
+
+
+def suggest(field, prefix, limit=10):
+    """Known values of `field` starting with prefix. Raises KeyError for an unknown field."""
+    if field not in FIELDS:
+        raise KeyError(field)
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    with _lock:
+        return _ready().indexes[field].search(prefix, max(1, min(limit, MAX_LIMIT)))
+
+
+def check_nc(nr_niezgodnosci):
+    """
+    {'nr_niezgodnosci', 'known', 'details'}: known is True when MOSYS has the
+    NC, False when it doesn't, None when MOSYS can't be asked right now.
+    """
+    nr = nr_niezgodnosci.strip()
+    result = {'nr_niezgodnosci': nr, 'known': None, 'details': None}
+    if not nr:
+        return result
+    with _lock:
+        state = _ready()
+        if nr in state.confirmed:
+            result['known'] = True
+            return result
+    try:
+        from MOSYS_data_functions import find_niezgodnosc
+        details, answered = find_niezgodnosc(nr)
+    except Exception as e:
+        print(f"NC check error: {e}")
+        return result
+    if details is None:
+        # Missing only when every source answered; otherwise MOSYS couldn't be asked
+        result['known'] = False if answered else None
+        return result
+    with _lock:
+        state.confirmed.add(nr)
+        state.indexes['nr_niezgodnosci'].add([nr])
+        if details.get('kod_detalu'):
+            state.indexes['kod_detalu'].add([details['kod_detalu']])
+    result['known'] = True
+    result['details'] = {key: value.isoformat() if hasattr(value, 'isoformat') else value
+                         for key, value in details.items()}
+    return result
+
+
+def _on_report_changed(sender, change, **kwargs):
+    if change.after is None:
+        return
+    with _lock:
+        state = _state()
+        if state.indexes is None:
+            return
+        for name, index in state.indexes.items():
+            index.add([change.after.get(name)])
+
+
+def _on_mosys_enriched(sender, nr_list, **kwargs):
+    with _lock:
+        state = _state()
+        if state.indexes is None:
+            return
+    try:
+        parts = set()
+        for start in range(0, len(nr_list), 500):
+            parts.update(_distinct(DaneRaportu.kod_detalu,
+                                   DaneRaportu.nr_niezgodnosci.in_(nr_list[start:start + 500])))
+    except Exception as e:
+        print(f"Autocomplete refresh error: {e}")
+        db.session.rollback()
+        return
+    with _lock:
+        state.confirmed.update(nr_list)
+        state.indexes['nr_niezgodnosci'].add(nr_list)
+        state.indexes['kod_detalu'].add(parts)
+
+
+report_changed.connect(_on_report_changed)
+mosys_enriched.connect(_on_mosys_enriched)
@@ -0,0 +1,153 @@
+"""
+Validation and bulk insertion of many reports in one transaction.
+
+Used by the bulk entry form and the JSON API in ``app.routes.reports``.
+All rows are validated first; nothing is written unless every row is valid.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import insert
+
+from app import db
+from app.models import DaneRaportu, BrakiDefektyRaportu
+from app.services.defect_types import resolve_defect_types
+from app.services.numbering import allocate_report_numbers
+
+
+def _to_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    return float(str(value).replace(',', '.'))
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('on', 'true', '1', 'tak', 'yes')
+
+
+def parse_defects_text(text):
+    """Parse 'Rysy:3, Wgniecenia:2' into [('Rysy', 3), ('Wgniecenia', 2)]."""
+    defects = []
+    for part in (text or '').replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, ilosc = part.rpartition(':')
+        if not sep or not name.strip():
+            raise ValueError(f'Niepoprawny zapis defektu "{part}" (oczekiwano nazwa:ilość)')
+        defects.append((name.strip(), int(ilosc)))
+    return defects
+
+
+def parse_report_row(data, operator_ids):
+    """
+    Validate one submitted report.
+
+    `data` uses the same keys as the single report form; defects come either
+    as a list of {'defekt', 'ilosc'} dicts or as 'nazwa:ilość, ...' text.
+    Returns (values, defects, errors).
+    """
+    errors = []
+    values = {}
+
+    try:
+        operator_id = _to_int(data.get('operator_id'))
+        if operator_id is None:
+            errors.append('Operator jest wymagany.')
+        elif operator_id not in operator_ids:
+            errors.append(f'Nieznany operator (id={operator_id}).')
+        values['operator_id'] = operator_id
+    except (TypeError, ValueError):
+        errors.append('Niepoprawny identyfikator operatora.')
+
+    data_selekcji = data.get('data_selekcji')
+    if not data_selekcji:
+        errors.append('Data selekcji jest wymagana.')
+    elif isinstance(data_selekcji, date):
+        values['data_selekcji'] = data_selekcji
+    else:
+        try:
+            values['data_selekcji'] = datetime.strptime(str(data_selekcji), '%Y-%m-%d').date()
+        except ValueError:
+            errors.append(f'Niepoprawna data selekcji "{data_selekcji}" (RRRR-MM-DD).')
+
+    try:
+        ilosc = _to_int(data.get('ilosc_detali_sprawdzonych'))
+        if ilosc is None or ilosc < 0:
+            errors.append('Ilość detali sprawdzonych musi być liczbą nieujemną.')
+        values['ilosc_detali_sprawdzonych'] = ilosc
+    except (TypeError, ValueError):
+        errors.append('Ilość detali sprawdzonych musi być liczbą całkowitą.')
+
+    for field, label, required in (('czas_pracy', 'Czas pracy', True),
+                                   ('zalecana_wydajnosc', 'Zalecana wydajność', False)):
+        try:
+            value = _to_float(data.get(field))
+            if value is None and required:
+                errors.append(f'{label} jest wymagany.')
+            elif value is not None and value < 0:
+                errors.append(f'{label} nie może być ujemny.')
+            values[field] = value
+        except (TypeError, ValueError):
+            errors.append(f'{label} musi być liczbą.')
+
+    values['nr_niezgodnosci'] = (data.get('nr_niezgodnosci') or '').strip()
+    values['nr_instrukcji'] = (data.get('nr_instrukcji') or '').strip()
+    values['selekcja_na_biezaco'] = _to_bool(data.get('selekcja_na_biezaco', False))
+    values['uwagi'] = data.get('uwagi') or ''
+    values['uwagi_do_wydajnosci'] = data.get('uwagi_do_wydajnosci') or ''
+
+    defects = []
+    raw_defects = data.get('defekty') or []
+    try:
+        if isinstance(raw_defects, str):
+            defects = parse_defects_text(raw_defects)
+        else:
+            defects = [((d.get('defekt') or '').strip(), int(d.get('ilosc')))
+                       for d in raw_defects]
+        if any(not name or ilosc <= 0 for name, ilosc in defects):
+            errors.append('Każdy defekt wymaga nazwy i dodatniej ilości.')
+    except (AttributeError, TypeError, ValueError) as e:
+        errors.append(f'Niepoprawne defekty: {e}')
+
+    return values, defects, errors
+
+
+def bulk_create_reports(parsed):
+    """
+    Insert validated reports and their defects with two bulk INSERTs.
+
+    `parsed` is a list of (values, defects) pairs from parse_report_row().
+    Report numbers are reserved as one consecutive block. The caller commits.
+    Returns a list of (report_id, nr_raportu).
+    """
+    if not parsed:
+        return []
+
+    first_nr = allocate_report_numbers(len(parsed))
+    report_rows = [
+        dict(values, nr_raportu=str(first_nr + i))
+        for i, (values, _) in enumerate(parsed)
+    ]
+    ids = db.session.execute(
+        insert(DaneRaportu).returning(DaneRaportu.id, sort_by_parameter_order=True),
+        report_rows
+    ).scalars().all()
+
+    type_ids = resolve_defect_types({name for _, defects in parsed for name, _ in defects})
+    defect_rows = [
+        {'raport_id': report_id, 'defekt': name, 'defekt_typ_id': type_ids.get(name), 'ilosc': ilosc}
+        for report_id, (_, defects) in zip(ids, parsed)
+        for name, ilosc in defects
+    ]
+    if defect_rows:
+        db.session.execute(insert(BrakiDefektyRaportu), defect_rows)
+
+    return [(report_id, row['nr_raportu']) for report_id, row in zip(ids, report_rows)]
@@ -0,0 +1,44 @@
+"""
+Small in-process result cache.
+
+Entries are computed on first use and dropped as a whole by invalidate(),
+which receivers of app.signals call when the underlying data changes.
+Entries are kept per site (app.site_routing): a site only ever sees results
+computed from its own database, and a change invalidates only its entries.
+"""
+import threading
+
+from app.site_routing import current_site
+
+
+class ResultCache:
+    """Thread-safe dict cache with a version stamp bumped on every invalidation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.version = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        site = current_site()
+        with self._lock:
+            entries = self._data.get(site, {})
+            if key in entries:
+                return entries[key]
+            version = self.version
+        value = compute()
+        with self._lock:
+            # Don't store a result computed from data invalidated meanwhile
+            if version == self.version:
+                self._data.setdefault(site, {})[key] = value
+        return value
+
+    def invalidate(self, *args, **kwargs):
+        """Drop all entries of the active site. Accepts and ignores signal arguments."""
+        with self._lock:
+            self._data.pop(current_site(), None)
+            self.version += 1
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._data.values())
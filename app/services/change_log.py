@@ -0,0 +1,153 @@
+"""
+Change feed for downstream consumers (dziennik_zmian).
+
+SQLite triggers stamp created_at/updated_at on reports, operators and
+departments and append one row per insert, update or delete to
+dziennik_zmian, so writes from the app, the bulk insert path and the
+import/migration scripts are all recorded. A defect row written for a
+report counts as an update of that report; reports moved out by
+app.services.archive are logged as ARCHIVE, not DELETE. Consumers keep
+the last id they processed and ask for changes_since(cursor); ids come
+from AUTOINCREMENT and are never reused. The log itself rejects updates.
+
+Triggers are (re)created at startup.
+"""
+from sqlalchemy import text
+
+from app import db
+from app.models import DaneRaportu, Operator, KategoriaZrodlaDanych, ZmianaDanych
+from app.services.report_changes import REPORT_FIELDS
+
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# True while app.services.archive moves reports out of the live tables
+ARCHIVING = "EXISTS (SELECT 1 FROM archiwa_raportow WHERE w_toku)"
+
+# Logged table -> model whose current row is returned with a change
+TABLES = {
+    'dane_z_raportow': DaneRaportu,
+    'operatorzy': Operator,
+    'dzialy': KategoriaZrodlaDanych,
+}
+
+ROW_FIELDS = {
+    'dane_z_raportow': ('id', *REPORT_FIELDS, 'created_at', 'updated_at'),
+    'operatorzy': ('id', 'nr_operatora', 'imie_nazwisko', 'dzial_id', 'created_at', 'updated_at'),
+    'dzialy': ('id', 'opis_kategorii', 'koszt_pracy', 'created_at', 'updated_at'),
+}
+
+
+def _log(table, row_id, operation):
+    """INSERT into the log; `operation` is an SQL expression."""
+    return (f"INSERT INTO dziennik_zmian (tabela, rekord_id, operacja, zmieniono) "
+            f"VALUES ('{table}', {row_id}, {operation}, {NOW});")
+
+
+def trigger_ddl():
+    """CREATE TRIGGER statements of the change log."""
+    statements = []
+    for table in TABLES:
+        statements += [
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE {table} SET created_at = COALESCE(NEW.created_at, {NOW}),
+                                   updated_at = COALESCE(NEW.updated_at, {NOW})
+                WHERE id = NEW.id;
+                {_log(table, 'NEW.id', "'INSERT'")}
+            END""",
+            # Skipped for the trigger's own updated_at stamp (recursive_triggers is off)
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_update AFTER UPDATE ON {table}
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE {table} SET updated_at = {NOW} WHERE id = NEW.id;
+                {_log(table, 'NEW.id', "'UPDATE'")}
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON {table}
+            BEGIN
+                {_log(table, 'OLD.id', f"CASE WHEN {ARCHIVING} THEN 'ARCHIVE' ELSE 'DELETE' END")}
+            END""",
+        ]
+
+    # Defects belong to their report: stamp and log the report. Updates count only
+    # for the reported columns, not bookkeeping such as defekt_typ_id interning/merges
+    for event, ref in (('INSERT', 'NEW'), ('UPDATE OF raport_id, defekt, ilosc', 'NEW'), ('DELETE', 'OLD')):
+        statements.append(
+            f"""CREATE TRIGGER IF NOT EXISTS trg_braki_defekty_raportow_{event.split()[0].lower()}
+            AFTER {event} ON braki_defekty_raportow
+            WHEN {ref}.raport_id IS NOT NULL AND NOT {ARCHIVING}
+            BEGIN
+                UPDATE dane_z_raportow SET updated_at = {NOW} WHERE id = {ref}.raport_id;
+                {_log('dane_z_raportow', f'{ref}.raport_id', "'UPDATE'")}
+            END"""
+        )
+
+    statements.append(
+        """CREATE TRIGGER IF NOT EXISTS trg_dziennik_zmian_append_only BEFORE UPDATE ON dziennik_zmian
+        BEGIN
+            SELECT RAISE(ABORT, 'dziennik_zmian is append-only');
+        END"""
+    )
+    return statements
+
+
+def install_triggers(engine):
+    """(Re)create the change-log triggers, so definition changes apply on upgrade."""
+    with engine.begin() as conn:
+        for statement in trigger_ddl():
+            name = statement.split('EXISTS', 1)[1].split()[0]
+            conn.execute(text(f'DROP TRIGGER IF EXISTS main.{name}'))
+            conn.execute(text(statement))
+
+
+def latest_cursor():
+    """Id of the newest log entry (0 when empty) - a starting point for a new consumer."""
+    return db.session.query(db.func.coalesce(db.func.max(ZmianaDanych.id), 0)).scalar()
+
+
+def _rows(table, ids):
+    """Current rows of `table` by id, as plain dicts."""
+    model = TABLES[table]
+    fields = ROW_FIELDS[table]
+    result = {}
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        query = db.session.query(*(getattr(model, name) for name in fields)).filter(
+            model.id.in_(ids[start:start + 500])
+        )
+        for row in query:
+            result[row[0]] = {name: value.isoformat() if hasattr(value, 'isoformat') else value
+                              for name, value in zip(fields, row)}
+    return result
+
+
+def changes_since(cursor, tables=None, limit=500):
+    """
+    Log entries with id > cursor, oldest first, with the current row of each
+    record that still exists. Returns {'changes', 'cursor', 'has_more'};
+    pass the returned cursor to the next call.
+    """
+    limit = max(1, min(limit, 5000))
+    query = ZmianaDanych.query.filter(ZmianaDanych.id > cursor)
+    if tables:
+        query = query.filter(ZmianaDanych.tabela.in_(tables))
+    entries = query.order_by(ZmianaDanych.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    current = {}
+    for table in {entry.tabela for entry in entries}:
+        current[table] = _rows(table, {e.rekord_id for e in entries if e.tabela == table})
+
+    changes = [{
+        'id': entry.id,
+        'tabela': entry.tabela,
+        'rekord_id': entry.rekord_id,
+        'operacja': entry.operacja,
+        'zmieniono': entry.zmieniono.isoformat(),
+        'dane': current[entry.tabela].get(entry.rekord_id),
+    } for entry in entries]
+    return {
+        'changes': changes,
+        'cursor': entries[-1].id if entries else cursor,
+        'has_more': has_more,
+    }
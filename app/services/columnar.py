@@ -0,0 +1,112 @@
+"""
+Analytical queries over the Parquet snapshot (see app.services.snapshot).
+
+Scans run on memory-mapped Parquet files with pyarrow, reading only the
+needed columns and pruning year partitions, so multi-year aggregations
+never touch the SQLite file. query() runs ad-hoc SQL through DuckDB when
+it is installed, with the datasets available as ``reports`` and ``defects``.
+"""
+from pathlib import Path
+
+try:
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+except ImportError:  # optional dependency
+    pc = ds = fs = None
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+from flask import has_app_context
+
+from app.config import Config
+
+DATASETS = ('reports', 'defects')
+
+
+def _root(path):
+    """`path`, else the active site's snapshot (SNAPSHOT_DIR outside the app)."""
+    if path:
+        return Path(path)
+    if has_app_context():
+        from app.services import sites
+        return sites.snapshot_dir()
+    return Path(Config.SNAPSHOT_DIR)
+
+
+def dataset(name, path=None):
+    """The partitioned Parquet dataset `name` ('reports' or 'defects')."""
+    if ds is None:
+        raise RuntimeError('Analizy kolumnowe wymagają pakietu pyarrow (pip install pyarrow).')
+    if name not in DATASETS:
+        raise ValueError(f'Nieznany zbiór danych: {name}')
+    directory = _root(path) / name
+    if not directory.exists():
+        raise RuntimeError(f'Brak snapshotu {directory} - uruchom export_snapshot.py.')
+    return ds.dataset(str(directory), format='parquet', partitioning='hive',
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def scan(name, columns=None, years=None, path=None):
+    """Read `columns` of a dataset as a pyarrow Table, limited to `years` partitions."""
+    source = dataset(name, path)
+    condition = ds.field('year').isin(list(years)) if years else None
+    return source.to_table(columns=columns, filter=condition)
+
+
+def _records(table, sort_keys):
+    return table.sort_by(sort_keys).to_pylist()
+
+
+def yearly_scrap_per_part(years=None, path=None):
+    """Parts checked, defects and scrap % per (year, kod_detalu)."""
+    table = scan('reports', ['year', 'kod_detalu', 'ilosc_detali_sprawdzonych', 'total_defects'],
+                 years, path)
+    grouped = table.group_by(['year', 'kod_detalu']).aggregate([
+        ('ilosc_detali_sprawdzonych', 'sum'), ('total_defects', 'sum'), ('kod_detalu', 'count'),
+    ])
+    parts = grouped['ilosc_detali_sprawdzonych_sum']
+    defects = grouped['total_defects_sum']
+    scrap = pc.if_else(pc.greater(parts, 0),
+                       pc.multiply(pc.divide(pc.cast(defects, 'double'), parts), 100.0), 0.0)
+    grouped = grouped.append_column('scrap_rate', scrap)
+    return _records(grouped.rename_columns([
+        'year', 'kod_detalu', 'parts_checked', 'total_defects', 'reports', 'scrap_rate'
+    ]), [('year', 'ascending'), ('total_defects', 'descending')])
+
+
+def hours_per_department(years=None, path=None):
+    """Hours worked, parts checked and labour cost (koszt_pracy x hours) per (year, dzial)."""
+    table = scan('reports', ['year', 'dzial', 'czas_pracy', 'ilosc_detali_sprawdzonych', 'koszt_pracy'],
+                 years, path)
+    cost = pc.multiply(pc.fill_null(table['czas_pracy'], 0.0), pc.fill_null(table['koszt_pracy'], 0.0))
+    table = table.append_column('koszt', cost)
+    grouped = table.group_by(['year', 'dzial']).aggregate([
+        ('czas_pracy', 'sum'), ('ilosc_detali_sprawdzonych', 'sum'), ('koszt', 'sum'),
+    ])
+    return _records(grouped.rename_columns([
+        'year', 'dzial', 'hours_worked', 'parts_checked', 'labour_cost'
+    ]), [('year', 'ascending'), ('hours_worked', 'descending')])
+
+
+def query(sql, params=None, path=None):
+    """
+    Run SQL over the snapshot with DuckDB and return a pandas DataFrame.
+    Tables: reports, defects (with year/month partition columns).
+    """
+    if duckdb is None:
+        raise RuntimeError('Zapytania SQL na snapshocie wymagają pakietu duckdb (pip install duckdb).')
+    root = _root(path)
+    conn = duckdb.connect()
+    try:
+        for name in DATASETS:
+            pattern = (root / name / '**' / '*.parquet').as_posix().replace("'", "''")
+            conn.execute(
+                f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)"
+            )
+        return conn.execute(sql, params or []).df()
+    finally:
+        conn.close()
@@ -0,0 +1,59 @@
+"""
+Response compression for HTML, JSON and other text responses.
+
+Brotli is used when the client accepts it and the optional brotli package
+is installed, gzip otherwise. Small bodies, streamed responses (the
+/api/events stream) and files sent by send_file are left alone; the built
+CSS is served precompressed by app.services.assets instead.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+DEFAULT_MIMETYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript',
+)
+
+
+def _encoding(accept_encoding):
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=min(level, 9), mtime=0)
+
+
+def init_app(app):
+    config = app.config
+    mimetypes = set(config.get('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES))
+
+    @app.after_request
+    def compress_response(response):
+        if (not config.get('COMPRESS_ENABLED', True)
+                or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in mimetypes):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = _encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < config.get('COMPRESS_MIN_SIZE', 500):
+            return response
+        response.set_data(compress(data, encoding, config.get('COMPRESS_LEVEL', 6)))
+        response.headers['Content-Encoding'] = encoding
+        return response
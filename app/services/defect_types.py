@@ -0,0 +1,180 @@
+"""
+Defect-name normalization and interning.
+
+Free-text defect names are mapped to integer IDs in ``defect_types``
+through normalized aliases in ``defect_type_aliases`` (whitespace collapsed,
+lower case), so spelling variants count as one defect and aggregations run
+on integers. Lookups used by create/edit/bulk are served from an in-process
+cache of committed aliases (one per site, as type IDs differ between plant
+databases); the import scripts intern in bulk on a raw
+sqlite3 connection with intern_defect_names().
+"""
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.models import DefektTyp, DefektAlias, BrakiDefektyRaportu
+from app.services import sites
+from app.site_routing import current_site
+
+_aliases = {}               # site -> {alias: defekt_typ_id}
+_lock = threading.Lock()
+
+
+def normalize_defect_name(name):
+    """Alias key for a defect name: collapsed whitespace, lower case."""
+    return ' '.join(str(name).split()).lower() if name else ''
+
+
+def display_defect_name(name):
+    """Canonical spelling for a new defect type: collapsed whitespace, case kept."""
+    return ' '.join(str(name).split())
+
+
+def clear_cache(*args, **kwargs):
+    """Forget the active site's cached aliases (after merges or bulk interning)."""
+    with _lock:
+        _aliases.pop(current_site(), None)
+
+
+def resolve_defect_types(names):
+    """
+    Map defect names to defect type IDs, creating types for unknown names.
+
+    Runs in the caller's transaction. Only aliases that already existed are
+    cached, so a rolled-back request never leaves stale IDs behind.
+    Returns {name: defekt_typ_id}.
+    """
+    keys = {name: normalize_defect_name(name) for name in names if name and name.strip()}
+    with _lock:
+        aliases = _aliases.setdefault(current_site(), {})
+        found = {key: aliases[key] for key in set(keys.values()) if key in aliases}
+
+    missing = set(keys.values()) - set(found)
+    if missing:
+        rows = db.session.execute(
+            select(DefektAlias.alias, DefektAlias.defekt_typ_id).where(DefektAlias.alias.in_(missing))
+        ).all()
+        with _lock:
+            aliases.update(rows)
+        found.update(rows)
+
+        for name, key in keys.items():
+            if key in found:
+                continue
+            nazwa = display_defect_name(name)
+            db.session.execute(sqlite_insert(DefektTyp).values(nazwa=nazwa).on_conflict_do_nothing())
+            typ_id = db.session.execute(select(DefektTyp.id).where(DefektTyp.nazwa == nazwa)).scalar_one()
+            db.session.execute(
+                sqlite_insert(DefektAlias).values(alias=key, defekt_typ_id=typ_id).on_conflict_do_nothing()
+            )
+            found[key] = typ_id
+
+    return {name: found[key] for name, key in keys.items()}
+
+
+def intern_defect_names(conn):
+    """
+    Assign defekt_typ_id to every defect row that lacks it.
+
+    `conn` is a sqlite3 (DB-API) connection; the caller commits. One pass
+    over the distinct names, then a single UPDATE joined to a temp map.
+    Returns the number of distinct names interned.
+    """
+    names = [row[0] for row in conn.execute(
+        "SELECT DISTINCT defekt FROM braki_defekty_raportow "
+        "WHERE defekt_typ_id IS NULL AND defekt IS NOT NULL AND TRIM(defekt) != ''"
+    )]
+    if not names:
+        return 0
+
+    aliases = dict(conn.execute("SELECT alias, defekt_typ_id FROM defect_type_aliases"))
+    mapping = []
+    for name in names:
+        key = normalize_defect_name(name)
+        if key not in aliases:
+            nazwa = display_defect_name(name)
+            conn.execute("INSERT OR IGNORE INTO defect_types (nazwa) VALUES (?)", (nazwa,))
+            typ_id = conn.execute("SELECT id FROM defect_types WHERE nazwa = ?", (nazwa,)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO defect_type_aliases (alias, defekt_typ_id) VALUES (?, ?)", (key, typ_id)
+            )
+            aliases[key] = typ_id
+        mapping.append((name, aliases[key]))
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS defekt_map (defekt TEXT PRIMARY KEY, typ_id INTEGER)")
+    conn.execute("DELETE FROM defekt_map")
+    conn.executemany("INSERT INTO defekt_map (defekt, typ_id) VALUES (?, ?)", mapping)
+    conn.execute(
+        "UPDATE braki_defekty_raportow "
+        "SET defekt_typ_id = (SELECT typ_id FROM defekt_map WHERE defekt_map.defekt = braki_defekty_raportow.defekt) "
+        "WHERE defekt_typ_id IS NULL AND defekt IN (SELECT defekt FROM defekt_map)"
+    )
+    conn.execute("DROP TABLE defekt_map")
+    return len(mapping)
+
+
+def intern_missing_defect_types():
+    """Intern rows written without a type (e.g. by raw import scripts). Requires an app context."""
+    pending = db.session.query(BrakiDefektyRaportu.id).filter(
+        BrakiDefektyRaportu.defekt_typ_id.is_(None),
+        BrakiDefektyRaportu.defekt.isnot(None)
+    ).first()
+    db.session.rollback()
+    if not pending:
+        return 0
+
+    raw = sites.engine().raw_connection()
+    try:
+        count = intern_defect_names(raw)
+        raw.commit()
+    finally:
+        raw.close()
+    clear_cache()
+    return count
+
+
+def merge_defect_types(source_id, target_id):
+    """Fold one defect type into another: defect rows and aliases move to the target. Caller commits."""
+    if source_id == target_id:
+        raise ValueError('Nie można scalić defektu z samym sobą.')
+    source = db.session.get(DefektTyp, source_id)
+    target = db.session.get(DefektTyp, target_id)
+    if source is None or target is None:
+        raise ValueError('Nieznany typ defektu.')
+
+    BrakiDefektyRaportu.query.filter_by(defekt_typ_id=source.id).update(
+        {'defekt_typ_id': target.id}, synchronize_session=False
+    )
+    DefektAlias.query.filter_by(defekt_typ_id=source.id).update(
+        {'defekt_typ_id': target.id}, synchronize_session=False
+    )
+    db.session.expire(source)
+    db.session.delete(source)
+    clear_cache()
+    return target
+
+
+def add_defect_alias(typ_id, name):
+    """Map another spelling to an existing defect type, re-pointing rows that used it. Caller commits."""
+    key = normalize_defect_name(name)
+    if not key:
+        raise ValueError('Alias nie może być pusty.')
+    alias = DefektAlias.query.filter_by(alias=key).first()
+    if alias is None:
+        db.session.add(DefektAlias(alias=key, defekt_typ_id=typ_id))
+        return
+    old_typ = alias.defekt_typ_id
+    alias.defekt_typ_id = typ_id
+    clear_cache()
+    # Rows spelled this way follow the alias to its new type
+    rows = db.session.query(BrakiDefektyRaportu.id, BrakiDefektyRaportu.defekt).filter(
+        BrakiDefektyRaportu.defekt_typ_id == old_typ
+    ).all()
+    ids = [row_id for row_id, defekt in rows if normalize_defect_name(defekt) == key]
+    if ids:
+        BrakiDefektyRaportu.query.filter(BrakiDefektyRaportu.id.in_(ids)).update(
+            {'defekt_typ_id': typ_id}, synchronize_session=False
+        )
@@ -0,0 +1,175 @@
+"""
+MOSYS enrichment of report rows.
+
+Reports keep a local copy of data_niezgodnosci, nr_zamowienia and kod_detalu
+fetched from MOSYS. Code that saves reports queues their NC numbers here;
+a single background worker drains the queue and resolves everything pending
+at the highest queued priority with one batch call, so saving never waits
+for the ODBC round trip and prefetched (low priority) numbers go afterwards.
+Queued numbers remember their site (app.services.sites), and the worker
+enriches each site's numbers against that site's database and MOSYS DSN.
+"""
+import itertools
+import queue
+import threading
+
+from flask import has_app_context
+from sqlalchemy import bindparam
+
+from app import db
+from app.models import DaneRaportu
+from app.services import sites
+from app.signals import send_mosys_enriched
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 10
+
+_queue = queue.PriorityQueue()
+_counter = itertools.count()
+_pending = {}               # (site, nr_niezgodnosci) -> best (lowest) priority queued
+_lock = threading.Lock()
+_worker = None
+_app = None
+
+
+def init_app(app):
+    """Remember the app so the worker thread can open its own app context."""
+    global _app
+    _app = app
+
+
+def apply_mosys_data(reports, mosys_data):
+    """Copy fetched MOSYS details onto report objects. Returns the updated reports."""
+    updated = []
+    for report in reports:
+        data = mosys_data.get(report.nr_niezgodnosci)
+        if data:
+            report.data_niezgodnosci = data.get('data_niezgodnosci')
+            report.nr_zamowienia = data.get('nr_zamowienia')
+            report.kod_detalu = data.get('kod_detalu')
+            updated.append(report)
+    return updated
+
+
+def store_mosys_data(mosys_data):
+    """Write fetched MOSYS details to every report with a matching NC number."""
+    if not mosys_data:
+        return
+    table = DaneRaportu.__table__
+    stmt = table.update().where(
+        table.c.nr_niezgodnosci == bindparam('nr')
+    ).values(
+        data_niezgodnosci=bindparam('data'),
+        nr_zamowienia=bindparam('zamowienie'),
+        kod_detalu=bindparam('detal'),
+    )
+    db.session.execute(stmt, [
+        {
+            'nr': nr,
+            'data': data.get('data_niezgodnosci'),
+            'zamowienie': data.get('nr_zamowienia'),
+            'detal': data.get('kod_detalu'),
+        }
+        for nr, data in mosys_data.items()
+    ])
+
+
+def enrich(nr_list):
+    """Fetch MOSYS details for the NC numbers and store them. Requires an app context."""
+    from flask import current_app
+    from MOSYS_data_functions import get_batch_niezgodnosc_details
+
+    batch_size = current_app.config.get('MOSYS_BATCH_SIZE', 500)
+    nr_list = list(dict.fromkeys(nr for nr in nr_list if nr))
+    mosys_data = {}
+    for start in range(0, len(nr_list), batch_size):
+        mosys_data.update(get_batch_niezgodnosc_details(nr_list[start:start + batch_size]))
+
+    store_mosys_data(mosys_data)
+    db.session.commit()
+    send_mosys_enriched(mosys_data)
+    return mosys_data
+
+
+def enqueue(nr_list, priority=PRIORITY_HIGH):
+    """
+    Queue NC numbers for enrichment. Numbers already pending are skipped,
+    unless they wait at a lower priority: those are queued again at this one
+    (a saved report isn't held up by an earlier prefetch of its NC).
+
+    Without an initialized app (or with MOSYS_ENRICHMENT_ASYNC disabled) the
+    lookup runs synchronously in the caller's app context instead.
+    Returns the number of newly queued (or promoted) NC numbers.
+    """
+    site = sites.current_key() if has_app_context() else None
+    with _lock:
+        new = [nr for nr in dict.fromkeys(nr_list)
+               if nr and _pending.get((site, nr), priority + 1) > priority]
+        _pending.update(((site, nr), priority) for nr in new)
+    if not new:
+        return 0
+
+    if _app is None or not _app.config.get('MOSYS_ENRICHMENT_ASYNC', True):
+        try:
+            enrich(new)
+        except Exception as e:
+            print(f"MOSYS enrichment error: {e}")
+            db.session.rollback()
+        finally:
+            _done(site, new)
+        return len(new)
+
+    _queue.put((priority, next(_counter), site, new))
+    _ensure_worker()
+    return len(new)
+
+
+def _done(site, nr_list):
+    with _lock:
+        for nr in nr_list:
+            _pending.pop((site, nr), None)
+
+
+def _ensure_worker():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='mosys-enrichment', daemon=True)
+            _worker.start()
+
+
+def _drain(priority, site, first):
+    """
+    Collect what is queued at `priority` (or higher) into one batch per site.
+    Lower-priority work stays queued, so prefetching never rides along with
+    (and slows down) the lookup of a saved report.
+    """
+    batches = {site: list(first)}
+    while True:
+        try:
+            item = _queue.get_nowait()
+        except queue.Empty:
+            return batches
+        if item[0] > priority:
+            _queue.put(item)
+            return batches
+        _, _, site, nr_list = item
+        batches.setdefault(site, []).extend(nr_list)
+
+
+def _run():
+    while True:
+        priority, _, site, nr_list = _queue.get()
+        for site, batch in _drain(priority, site, nr_list).items():
+            # A number promoted to a higher priority was looked up already; skip its old entry
+            with _lock:
+                batch = [nr for nr in dict.fromkeys(batch) if (site, nr) in _pending]
+            if not batch:
+                continue
+            try:
+                with _app.app_context(), sites.activate(site):
+                    enrich(batch)
+            except Exception as e:
+                print(f"MOSYS enrichment error: {e}")
+            finally:
+                _done(site, batch)
@@ -0,0 +1,319 @@
+"""
+Parallel ingestion of report workbooks (see ingest_excel.py).
+
+Every sheet of every workbook is parsed and validated in a process pool,
+with python-calamine when installed (much faster than openpyxl) and
+openpyxl otherwise. A sheet is recognised by its columns: report sheets
+have the dane_z_raportow columns of dane.xlsx, defect sheets the
+braki_defekty_raportow ones; other sheets are skipped.
+
+The parent process merges the parsed rows in file/sheet order and rejects
+rows whose id or nr_raportu already exists (live or archived) or appeared
+earlier in the batch, reports of unknown operators, and defects whose
+report is not imported. The accepted rows are written by one bulk writer in
+a single transaction. Works on plain sqlite3 connections, like
+import_excel_data.py, so the app does not have to be stopped.
+"""
+import importlib.util
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import pandas as pd
+
+ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+
+REPORT_COLUMNS = (
+    'id', 'nr_raportu', 'operator_id', 'nr_niezgodnosci', 'nr_instrukcji',
+    'selekcja_na_biezaco', 'ilosc_detali_sprawdzonych', 'zalecana_wydajnosc',
+    'czas_pracy', 'uwagi', 'uwagi_do_wydajnosci', 'data_selekcji',
+)
+DEFECT_COLUMNS = ('id', 'raport_id', 'defekt', 'ilosc')
+
+# Workbook header -> column, where the sheet uses a different name
+HEADER_ALIASES = {'zalecana wydajność': 'zalecana_wydajnosc'}
+
+
+@dataclass
+class SheetResult:
+    """Rows of one parsed sheet: kind is 'reports', 'defects' or None (skipped)."""
+    path: str
+    sheet: str
+    kind: str = None
+    read: int = 0
+    rows: list = field(default_factory=list)
+    rejected: list = field(default_factory=list)     # [(row number, reason)]
+    seconds: float = 0.0
+    error: str = None
+
+
+@dataclass
+class FileStats:
+    path: str
+    sheets: int = 0
+    read: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.seconds if self.seconds else 0.0
+
+
+def _blank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT \
+        or (isinstance(value, str) and not value.strip())
+
+
+def _text(value):
+    if _blank(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _int(value):
+    if _blank(value):
+        return None
+    number = float(str(value).replace(',', '.'))
+    if not number.is_integer():
+        raise ValueError(value)
+    return int(number)
+
+
+def _float(value):
+    if _blank(value):
+        return None
+    return float(str(value).replace(',', '.'))
+
+
+def _date(value):
+    if _blank(value):
+        return None
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date().isoformat()
+
+
+def _bool(value):
+    if _blank(value):
+        return False
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'tak', 'yes', 'on')
+    return bool(value)
+
+
+def _report_row(record):
+    """Validated report tuple (REPORT_COLUMNS order) or a rejection reason."""
+    try:
+        row = {
+            'id': _int(record.get('id')),
+            'nr_raportu': _text(record.get('nr_raportu')),
+            'operator_id': _int(record.get('operator_id')),
+            'nr_niezgodnosci': _text(record.get('nr_niezgodnosci')),
+            'nr_instrukcji': _text(record.get('nr_instrukcji')),
+            'selekcja_na_biezaco': _bool(record.get('selekcja_na_biezaco')),
+            'ilosc_detali_sprawdzonych': _int(record.get('ilosc_detali_sprawdzonych')),
+            'zalecana_wydajnosc': _float(record.get('zalecana_wydajnosc')),
+            'czas_pracy': _float(record.get('czas_pracy')),
+            'uwagi': _text(record.get('uwagi')),
+            'uwagi_do_wydajnosci': _text(record.get('uwagi_do_wydajnosci')),
+            'data_selekcji': _date(record.get('data_selekcji')),
+        }
+    except (TypeError, ValueError) as e:
+        return f'niepoprawna wartość ({e})'
+    if row['id'] is None:
+        return 'brak id'
+    if not row['nr_raportu']:
+        return 'brak nr_raportu'
+    if row['data_selekcji'] is None:
+        return 'brak daty selekcji'
+    for name in ('ilosc_detali_sprawdzonych', 'czas_pracy', 'zalecana_wydajnosc'):
+        if row[name] is not None and row[name] < 0:
+            return f'ujemna wartość {name}'
+    return tuple(row[name] for name in REPORT_COLUMNS)
+
+
+def _defect_row(record):
+    """Validated defect tuple (DEFECT_COLUMNS order) or a rejection reason."""
+    try:
+        row = (_int(record.get('id')), _int(record.get('raport_id')),
+               _text(record.get('defekt')), _int(record.get('ilosc')))
+    except (TypeError, ValueError) as e:
+        return f'niepoprawna wartość ({e})'
+    if row[1] is None:
+        return 'brak raport_id'
+    if not row[2]:
+        return 'brak nazwy defektu'
+    if row[3] is None or row[3] <= 0:
+        return 'ilość musi być dodatnia'
+    return row
+
+
+def _sheet_kind(columns):
+    if {'raport_id', 'defekt', 'ilosc'} <= columns:
+        return 'defects'
+    if {'id', 'nr_raportu', 'data_selekcji'} <= columns:
+        return 'reports'
+    return None
+
+
+def sheet_names(path, engine=ENGINE):
+    """(sheet names, None) of a workbook, or ([], error) when it can't be opened."""
+    try:
+        return pd.ExcelFile(path, engine=engine).sheet_names, None
+    except Exception as e:
+        return [], str(e)
+
+
+def parse_sheet(path, sheet, engine=ENGINE):
+    """Read and validate one sheet (runs in a worker process)."""
+    result = SheetResult(str(path), sheet)
+    started = time.perf_counter()
+    try:
+        df = pd.read_excel(path, sheet_name=sheet, engine=engine)
+    except Exception as e:
+        result.error = str(e)
+        result.seconds = time.perf_counter() - started
+        return result
+    df.columns = [HEADER_ALIASES.get(str(c).strip(), str(c).strip()) for c in df.columns]
+    result.kind = _sheet_kind(set(df.columns))
+    if result.kind is not None:
+        validate = _report_row if result.kind == 'reports' else _defect_row
+        records = df.to_dict('records')
+        result.read = len(records)
+        for number, record in enumerate(records, start=2):   # row 1 is the header
+            row = validate(record)
+            if isinstance(row, str):
+                result.rejected.append((number, row))
+            else:
+                result.rows.append((number, row))
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def parse_workbooks(paths, workers=None, engine=ENGINE):
+    """Parse every sheet of every workbook in a process pool; results in file/sheet order."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        listed = list(pool.map(sheet_names, paths, [engine] * len(paths)))
+        tasks = [(path, sheet) for path, (sheets, _) in zip(paths, listed) for sheet in sheets]
+        parsed = iter(pool.map(parse_sheet, [p for p, _ in tasks], [s for _, s in tasks],
+                               [engine] * len(tasks)))
+    results = []
+    for path, (sheets, error) in zip(paths, listed):
+        if error:
+            results.append(SheetResult(str(path), '', error=error))
+        results.extend(next(parsed) for _ in sheets)
+    return results
+
+
+def existing_keys(conn):
+    """Report ids, report numbers, defect ids and operator ids already in the database."""
+    return {
+        'report_ids': {row[0] for row in conn.execute('SELECT id FROM dane_z_raportow')},
+        'numbers': {row[0] for row in conn.execute('SELECT nr_raportu FROM dane_z_raportow')},
+        'defect_ids': {row[0] for row in conn.execute('SELECT id FROM braki_defekty_raportow')},
+        'operator_ids': {row[0] for row in conn.execute('SELECT id FROM operatorzy')},
+    }
+
+
+def merge(results, existing):
+    """
+    Deduplicate and cross-check the parsed sheets.
+
+    Returns (reports, defects, stats, rejects): the rows to write, FileStats
+    per workbook and [(path, sheet, row number, reason)].
+    """
+    report_ids, numbers = set(existing['report_ids']), set(existing['numbers'])
+    defect_ids = set(existing['defect_ids'])
+    stats, rejects = {}, []
+    reports, defects, pending_defects = [], [], []
+
+    for result in results:
+        file_stats = stats.setdefault(result.path, FileStats(result.path))
+        file_stats.sheets += 1
+        file_stats.read += result.read
+        file_stats.seconds += result.seconds
+        if result.error:
+            rejects.append((result.path, result.sheet, None, f'błąd odczytu: {result.error}'))
+            continue
+        rejects.extend((result.path, result.sheet, number, reason) for number, reason in result.rejected)
+
+        if result.kind == 'defects':
+            pending_defects.append(result)
+            continue
+        for number, row in result.rows:
+            report_id, nr_raportu, operator_id = row[0], row[1], row[2]
+            if report_id in report_ids:
+                reason = f'duplikat id {report_id}'
+            elif nr_raportu in numbers:
+                reason = f'duplikat nr_raportu {nr_raportu}'
+            elif operator_id is not None and operator_id not in existing['operator_ids']:
+                reason = f'nieznany operator {operator_id}'
+            else:
+                report_ids.add(report_id)
+                numbers.add(nr_raportu)
+                reports.append(row)
+                file_stats.accepted += 1
+                continue
+            rejects.append((result.path, result.sheet, number, reason))
+
+    # Defects only for reports imported now (from any workbook of the batch)
+    imported = {row[0] for row in reports}
+    for result in pending_defects:
+        for number, row in result.rows:
+            if row[1] not in imported:
+                reason = f'raport {row[1]} nie jest importowany'
+            elif row[0] is not None and row[0] in defect_ids:
+                reason = f'duplikat id defektu {row[0]}'
+            else:
+                if row[0] is not None:
+                    defect_ids.add(row[0])
+                defects.append(row)
+                stats[result.path].accepted += 1
+                continue
+            rejects.append((result.path, result.sheet, number, reason))
+
+    for path, *_ in rejects:
+        stats[path].rejected += 1
+    return reports, defects, list(stats.values()), rejects
+
+
+def write(conn, reports, defects):
+    """
+    Bulk-insert the merged rows in one transaction (the single writer).
+    Defect names are interned and the report number sequence is moved past
+    the imported numbers. Returns the imported report ids.
+    """
+    from app.services.defect_types import intern_defect_names
+
+    conn.isolation_level = None
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(
+            f"INSERT INTO dane_z_raportow ({', '.join(REPORT_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(REPORT_COLUMNS))})", reports
+        )
+        conn.executemany(
+            f"INSERT INTO braki_defekty_raportow ({', '.join(DEFECT_COLUMNS)}) VALUES (?, ?, ?, ?)", defects
+        )
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(braki_defekty_raportow)')}
+        if 'defekt_typ_id' in columns:
+            intern_defect_names(conn)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sekwencje'").fetchone():
+            conn.execute(
+                "UPDATE sekwencje SET wartosc = MAX(wartosc, ("
+                "SELECT COALESCE(MAX(CAST(nr_raportu AS INTEGER)), 0) FROM dane_z_raportow "
+                "WHERE nr_raportu GLOB '[0-9]*')) WHERE nazwa = 'nr_raportu'"
+            )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return [row[0] for row in reports]
@@ -0,0 +1,141 @@
+"""
+Report filters shared by the dashboard, its statistics and background jobs.
+
+ReportFilter holds the date range (custom or preset), the column text
+filters and the sort order parsed from the dashboard query string, and
+applies them to any query over DaneRaportu, so the table, the stats and
+prefetching always see the same rows.
+"""
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+
+from app.models import DaneRaportu
+
+DEFAULT_PRESET = 'last_month'
+DEFAULT_SORT = 'data_selekcji'
+
+SORT_COLUMNS = ('data_selekcji', 'nr_raportu', 'nr_niezgodnosci', 'data_niezgodnosci',
+                'nr_zamowienia', 'kod_detalu', 'nr_instrukcji',
+                'ilosc_detali_sprawdzonych', 'czas_pracy', 'zalecana_wydajnosc')
+
+# Dashboard filter key -> (query string argument, DaneRaportu column name)
+TEXT_FILTERS = {
+    'operator': ('filter_operator', None),
+    'nr_raportu': ('filter_nr_raportu', 'nr_raportu'),
+    'nr_niezgodnosci': ('filter_nr_niezgodnosci', 'nr_niezgodnosci'),
+    'data_nc': ('filter_data_nc', 'data_niezgodnosci'),
+    'commessa': ('filter_commessa', 'nr_zamowienia'),
+    'kod_detalu': ('filter_kod_detalu', 'kod_detalu'),
+    'nr_instrukcji': ('filter_nr_instrukcji', 'nr_instrukcji'),
+}
+
+
+def preset_range(preset, today=None):
+    """(date_from, date_to) for a dashboard date preset; None means open-ended."""
+    today = today or datetime.now().date()
+    if preset == 'last_week':
+        return today - timedelta(days=7), None
+    if preset == 'last_month':
+        return today - timedelta(days=30), None
+    if preset == 'this_month':
+        return today.replace(day=1), None
+    if preset == 'previous_month':
+        last_of_prev_month = today.replace(day=1) - timedelta(days=1)
+        return last_of_prev_month.replace(day=1), last_of_prev_month
+    if preset == 'last_quarter':
+        return today - timedelta(days=90), None
+    if preset == 'this_year':
+        return today.replace(month=1, day=1), None
+    if preset == 'previous_year':
+        return (today.replace(year=today.year - 1, month=1, day=1),
+                today.replace(year=today.year - 1, month=12, day=31))
+    if preset == 'last_year':
+        return today - timedelta(days=365), None
+    # 'all' (or unknown) leaves the range open
+    return None, None
+
+
+@dataclass(frozen=True)
+class ReportFilter:
+    """Date range, text filters and sort order of a report listing."""
+    date_from: object = None
+    date_to: object = None
+    preset: str = DEFAULT_PRESET
+    text: dict = field(default_factory=dict)
+    sort_by: str = DEFAULT_SORT
+    order: str = 'desc'
+
+    @classmethod
+    def from_args(cls, args, default_preset=DEFAULT_PRESET):
+        """Parse the dashboard query string (request.args)."""
+        date_from = args.get('date_from', '')
+        date_to = args.get('date_to', '')
+        preset = args.get('preset', default_preset)
+        if not date_from and not date_to:
+            date_from, date_to = preset_range(preset)
+        else:
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+
+        text = {key: args.get(arg, '') for key, (arg, _) in TEXT_FILTERS.items()}
+        return cls(date_from=date_from, date_to=date_to, preset=preset, text=text,
+                   sort_by=args.get('sort', DEFAULT_SORT), order=args.get('order', 'desc'))
+
+    def template_filters(self):
+        """Filter values in the shape dashboard/index.html expects."""
+        return dict({'data_selekcji': self.date_from or ''},
+                    **{key: self.text.get(key, '') for key in TEXT_FILTERS})
+
+    def text_columns(self):
+        """Columns the active text filters need."""
+        return {column for key, (_, column) in TEXT_FILTERS.items() if column and self.text.get(key)}
+
+    def key(self):
+        """Hashable form, for caching results per filter."""
+        return (self.date_from, self.date_to,
+                tuple(sorted((k, v) for k, v in self.text.items() if v)),
+                self.sort_by, self.order)
+
+    def apply(self, query, entity=DaneRaportu):
+        """
+        Restrict a query that selects from (or joins) DaneRaportu, or another
+        entity with the same column names (e.g. the daily rollup).
+        """
+        if self.date_from:
+            query = query.filter(entity.data_selekcji >= self.date_from)
+        if self.date_to:
+            query = query.filter(entity.data_selekcji <= self.date_to)
+        for key, (_, column) in TEXT_FILTERS.items():
+            value = self.text.get(key)
+            if value and column:
+                query = query.filter(getattr(entity, column).ilike(f"%{value}%"))
+        return query
+
+    def matches(self, snapshot):
+        """Python counterpart of apply() for a report snapshot dict (see report_snapshot)."""
+        if not snapshot:
+            return False
+        day = snapshot.get('data_selekcji')
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+        if self.date_from and (day is None or day < self.date_from):
+            return False
+        if self.date_to and (day is None or day > self.date_to):
+            return False
+        for key, (_, column) in TEXT_FILTERS.items():
+            value = self.text.get(key)
+            if value and column:
+                stored = snapshot.get(column)
+                if stored is None or value.lower() not in str(stored).lower():
+                    return False
+        return True
+
+    def order_query(self, query):
+        """Apply the sort order (unknown columns fall back to newest first)."""
+        if self.sort_by in SORT_COLUMNS:
+            column = getattr(DaneRaportu, self.sort_by)
+            return query.order_by(column.desc() if self.order == 'desc' else column.asc())
+        return query.order_by(DaneRaportu.data_selekcji.desc())
+
+    def with_sort(self, sort_by, order):
+        return replace(self, sort_by=sort_by, order=order)
@@ -0,0 +1,92 @@
+"""
+Dashboard KPIs of a report filter, for one site or across all sites.
+
+totals() sums the additive terms (reports, parts, hours, defects and the
+two efficiency terms) in the active site's database; derive() turns them
+into the dashboard's stats (scrap rate, parts/hour, efficiency). Only sums
+travel between sites, so federated_kpis() queries every plant's database
+concurrently (app.services.sites.federated) and merges exact totals
+without copying any data. Per-site totals are cached until that site's
+reports change.
+"""
+from sqlalchemy import func
+
+from app import db
+from app.models import DaneRaportu, BrakiDefektyRaportu
+from app.services import archive, sites
+from app.services.cache import ResultCache
+from app.services.recommended_rates import efficiency_totals
+from app.signals import report_changed, mosys_enriched
+
+TERMS = ('count', 'parts_checked', 'hours_worked', 'total_defects', 'efficiency_parts', 'efficiency_expected')
+
+_cache = ResultCache('site-kpis')
+report_changed.connect(_cache.invalidate)
+mosys_enriched.connect(_cache.invalidate)
+
+
+def totals(report_filter):
+    """Additive KPI terms of the reports matching the filter (archived years included)."""
+    with archive.scope(report_filter.date_from, report_filter.date_to):
+        count, parts, hours = report_filter.apply(db.session.query(
+            func.count(DaneRaportu.id),
+            func.coalesce(func.sum(DaneRaportu.ilosc_detali_sprawdzonych), 0),
+            func.coalesce(func.sum(DaneRaportu.czas_pracy), 0)
+        )).first()
+        defects = report_filter.apply(db.session.query(
+            func.coalesce(func.sum(BrakiDefektyRaportu.ilosc), 0)
+        ).join(DaneRaportu, BrakiDefektyRaportu.raport_id == DaneRaportu.id)).scalar() or 0
+        # Against typed or recommended rates (wydajnosci_zalecane)
+        efficiency_parts, expected = efficiency_totals(report_filter.apply)
+    return {
+        'count': count,
+        'parts_checked': parts,
+        'hours_worked': hours,
+        'total_defects': defects,
+        'efficiency_parts': efficiency_parts,
+        'efficiency_expected': expected,
+    }
+
+
+def derive(terms):
+    """Dashboard stats from summed terms."""
+    parts, hours = terms['parts_checked'], terms['hours_worked']
+    return {
+        'count': terms['count'],
+        'parts_checked': parts,
+        'hours_worked': hours,
+        'total_defects': terms['total_defects'],
+        # Average scrap rate = (total defects / total parts checked) * 100
+        'average_scrap_rate': terms['total_defects'] * 100.0 / parts if parts else 0,
+        # Average productivity = total parts checked / total hours worked
+        'average_productivity': parts / hours if hours else 0,
+        'average_efficiency': (terms['efficiency_parts'] * 100.0 / terms['efficiency_expected']
+                               if terms['efficiency_expected'] else None),
+    }
+
+
+def federated_kpis(report_filter):
+    """
+    KPIs of every site and of all sites together:
+    {'sites': [{'site', 'nazwa', 'stats', 'error'}], 'total': stats, 'complete': bool}.
+    A site that can't be read is listed with its error and left out of the total.
+    """
+    key = report_filter.key()
+    results = sites.federated(lambda: _cache.get_or_compute(key, lambda: totals(report_filter)))
+    merged = dict.fromkeys(TERMS, 0)
+    rows = []
+    for site, result, error in results:
+        rows.append({
+            'site': site,
+            'nazwa': sites.site_name(site) or site,
+            'stats': derive(result) if result is not None else None,
+            'error': error,
+        })
+        if result is not None:
+            for term in TERMS:
+                merged[term] += result[term]
+    return {
+        'sites': rows,
+        'total': derive(merged),
+        'complete': all(row['error'] is None for row in rows),
+    }
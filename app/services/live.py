@@ -0,0 +1,219 @@
+"""
+Live dashboard updates (Server-Sent Events).
+
+report_changed and mosys_enriched are published to an in-process broker;
+every open dashboard holds one /api/events stream. For each report change
+the stream sends the KPI delta for that client's filter, computed from the
+change's before/after snapshots alone (the row leaves the range, enters
+it, or both), plus the rendered table row, so the page patches its stats
+cards and rows without reloading. Enrichment events carry the new MOSYS
+columns of the affected rows.
+
+Events carry the site they happened on and a stream only sends its own
+site's events. The broker keeps the last HISTORY events so a reconnecting
+EventSource resumes from Last-Event-ID. It lives in one process: with several worker
+processes each one only streams its own writes.
+"""
+import json
+import queue
+import threading
+from collections import deque
+
+from flask import render_template
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import DaneRaportu, Operator
+from app.signals import report_changed, mosys_enriched
+from app.site_routing import current_site
+
+HISTORY = 500
+QUEUE_SIZE = 1000
+HEARTBEAT = 15          # seconds between keep-alive comments
+ENRICHED_ROWS = 2000    # cap on rows patched by one enrichment event
+
+
+class Event:
+    """One published change; derived payloads are built once and shared by all streams."""
+
+    def __init__(self, event_id, kind, **data):
+        self.id = event_id
+        self.kind = kind
+        self.data = data
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def cached(self, name, build):
+        with self._lock:
+            if name not in self._cache:
+                self._cache[name] = build()
+            return self._cache[name]
+
+
+class EventBroker:
+    """Fan-out of events to subscriber queues with a short replay history."""
+
+    def __init__(self, history=HISTORY, queue_size=QUEUE_SIZE):
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._queue_size = queue_size
+        self._next_id = 1
+
+    def publish(self, kind, **data):
+        with self._lock:
+            event = Event(self._next_id, kind, **data)
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Too slow to keep up: tell it to reload instead of growing without bound
+                self.unsubscribe(subscriber)
+                subscriber.overflowed = True
+        return event
+
+    def subscribe(self, last_id=None):
+        """New subscriber queue, pre-filled with the events after last_id still in history."""
+        subscriber = queue.Queue(maxsize=self._queue_size)
+        subscriber.overflowed = False
+        with self._lock:
+            if last_id is not None:
+                missed = [event for event in self._history if event.id > last_id]
+                if self._history and self._history[0].id > last_id + 1:
+                    subscriber.overflowed = True
+                for event in missed[-self._queue_size:]:
+                    subscriber.put_nowait(event)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def last_id(self):
+        with self._lock:
+            return self._next_id - 1
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+broker = EventBroker()
+
+
+def _contribution(snapshot):
+    return {
+        'count': 1,
+        'parts': snapshot.get('ilosc_detali_sprawdzonych') or 0,
+        'hours': snapshot.get('czas_pracy') or 0,
+        'defects': snapshot.get('total_defects') or 0,
+    }
+
+
+def kpi_delta(change, report_filter):
+    """Change of the filtered totals caused by one ReportChange, or None if it doesn't touch them."""
+    was_in = report_filter.matches(change.before)
+    is_in = report_filter.matches(change.after)
+    if not was_in and not is_in:
+        return None
+    delta = dict.fromkeys(('count', 'parts', 'hours', 'defects'), 0)
+    if was_in:
+        for key, value in _contribution(change.before).items():
+            delta[key] -= value
+    if is_in:
+        for key, value in _contribution(change.after).items():
+            delta[key] += value
+    return {'delta': delta, 'in_filter': is_in}
+
+
+def _render_row(report_id):
+    from app.services.anomalies import alarms_for_reports, series_labels
+
+    report = DaneRaportu.query.options(
+        joinedload(DaneRaportu.operator).joinedload(Operator.dzial), joinedload(DaneRaportu.braki_defekty)
+    ).populate_existing().filter(DaneRaportu.id == report_id).first()
+    if report is None:
+        return None
+    alarms = alarms_for_reports([report.id])
+    html = render_template('dashboard/_report_row.html', report=report, alarms=alarms,
+                           alarm_labels=series_labels(alarms.get(report.id, [])))
+    db.session.rollback()
+    return html
+
+
+def _enriched_rows(nr_list):
+    rows = []
+    for start in range(0, len(nr_list), 500):
+        rows.extend(db.session.query(
+            DaneRaportu.id, DaneRaportu.data_niezgodnosci, DaneRaportu.nr_zamowienia, DaneRaportu.kod_detalu
+        ).filter(DaneRaportu.nr_niezgodnosci.in_(nr_list[start:start + 500])).limit(ENRICHED_ROWS - len(rows)))
+        if len(rows) >= ENRICHED_ROWS:
+            break
+    db.session.rollback()
+    return [{
+        'id': report_id,
+        'data_niezgodnosci': data_nc.strftime('%d.%m.%y') if data_nc else '-',
+        'nr_zamowienia': nr_zamowienia or '-',
+        'kod_detalu': kod_detalu or '-',
+    } for report_id, data_nc, nr_zamowienia, kod_detalu in rows]
+
+
+def _message(event, report_filter):
+    """SSE payload of an event for one client's filter, or None when irrelevant to it."""
+    if event.kind == 'report':
+        change = event.data['change']
+        kpi = kpi_delta(change, report_filter)
+        if kpi is None:
+            return None
+        payload = dict(kpi, action=change.action, report_id=change.report_id)
+        if kpi['in_filter'] and change.action != 'deleted':
+            payload['html'] = event.cached('html', lambda: _render_row(change.report_id))
+        return payload
+    if event.kind == 'enriched':
+        return {'rows': event.cached('rows', lambda: _enriched_rows(event.data['nr_list']))}
+    return None
+
+
+def _format(event_id, kind, payload):
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n'
+
+
+def stream(report_filter, last_id=None):
+    """Generator of SSE text for one dashboard; run it under stream_with_context."""
+    site = current_site()
+    subscriber = broker.subscribe(last_id)
+    try:
+        yield f'retry: 5000\nid: {last_id if last_id is not None else broker.last_id}\n\n'
+        while True:
+            if subscriber.overflowed:
+                yield _format(broker.last_id, 'reload', {})
+                return
+            try:
+                event = subscriber.get(timeout=HEARTBEAT)
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            if event.data['site'] != site:
+                continue
+            payload = _message(event, report_filter)
+            if payload is not None:
+                yield _format(event.id, event.kind, payload)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def _on_report_changed(sender, change, **kwargs):
+    broker.publish('report', change=change, site=current_site())
+
+
+def _on_mosys_enriched(sender, nr_list, **kwargs):
+    broker.publish('enriched', nr_list=list(nr_list), site=current_site())
+
+
+report_changed.connect(_on_report_changed)
+mosys_enriched.connect(_on_mosys_enriched)
@@ -0,0 +1,201 @@
+"""
+NC timeline: how long NCs wait for sorting and how long sorting takes.
+
+The MOSYS notes of every NC (NOTCOJAN, read from the local mirror - see
+mosys_mirror.py) are summarized into historia_niezgodnosci: date of the
+first and last note, number of notes and the order/part of the opening
+note. The summary is kept incrementally by mirror rowid - only NCs with
+notes mirrored since the last pass are re-read, at most every
+NC_TIMELINE_MIRROR_REFRESH seconds - so analysing thousands of NCs needs
+no ODBC call at all.
+
+timeline() joins that summary with the reports aggregated per NC in one
+grouped query (archived years included) and returns, per part or order,
+the distribution of:
+  reakcja  - days from the NC being opened (first note, else
+             data_niezgodnosci of the reports) to the first sorting day
+  selekcja - days from the first to the last sorting day, inclusive
+plus the average number of notes. Results are cached per spec until a
+report changes, MOSYS data is enriched or new history is mirrored.
+"""
+import threading
+import time
+from datetime import datetime
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.models import DaneRaportu, HistoriaNiezgodnosci
+from app.services import archive
+from app.services.cache import ResultCache
+from app.services.recommended_rates import percentile
+from app.signals import report_changed, mosys_enriched
+from app.site_routing import current_site
+
+DIMENSIONS = {
+    'kod_detalu': 'Kod detalu',
+    'nr_zamowienia': 'Nr zamówienia',
+}
+PERCENTILES = (50, 75, 90)
+SLOWEST = 20
+UPSERT_CHUNK = 500
+
+_cache = ResultCache('nc-timeline')
+report_changed.connect(_cache.invalidate)
+mosys_enriched.connect(_cache.invalidate)
+
+_lock = threading.Lock()
+_checked = {}               # site -> monotonic time of the last pass
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y%m%d').date() if value else None
+
+
+def _upsert(rows):
+    values = [{
+        'nr_niezgodnosci': nc, 'otwarta': _date(first), 'ostatni_wpis': _date(last), 'wpisy': notes,
+        'nr_zamowienia': commessa, 'kod_detalu': articolo, 'ostatni_rowid': rowid,
+    } for nc, first, last, notes, commessa, articolo, rowid in rows]
+    for start in range(0, len(values), UPSERT_CHUNK):
+        statement = sqlite_insert(HistoriaNiezgodnosci).values(values[start:start + UPSERT_CHUNK])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['nr_niezgodnosci'],
+            set_={column: statement.excluded[column] for column in values[0] if column != 'nr_niezgodnosci'}
+        ))
+
+
+def sync_history(force=False):
+    """
+    Re-summarize the NCs with notes mirrored since the last pass and commit.
+    Returns the number of NCs updated; 0 when not due or the mirror is unavailable.
+    """
+    site = current_site()
+    with _lock:
+        refresh = current_app.config.get('NC_TIMELINE_MIRROR_REFRESH', 300)
+        if not force and site in _checked and time.monotonic() - _checked[site] < refresh:
+            return 0
+        _checked[site] = time.monotonic()
+        try:
+            from mosys_mirror import mirror_nc_summaries
+            watermark = db.session.scalar(select(func.max(HistoriaNiezgodnosci.ostatni_rowid))) or 0
+            rows, last = mirror_nc_summaries(watermark)
+            if last < watermark:
+                # The mirror was rebuilt from scratch: rowids started over
+                db.session.execute(delete(HistoriaNiezgodnosci))
+                rows, last = mirror_nc_summaries(0)
+            _upsert(rows)
+            db.session.commit()
+        except Exception as e:
+            print(f"NC history sync error: {e}")
+            db.session.rollback()
+            return 0
+    if rows:
+        _cache.invalidate()
+    return len(rows)
+
+
+def _distribution(values):
+    values = sorted(v for v in values if v is not None)
+    result = {'n': len(values)}
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        result[f'p{pct}'] = round(value, 1) if value is not None else None
+    result['srednia'] = round(sum(values) / len(values), 1) if values else None
+    return result
+
+
+def _summary(rows):
+    return {
+        'nc': len(rows),
+        'reakcja': _distribution(row['reakcja_dni'] for row in rows),
+        'selekcja': _distribution(row['selekcja_dni'] for row in rows),
+        'wpisy_srednio': round(sum(row['wpisy'] for row in rows) / len(rows), 1) if rows else None,
+        'raporty': sum(row['raporty'] for row in rows),
+        'detale': sum(row['detale'] for row in rows),
+        'godziny': round(sum(row['godziny'] for row in rows), 1),
+    }
+
+
+def _nc_rows(date_from, date_to, kod_detalu, nr_zamowienia):
+    """One row per NC with reports: sorting dates and totals joined with its note history."""
+    reports = select(
+        DaneRaportu.nr_niezgodnosci.label('nr'),
+        func.min(DaneRaportu.data_selekcji).label('pierwsza'),
+        func.max(DaneRaportu.data_selekcji).label('ostatnia'),
+        func.count(DaneRaportu.id).label('raporty'),
+        func.coalesce(func.sum(DaneRaportu.ilosc_detali_sprawdzonych), 0).label('detale'),
+        func.coalesce(func.sum(DaneRaportu.czas_pracy), 0).label('godziny'),
+        func.min(DaneRaportu.data_niezgodnosci).label('data_nc'),
+        func.max(DaneRaportu.kod_detalu).label('kod_detalu'),
+        func.max(DaneRaportu.nr_zamowienia).label('nr_zamowienia'),
+    ).where(
+        DaneRaportu.nr_niezgodnosci.isnot(None), DaneRaportu.nr_niezgodnosci != ''
+    ).group_by(DaneRaportu.nr_niezgodnosci).subquery()
+
+    history = HistoriaNiezgodnosci
+    opened = func.coalesce(history.otwarta, reports.c.data_nc)
+    part = func.coalesce(reports.c.kod_detalu, history.kod_detalu)
+    order = func.coalesce(reports.c.nr_zamowienia, history.nr_zamowienia)
+    query = select(
+        reports.c.nr, part, order, opened, reports.c.pierwsza, reports.c.ostatnia,
+        func.julianday(reports.c.pierwsza) - func.julianday(opened),
+        func.julianday(reports.c.ostatnia) - func.julianday(reports.c.pierwsza) + 1,
+        func.coalesce(history.wpisy, 0), reports.c.raporty, reports.c.detale, reports.c.godziny,
+    ).outerjoin(history, history.nr_niezgodnosci == reports.c.nr)
+
+    if date_from:
+        query = query.where(reports.c.pierwsza >= date_from)
+    if date_to:
+        query = query.where(reports.c.pierwsza <= date_to)
+    if kod_detalu:
+        query = query.where(part == kod_detalu)
+    if nr_zamowienia:
+        query = query.where(order == nr_zamowienia)
+
+    names = ('nr_niezgodnosci', 'kod_detalu', 'nr_zamowienia', 'otwarta', 'pierwsza_selekcja',
+             'ostatnia_selekcja', 'reakcja_dni', 'selekcja_dni', 'wpisy', 'raporty', 'detale', 'godziny')
+    return [dict(zip(names, row)) for row in db.session.execute(query)]
+
+
+def _compute(spec):
+    group_by, date_from, date_to, kod_detalu, nr_zamowienia, limit = spec
+    # Every year: an NC's first and last sorting day may lie outside the range
+    with archive.scope():
+        rows = _nc_rows(date_from, date_to, kod_detalu, nr_zamowienia)
+    db.session.rollback()
+
+    rows.sort(key=lambda row: row[group_by] or '')
+    groups = [{'klucz': key or None, **_summary(list(group))}
+              for key, group in groupby(rows, key=lambda row: row[group_by] or '')]
+    groups.sort(key=lambda group: (-group['nc'], group['klucz'] or ''))
+
+    slowest = sorted((row for row in rows if row['reakcja_dni'] is not None),
+                     key=lambda row: -row['reakcja_dni'])[:SLOWEST]
+    slowest = [{key: value.isoformat() if hasattr(value, 'isoformat') else value for key, value in row.items()}
+               for row in slowest]
+    return {
+        'group_by': group_by,
+        'summary': _summary(rows),
+        'groups': len(groups),
+        'rows': groups[:limit] if limit else groups,
+        'slowest': slowest,
+        'with_history': sum(1 for row in rows if row['wpisy']),
+    }
+
+
+def timeline(group_by='kod_detalu', date_from=None, date_to=None, kod_detalu=None, nr_zamowienia=None,
+             limit=None):
+    """
+    Lead-time distributions per part or order for the NCs first sorted within
+    the date range; see the module docstring for the measures.
+    """
+    if group_by not in DIMENSIONS:
+        raise ValueError(f'Nieznany wymiar: {group_by}')
+    sync_history()
+    spec = (group_by, date_from or None, date_to or None, kod_detalu or None, nr_zamowienia or None,
+            limit or None)
+    return _cache.get_or_compute(spec, lambda: _compute(spec))
@@ -0,0 +1,59 @@
+"""
+Atomic allocation of sequential business numbers.
+
+Report numbers used to be computed as ``MAX(nr_raportu) + 1`` with a
+separate SELECT, so two concurrent submissions could get the same number.
+Numbers are now reserved from the ``sekwencje`` counter table with a single
+UPDATE, which takes SQLite's write lock for the rest of the transaction.
+"""
+from sqlalchemy import Integer, cast, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from app.models import DaneRaportu, SekwencjaNumerow
+
+REPORT_SEQUENCE = 'nr_raportu'
+
+
+def _current_max_report_number():
+    """Highest numeric nr_raportu already stored (falls back to the highest id)."""
+    max_nr = db.session.query(
+        func.max(cast(DaneRaportu.nr_raportu, Integer))
+    ).filter(DaneRaportu.nr_raportu.op('GLOB')('[0-9]*')).scalar()
+    if max_nr is not None:
+        return max_nr
+    return db.session.query(func.max(DaneRaportu.id)).scalar() or 0
+
+
+def allocate_numbers(nazwa, count, seed):
+    """
+    Reserve `count` consecutive numbers from sequence `nazwa`.
+
+    Must run inside the transaction that uses the numbers; they are released
+    again if it rolls back. `seed` is a callable returning the starting value
+    for a sequence that does not exist yet. Returns the first reserved number.
+    """
+    if count < 1:
+        raise ValueError('count must be positive')
+
+    bump = update(SekwencjaNumerow).where(
+        SekwencjaNumerow.nazwa == nazwa
+    ).values(wartosc=SekwencjaNumerow.wartosc + count)
+
+    if db.session.execute(bump).rowcount == 0:
+        db.session.execute(
+            sqlite_insert(SekwencjaNumerow)
+            .values(nazwa=nazwa, wartosc=seed())
+            .on_conflict_do_nothing()
+        )
+        db.session.execute(bump)
+
+    last = db.session.execute(
+        select(SekwencjaNumerow.wartosc).where(SekwencjaNumerow.nazwa == nazwa)
+    ).scalar_one()
+    return last - count + 1
+
+
+def allocate_report_numbers(count=1):
+    """Reserve `count` consecutive report numbers; returns the first one."""
+    return allocate_numbers(REPORT_SEQUENCE, count, _current_max_report_number)
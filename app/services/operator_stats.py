@@ -0,0 +1,125 @@
+"""
+Operator productivity leaderboard.
+
+Rolling 7/30/90-day metrics per operator (parts/hour, efficiency against
+zalecana_wydajnosc, scrap found) computed with one GROUP BY + RANK() window
+query per window, rolled up per department in Python. Results are cached
+per window and dropped whenever a report or operator changes.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func
+
+from app import db
+from app.models import DaneRaportu, BrakiDefektyRaportu, Operator, KategoriaZrodlaDanych
+from app.services import archive
+from app.services.cache import ResultCache
+from app.signals import report_changed, reference_changed
+
+WINDOWS = (7, 30, 90)
+DEFAULT_WINDOW = 30
+
+_cache = ResultCache('operator-ranking')
+report_changed.connect(_cache.invalidate)
+reference_changed.connect(_cache.invalidate)
+
+
+def _ratio(numerator, denominator, scale=1):
+    return (numerator / denominator * scale) if denominator else 0
+
+
+def _metrics(row):
+    """Derived metrics from summed columns (shared by operators and departments)."""
+    return {
+        'parts_per_hour': _ratio(row['parts_checked'], row['hours_worked']),
+        'efficiency': _ratio(row['parts_with_target'], row['target_parts'], 100),
+        'scrap_rate': _ratio(row['total_defects'], row['parts_checked'], 100),
+    }
+
+
+def _compute_ranking(days, today):
+    date_from = today - timedelta(days=days)
+
+    defects = db.session.query(
+        BrakiDefektyRaportu.raport_id.label('raport_id'),
+        func.sum(BrakiDefektyRaportu.ilosc).label('ilosc')
+    ).group_by(BrakiDefektyRaportu.raport_id).subquery()
+
+    has_target = DaneRaportu.zalecana_wydajnosc > 0
+    parts = func.coalesce(func.sum(DaneRaportu.ilosc_detali_sprawdzonych), 0)
+    hours = func.coalesce(func.sum(DaneRaportu.czas_pracy), 0)
+    parts_per_hour = parts / func.nullif(hours, 0)
+
+    query = db.session.query(
+        Operator.id,
+        Operator.nr_operatora,
+        Operator.imie_nazwisko,
+        KategoriaZrodlaDanych.opis_kategorii,
+        func.count(DaneRaportu.id),
+        parts,
+        hours,
+        func.coalesce(func.sum(defects.c.ilosc), 0),
+        func.coalesce(func.sum(case((has_target, DaneRaportu.ilosc_detali_sprawdzonych))), 0),
+        func.coalesce(func.sum(case((has_target, DaneRaportu.czas_pracy * DaneRaportu.zalecana_wydajnosc))), 0),
+        func.rank().over(order_by=func.coalesce(parts_per_hour, 0).desc()),
+    ).join(
+        DaneRaportu, DaneRaportu.operator_id == Operator.id
+    ).outerjoin(
+        KategoriaZrodlaDanych, Operator.dzial_id == KategoriaZrodlaDanych.id
+    ).outerjoin(
+        defects, defects.c.raport_id == DaneRaportu.id
+    ).filter(
+        DaneRaportu.data_selekcji >= date_from
+    ).group_by(Operator.id).order_by(func.coalesce(parts_per_hour, 0).desc())
+    # The window can reach into an archived year
+    with archive.scope(date_from, today):
+        rows = query.all()
+
+    operators = []
+    departments = {}
+    for (op_id, nr, name, dzial, count, parts_sum, hours_sum, defects_sum,
+         parts_with_target, target_parts, rank) in rows:
+        row = {
+            'rank': rank,
+            'operator_id': op_id,
+            'nr_operatora': nr,
+            'imie_nazwisko': name,
+            'dzial': dzial or 'Brak',
+            'reports': count,
+            'parts_checked': parts_sum,
+            'hours_worked': hours_sum,
+            'total_defects': defects_sum,
+            'parts_with_target': parts_with_target,
+            'target_parts': target_parts,
+        }
+        row.update(_metrics(row))
+        operators.append(row)
+
+        dept = departments.setdefault(row['dzial'], {
+            'dzial': row['dzial'], 'operators': 0, 'reports': 0, 'parts_checked': 0,
+            'hours_worked': 0, 'total_defects': 0, 'parts_with_target': 0, 'target_parts': 0,
+        })
+        dept['operators'] += 1
+        for key in ('reports', 'parts_checked', 'hours_worked', 'total_defects',
+                    'parts_with_target', 'target_parts'):
+            dept[key] += row[key]
+
+    for dept in departments.values():
+        dept.update(_metrics(dept))
+
+    return {
+        'window': days,
+        'date_from': date_from.isoformat(),
+        'date_to': today.isoformat(),
+        'operators': operators,
+        'departments': sorted(departments.values(), key=lambda d: d['parts_per_hour'], reverse=True),
+    }
+
+
+def get_operator_ranking(days=DEFAULT_WINDOW):
+    """Leaderboard for the last `days` days (one of WINDOWS), cached until data changes."""
+    if days not in WINDOWS:
+        days = DEFAULT_WINDOW
+    today = datetime.now().date()
+    # The date is part of the key so windows roll over at midnight
+    return _cache.get_or_compute((days, today), lambda: _compute_ranking(days, today))
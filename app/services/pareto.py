@@ -0,0 +1,109 @@
+"""
+Pareto / drill-down analysis of defects (braki_defekty_raportow.ilosc).
+
+Groups defect quantities by one dimension (defect type, part, order,
+operator or month) with optional drill-down filters on the others and
+returns rows with share and cumulative share of the total. Results are
+cached per normalized spec until a report changes.
+"""
+from sqlalchemy import func
+
+from app import db
+from app.models import DaneRaportu, BrakiDefektyRaportu, Operator, DefektTyp
+from app.services import archive
+from app.services.cache import ResultCache
+from app.signals import report_changed, reference_changed, mosys_enriched
+
+# Dimension -> (label shown in UI, displayed value, grouping key)
+DIMENSIONS = {
+    'defekt': ('Defekt', DefektTyp.nazwa, BrakiDefektyRaportu.defekt_typ_id),
+    'kod_detalu': ('Kod detalu', DaneRaportu.kod_detalu, DaneRaportu.kod_detalu),
+    'nr_zamowienia': ('Nr zamówienia', DaneRaportu.nr_zamowienia, DaneRaportu.nr_zamowienia),
+    'operator': ('Operator', Operator.imie_nazwisko, DaneRaportu.operator_id),
+    'okres': ('Miesiąc', func.strftime('%Y-%m', DaneRaportu.data_selekcji),
+              func.strftime('%Y-%m', DaneRaportu.data_selekcji)),
+}
+DRILL_ORDER = ('defekt', 'kod_detalu', 'nr_zamowienia', 'operator', 'okres')
+VITAL_FEW_SHARE = 80.0
+
+_cache = ResultCache('pareto')
+report_changed.connect(_cache.invalidate)
+reference_changed.connect(_cache.invalidate)
+mosys_enriched.connect(_cache.invalidate)
+
+
+def normalize_spec(group_by, filters=None, date_from=None, date_to=None, limit=None):
+    """Validate a Pareto request and return it as a hashable tuple."""
+    if group_by not in DIMENSIONS:
+        raise ValueError(f'Nieznany wymiar: {group_by}')
+    filters = tuple(sorted(
+        (dim, value) for dim, value in (filters or {}).items()
+        if dim in DIMENSIONS and dim != group_by and value not in (None, '')
+    ))
+    return (group_by, filters, date_from or None, date_to or None, limit or None)
+
+
+def _compute(spec):
+    group_by, filters, date_from, date_to, limit = spec
+    _, label, key = DIMENSIONS[group_by]
+    total_qty = func.sum(BrakiDefektyRaportu.ilosc)
+    used = {group_by} | {dim for dim, _ in filters}
+
+    # Grouping runs on integer keys (defect type, operator id); names are joined for display
+    query = db.session.query(
+        label, total_qty, func.count(func.distinct(BrakiDefektyRaportu.raport_id))
+    ).join(DaneRaportu, BrakiDefektyRaportu.raport_id == DaneRaportu.id)
+
+    if 'defekt' in used:
+        query = query.outerjoin(DefektTyp, BrakiDefektyRaportu.defekt_typ_id == DefektTyp.id)
+    if 'operator' in used:
+        query = query.outerjoin(Operator, DaneRaportu.operator_id == Operator.id)
+    if date_from:
+        query = query.filter(DaneRaportu.data_selekcji >= date_from)
+    if date_to:
+        query = query.filter(DaneRaportu.data_selekcji <= date_to)
+    for dim, value in filters:
+        query = query.filter(DIMENSIONS[dim][1] == value)
+
+    # Archived years in the range are read too
+    with archive.scope(date_from, date_to):
+        rows = query.filter(BrakiDefektyRaportu.ilosc > 0).group_by(key).order_by(total_qty.desc()).all()
+
+    total = sum(qty for _, qty, _ in rows)
+    result = []
+    cumulative = 0
+    for value, qty, reports in rows:
+        share = qty / total * 100 if total else 0
+        # Vital few: rows needed to reach VITAL_FEW_SHARE of the total
+        vital = total and cumulative / total * 100 < VITAL_FEW_SHARE
+        cumulative += qty
+        result.append({
+            'value': value,
+            'ilosc': qty,
+            'reports': reports,
+            'share': share,
+            'cumulative_share': cumulative / total * 100 if total else 0,
+            'vital_few': bool(vital),
+        })
+
+    return {
+        'group_by': group_by,
+        'filters': dict(filters),
+        'date_from': date_from.isoformat() if date_from else None,
+        'date_to': date_to.isoformat() if date_to else None,
+        'total': total,
+        'groups': len(result),
+        'rows': result[:limit] if limit else result,
+    }
+
+
+def pareto(group_by='defekt', filters=None, date_from=None, date_to=None, limit=None):
+    """Pareto rows for `group_by`, restricted by drill-down `filters` and date range."""
+    spec = normalize_spec(group_by, filters, date_from, date_to, limit)
+    return _cache.get_or_compute(spec, lambda: _compute(spec))
+
+
+def next_dimension(group_by, filters):
+    """First dimension not yet used, for drilling into a clicked row."""
+    used = set(filters) | {group_by}
+    return next((dim for dim in DRILL_ORDER if dim not in used), None)
@@ -0,0 +1,180 @@
+"""
+Generic pivot / cross-tab engine.
+
+A pivot spec names dimensions (date bucket, operator, department, part,
+order, defect) and measures (parts, hours, defects, reports, scrap %,
+labour cost); it is compiled to a single GROUP BY restricted by the shared
+ReportFilter. Specs at the daily-rollup grain or coarser read
+raporty_dzienne instead of every report. Results are cached per
+normalized spec until reports, reference data or MOSYS data change.
+"""
+from sqlalchemy import func
+
+from app import db
+from app.models import (DaneRaportu, BrakiDefektyRaportu, Operator, KategoriaZrodlaDanych,
+                        DefektTyp, RaportDzienny)
+from app.services import archive
+from app.services.cache import ResultCache
+from app.signals import report_changed, reference_changed, mosys_enriched
+
+# Dimension -> (label, date format or column name in the report/rollup grain)
+DIMENSIONS = {
+    'dzien': ('Dzień', '%Y-%m-%d'),
+    'tydzien': ('Tydzień', '%Y-W%W'),
+    'miesiac': ('Miesiąc', '%Y-%m'),
+    'rok': ('Rok', '%Y'),
+    'operator': ('Operator', None),
+    'dzial': ('Dział', None),
+    'kod_detalu': ('Kod detalu', 'kod_detalu'),
+    'nr_zamowienia': ('Nr zamówienia', 'nr_zamowienia'),
+    'defekt': ('Defekt', None),
+}
+DATE_BUCKETS = ('dzien', 'tydzien', 'miesiac', 'rok')
+
+MEASURES = {
+    'reports': 'Raportów',
+    'parts': 'Detali sprawdzonych',
+    'hours': 'Godzin pracy',
+    'defects': 'Braków',
+    'scrap_pct': 'Braki %',
+    'cost': 'Koszt pracy',
+}
+# Measures that stay additive when rows are split by defect type
+DEFECT_MEASURES = ('reports', 'defects')
+
+# Text filters the rollup can answer (it keeps only these report columns)
+ROLLUP_FILTER_COLUMNS = {'kod_detalu', 'nr_zamowienia'}
+
+_cache = ResultCache('pivot')
+report_changed.connect(_cache.invalidate)
+reference_changed.connect(_cache.invalidate)
+mosys_enriched.connect(_cache.invalidate)
+
+
+def normalize_spec(dimensions, measures, report_filter):
+    """Validate a pivot request and return it as a hashable tuple."""
+    dimensions = tuple(dict.fromkeys(d for d in dimensions if d))
+    measures = tuple(dict.fromkeys(m for m in measures if m))
+    unknown = [d for d in dimensions if d not in DIMENSIONS] + [m for m in measures if m not in MEASURES]
+    if unknown:
+        raise ValueError(f'Nieznane wymiary lub miary: {", ".join(unknown)}')
+    if not measures:
+        raise ValueError('Wybierz co najmniej jedną miarę.')
+    if 'defekt' in dimensions and set(measures) - set(DEFECT_MEASURES):
+        raise ValueError('Przy podziale na defekty dostępne są tylko miary: raportów, braków.')
+    return dimensions, measures, report_filter.key()
+
+
+def choose_source(dimensions, report_filter):
+    """'rollup' when the spec fits the daily rollup grain, else 'reports' or 'defects'."""
+    if 'defekt' in dimensions:
+        return 'defects'
+    if report_filter.text_columns() <= ROLLUP_FILTER_COLUMNS:
+        return 'rollup'
+    return 'reports'
+
+
+def _source_columns(source):
+    """Grain columns and summed measures of one source."""
+    if source == 'rollup':
+        entity = RaportDzienny
+        sums = {
+            'reports': func.sum(RaportDzienny.raporty),
+            'parts': func.sum(RaportDzienny.ilosc_detali),
+            'hours': func.sum(RaportDzienny.czas_pracy),
+            'defects': func.sum(RaportDzienny.braki),
+        }
+    elif source == 'reports':
+        entity = DaneRaportu
+        braki = db.session.query(
+            BrakiDefektyRaportu.raport_id, func.sum(BrakiDefektyRaportu.ilosc).label('braki')
+        ).group_by(BrakiDefektyRaportu.raport_id).subquery()
+        sums = {
+            'reports': func.count(DaneRaportu.id),
+            'parts': func.sum(DaneRaportu.ilosc_detali_sprawdzonych),
+            'hours': func.sum(DaneRaportu.czas_pracy),
+            'defects': func.sum(func.coalesce(braki.c.braki, 0)),
+            '_braki': braki,
+        }
+    else:
+        entity = DaneRaportu
+        sums = {
+            'reports': func.count(func.distinct(BrakiDefektyRaportu.raport_id)),
+            'defects': func.sum(BrakiDefektyRaportu.ilosc),
+        }
+    hours = getattr(entity, 'czas_pracy')
+    sums['cost'] = func.sum(hours * func.coalesce(KategoriaZrodlaDanych.koszt_pracy, 0))
+    return entity, sums
+
+
+def _compute(dimensions, measures, report_filter, source):
+    entity, sums = _source_columns(source)
+
+    # Grouping runs on the id columns; names are joined for display
+    labels, keys = [], []
+    for dim in dimensions:
+        fmt = DIMENSIONS[dim][1]
+        if dim in DATE_BUCKETS:
+            expr = func.strftime(fmt, entity.data_selekcji)
+            labels.append(expr)
+            keys.append(expr)
+        elif dim == 'operator':
+            labels.append(Operator.imie_nazwisko)
+            keys.append(entity.operator_id)
+        elif dim == 'dzial':
+            labels.append(KategoriaZrodlaDanych.opis_kategorii)
+            keys.append(Operator.dzial_id)
+        elif dim == 'defekt':
+            labels.append(func.coalesce(DefektTyp.nazwa, BrakiDefektyRaportu.defekt))
+            keys.append(BrakiDefektyRaportu.defekt_typ_id)
+        else:
+            labels.append(getattr(entity, fmt))
+            keys.append(getattr(entity, fmt))
+
+    columns = []
+    for measure in measures:
+        if measure == 'scrap_pct':
+            columns.append(func.coalesce(sums['defects'], 0) * 100.0
+                           / func.nullif(func.coalesce(sums['parts'], 0), 0))
+        else:
+            columns.append(func.coalesce(sums[measure], 0))
+
+    query = db.session.query(*labels, *columns)
+    if source == 'defects':
+        query = query.select_from(BrakiDefektyRaportu).join(
+            DaneRaportu, BrakiDefektyRaportu.raport_id == DaneRaportu.id
+        ).outerjoin(DefektTyp, BrakiDefektyRaportu.defekt_typ_id == DefektTyp.id)
+    else:
+        query = query.select_from(entity)
+        if source == 'reports':
+            query = query.outerjoin(sums['_braki'], sums['_braki'].c.raport_id == DaneRaportu.id)
+
+    needs_operator = {'operator', 'dzial'} & set(dimensions) or 'cost' in measures
+    if needs_operator:
+        query = query.outerjoin(Operator, entity.operator_id == Operator.id)
+        if 'dzial' in dimensions or 'cost' in measures:
+            query = query.outerjoin(KategoriaZrodlaDanych, Operator.dzial_id == KategoriaZrodlaDanych.id)
+
+    query = report_filter.apply(query, entity)
+    if keys:
+        query = query.group_by(*keys).order_by(*labels)
+    if source == 'rollup':
+        return [tuple(row) for row in query.all()]
+    # The rollup keeps archived days; report and defect rows are read through the archive
+    with archive.scope(report_filter.date_from, report_filter.date_to):
+        return [tuple(row) for row in query.all()]
+
+
+def pivot(dimensions, measures, report_filter):
+    """
+    Run a pivot. Returns {'dimensions', 'measures', 'source', 'rows'} where
+    each row is a tuple of dimension values followed by measure values.
+    """
+    spec = normalize_spec(dimensions, measures, report_filter)
+    dimensions, measures, _ = spec
+    source = choose_source(dimensions, report_filter)
+    rows = _cache.get_or_compute(
+        (*spec, source),
+        lambda: _compute(dimensions, measures, report_filter, source)
+    )
+    return {'dimensions': list(dimensions), 'measures': list(measures), 'source': source, 'rows': rows}
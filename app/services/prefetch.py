@@ -0,0 +1,62 @@
+"""
+Predictive MOSYS prefetch for the dashboard.
+
+After a dashboard page is served, the rows of the next few pages (and the
+first page of the same listing in the opposite sort order) that still lack
+MOSYS data are queued for low-priority background enrichment, so paging
+forward does not wait for STAAMP. Attempts are remembered per site.
+"""
+import threading
+import time
+
+from flask import current_app
+
+from app.models import DaneRaportu
+from app.services import enrichment
+from app.site_routing import current_site
+
+# NC numbers MOSYS had no answer for are not re-queued before this many seconds
+RETRY_AFTER = 600
+
+_attempted = {}             # (site, nr_niezgodnosci) -> monotonic time of the last attempt
+_lock = threading.Lock()
+
+
+def _window_nrs(query, offset, limit):
+    rows = query.with_entities(
+        DaneRaportu.nr_niezgodnosci, DaneRaportu.data_niezgodnosci
+    ).offset(offset).limit(limit).all()
+    return [nr for nr, data_nc in rows if nr and data_nc is None]
+
+
+def prefetch_pages(report_filter, base_query, page, per_page, pages=None):
+    """
+    Queue NC numbers lacking MOSYS data on the pages after `page`.
+
+    `base_query` is the filtered (unsorted) report query of the listing.
+    Returns the number of NC numbers queued.
+    """
+    pages = current_app.config.get('MOSYS_PREFETCH_PAGES', 3) if pages is None else pages
+    # Prefetching only makes sense when enrichment runs off the request thread
+    if not pages or not current_app.config.get('MOSYS_ENRICHMENT_ASYNC', True):
+        return 0
+
+    nr_list = _window_nrs(report_filter.order_query(base_query), page * per_page, pages * per_page)
+    # The likely next sort variant: same column, reversed
+    reversed_filter = report_filter.with_sort(
+        report_filter.sort_by, 'asc' if report_filter.order == 'desc' else 'desc'
+    )
+    nr_list += _window_nrs(reversed_filter.order_query(base_query), 0, per_page)
+
+    now = time.monotonic()
+    site = current_site()
+    with _lock:
+        fresh = [nr for nr in dict.fromkeys(nr_list)
+                 if now - _attempted.get((site, nr), -RETRY_AFTER) >= RETRY_AFTER]
+        _attempted.update(((site, nr), now) for nr in fresh)
+        if len(_attempted) > 50000:
+            for key in [key for key, at in _attempted.items() if now - at >= RETRY_AFTER]:
+                del _attempted[key]
+    if not fresh:
+        return 0
+    return enrichment.enqueue(fresh, priority=enrichment.PRIORITY_LOW)
@@ -0,0 +1,165 @@
+"""
+Slow-query log and per-request query budgets.
+
+Engine events time every statement. A statement slower than SLOW_QUERY_MS
+is appended to SLOW_QUERY_LOG (JSON lines) with its parameters, its
+EXPLAIN QUERY PLAN and the request it ran for. Within a request the
+statements are also counted: when QUERY_BUDGET_COUNT statements or
+QUERY_BUDGET_MS of database time are exceeded, the request is logged with
+its most repeated statements (the usual N+1 signature), or - with
+QUERY_BUDGET_MODE = 'reject' - stopped with 503 before the next
+statement runs. Every response carries a Server-Timing header with the
+request's query count and time.
+
+The last HISTORY entries are also kept in memory for /query-log.
+"""
+import json
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from werkzeug.exceptions import ServiceUnavailable
+
+from app import db
+from app.site_routing import current_site
+
+HISTORY = 200
+STATEMENT_CHARS = 2000
+TOP_STATEMENTS = 5
+
+_history = deque(maxlen=HISTORY)
+_file_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(ServiceUnavailable):
+    description = 'Zapytanie przekroczyło limit obciążenia bazy danych. Zawęź filtry i spróbuj ponownie.'
+
+
+def recent(limit=50, kind=None):
+    """Newest log entries first."""
+    entries = [e for e in reversed(_history) if kind is None or e['kind'] == kind]
+    return entries[:limit]
+
+
+def _route():
+    if not has_request_context():
+        return None
+    return {'endpoint': request.endpoint, 'method': request.method, 'path': request.full_path.rstrip('?'),
+            'site': current_site()}
+
+
+def _write(app, entry):
+    _history.append(entry)
+    path = app.config.get('SLOW_QUERY_LOG')
+    if not path:
+        return
+    try:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _file_lock, path.open('a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+    except OSError as e:
+        print(f"Slow query log error: {e}")
+
+
+def _explain(cursor, statement, parameters):
+    """EXPLAIN QUERY PLAN lines of a SELECT, run on a fresh cursor of the same connection."""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        explain = cursor.connection.cursor()
+        try:
+            explain.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+            return [row[3] for row in explain.fetchall()]
+        finally:
+            explain.close()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+
+
+def _params(parameters):
+    text = repr(parameters)
+    return text if len(text) <= 500 else text[:500] + '...'
+
+
+def _budget_applies(app):
+    return (has_request_context() and 'query_stats' in g
+            and request.endpoint not in app.config.get('QUERY_BUDGET_EXEMPT', ()))
+
+
+def _over_budget(app, stats):
+    config = app.config
+    count, budget_ms = config.get('QUERY_BUDGET_COUNT'), config.get('QUERY_BUDGET_MS')
+    return bool((count and stats['count'] > count) or (budget_ms and stats['ms'] > budget_ms))
+
+
+def init_app(app):
+    config = app.config
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = {'count': 0, 'ms': 0.0, 'statements': Counter(), 'rejected': False}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if (config.get('QUERY_BUDGET_MODE') == 'reject' and _budget_applies(app)
+                and _over_budget(app, g.query_stats)):
+            g.query_stats['rejected'] = True
+            raise QueryBudgetExceeded()
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        ms = (time.perf_counter() - started) * 1000
+
+        if has_request_context() and 'query_stats' in g:
+            stats = g.query_stats
+            stats['count'] += 1
+            stats['ms'] += ms
+            stats['statements'][statement] += 1
+
+        threshold = config.get('SLOW_QUERY_MS')
+        if threshold is not None and ms >= threshold:
+            _write(app, {
+                'kind': 'slow',
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'ms': round(ms, 1),
+                'statement': statement[:STATEMENT_CHARS],
+                'params': _params(parameters),
+                'plan': None if executemany else _explain(cursor, statement, parameters),
+                'route': _route(),
+            })
+
+    def handle_error(exception_context):
+        # Keep the timing stack balanced when a statement fails
+        started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+        if started:
+            started.pop()
+
+    # Every site's engine (app.services.sites), not only the default one
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(engine, 'handle_error', handle_error)
+
+    @app.after_request
+    def check_query_budget(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        response.headers.add('Server-Timing', f'db;dur={stats["ms"]:.1f};desc="{stats["count"]} queries"')
+        if _budget_applies(app) and _over_budget(app, stats):
+            _write(app, {
+                'kind': 'budget',
+                'at': datetime.now().isoformat(timespec='seconds'),
+                'count': stats['count'],
+                'ms': round(stats['ms'], 1),
+                'rejected': stats['rejected'],
+                'top_statements': [{'count': n, 'statement': s[:STATEMENT_CHARS]}
+                                   for s, n in stats['statements'].most_common(TOP_STATEMENTS)],
+                'route': _route(),
+            })
+        return response
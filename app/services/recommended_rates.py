@@ -0,0 +1,231 @@
+"""
+Recommended rate index (wydajnosci_zalecane).
+
+For every (kod_detalu, nr_instrukcji) the historical parts/hour of its
+reports is summarized as 25th/50th/75th percentiles; `zalecana` is the
+RECOMMENDED_RATE_PERCENTILE of them. Rows with kod_detalu = '' cover all
+parts of an instruction and are the fallback while a report's part is not
+known yet. Only the keys touched by a report change or MOSYS enrichment are
+recomputed; the create form reads the index through lookup().
+
+target_rate() is the SQL counterpart: the typed zalecana_wydajnosc, else
+the index, so efficiency can be aggregated over reports that have no
+recommended rate of their own.
+"""
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from app import db
+from app.models import DaneRaportu, WydajnoscZalecana
+from app.services import archive
+from app.signals import report_changed, mosys_enriched
+
+ALL_PARTS = ''
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of sorted values (pct 0-100)."""
+    if not values:
+        return None
+    position = (len(values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _params():
+    config = current_app.config
+    return config.get('RECOMMENDED_RATE_PERCENTILE', 50), config.get('RECOMMENDED_RATE_MIN_SAMPLES', 3)
+
+
+def _entry(kod_detalu, nr_instrukcji, rates, params):
+    """Index row for one key from its (unsorted) rates, or None below the sample minimum."""
+    pct, min_samples = params
+    if len(rates) < min_samples:
+        return None
+    rates = sorted(rates)
+    return WydajnoscZalecana(
+        kod_detalu=kod_detalu, nr_instrukcji=nr_instrukcji, n=len(rates),
+        p25=percentile(rates, 25), p50=percentile(rates, 50), p75=percentile(rates, 75),
+        zalecana=percentile(rates, pct)
+    )
+
+
+def _rates_query():
+    return select(
+        func.coalesce(DaneRaportu.kod_detalu, ALL_PARTS), DaneRaportu.nr_instrukcji,
+        DaneRaportu.ilosc_detali_sprawdzonych * 1.0 / DaneRaportu.czas_pracy
+    ).where(
+        DaneRaportu.czas_pracy > 0,
+        DaneRaportu.ilosc_detali_sprawdzonych > 0,
+        DaneRaportu.nr_instrukcji.isnot(None),
+        DaneRaportu.nr_instrukcji != '',
+    )
+
+
+def rebuild():
+    """Recompute the whole index in one pass over the reports and commit. Returns the row count."""
+    params = _params()
+    per_instruction = {}
+    entries = []
+    # Archived years count too; the scope ends before anything is written
+    with archive.scope():
+        rows = db.session.execute(_rates_query().order_by(DaneRaportu.kod_detalu, DaneRaportu.nr_instrukcji))
+        for (kod_detalu, nr_instrukcji), group in groupby(rows, key=lambda row: (row[0], row[1])):
+            rates = [row[2] for row in group]
+            per_instruction.setdefault(nr_instrukcji, []).extend(rates)
+            if kod_detalu != ALL_PARTS:
+                entries.append(_entry(kod_detalu, nr_instrukcji, rates, params))
+    entries.extend(_entry(ALL_PARTS, nr_instrukcji, rates, params)
+                   for nr_instrukcji, rates in per_instruction.items())
+    entries = [entry for entry in entries if entry is not None]
+
+    db.session.execute(delete(WydajnoscZalecana))
+    db.session.add_all(entries)
+    db.session.commit()
+    return len(entries)
+
+
+def refresh_keys(keys):
+    """Recompute the given (kod_detalu, nr_instrukcji) keys (and their instructions) and commit."""
+    keys = {(kod or ALL_PARTS, instr) for kod, instr in keys if instr}
+    if not keys:
+        return
+    keys |= {(ALL_PARTS, instr) for _, instr in keys}
+    params = _params()
+    entries = {}
+    with archive.scope():
+        for kod_detalu, nr_instrukcji in keys:
+            query = _rates_query().where(DaneRaportu.nr_instrukcji == nr_instrukcji)
+            if kod_detalu != ALL_PARTS:
+                query = query.where(DaneRaportu.kod_detalu == kod_detalu)
+            entries[(kod_detalu, nr_instrukcji)] = _entry(
+                kod_detalu, nr_instrukcji, [row[2] for row in db.session.execute(query)], params
+            )
+    for (kod_detalu, nr_instrukcji), entry in entries.items():
+        db.session.execute(delete(WydajnoscZalecana).where(
+            WydajnoscZalecana.kod_detalu == kod_detalu, WydajnoscZalecana.nr_instrukcji == nr_instrukcji
+        ))
+        if entry is not None:
+            db.session.add(entry)
+    db.session.commit()
+
+
+def ensure_recommended_rates():
+    """Build the index on first start. Returns True if built."""
+    if db.session.query(WydajnoscZalecana.kod_detalu).limit(1).first() is not None:
+        db.session.rollback()
+        return False
+    rebuild()
+    return True
+
+
+def _part_for_nc(nr_niezgodnosci):
+    """kod_detalu already stored for an NC by an earlier report, if any."""
+    return db.session.scalar(
+        select(DaneRaportu.kod_detalu)
+        .where(DaneRaportu.nr_niezgodnosci == nr_niezgodnosci, DaneRaportu.kod_detalu.isnot(None))
+        .limit(1)
+    )
+
+
+def lookup(nr_instrukcji, kod_detalu=None, nr_niezgodnosci=None):
+    """
+    Recommended rate for a new report as a dict, or None.
+
+    The part is taken from an earlier report of the same NC when not given;
+    without a part (or with too few reports of it) the instruction-wide
+    rate is returned, marked with zrodlo='instrukcja'.
+    """
+    if not nr_instrukcji:
+        return None
+    if not kod_detalu and nr_niezgodnosci:
+        kod_detalu = _part_for_nc(nr_niezgodnosci)
+    entry = db.session.get(WydajnoscZalecana, (kod_detalu, nr_instrukcji)) if kod_detalu else None
+    source = 'kod_detalu'
+    if entry is None:
+        entry = db.session.get(WydajnoscZalecana, (ALL_PARTS, nr_instrukcji))
+        source = 'instrukcja'
+    if entry is None:
+        return None
+    return {
+        'kod_detalu': kod_detalu,
+        'nr_instrukcji': nr_instrukcji,
+        'zrodlo': source,
+        'zalecana': round(entry.zalecana, 1),
+        'p25': round(entry.p25, 1),
+        'p50': round(entry.p50, 1),
+        'p75': round(entry.p75, 1),
+        'n': entry.n,
+    }
+
+
+def target_rate(entity=DaneRaportu):
+    """SQL expression: typed zalecana_wydajnosc, else the part's index rate, else the instruction's."""
+    per_part = select(WydajnoscZalecana.zalecana).where(
+        WydajnoscZalecana.kod_detalu == entity.kod_detalu,
+        WydajnoscZalecana.nr_instrukcji == entity.nr_instrukcji,
+    ).scalar_subquery()
+    per_instruction = select(WydajnoscZalecana.zalecana).where(
+        WydajnoscZalecana.kod_detalu == ALL_PARTS,
+        WydajnoscZalecana.nr_instrukcji == entity.nr_instrukcji,
+    ).scalar_subquery()
+    return func.coalesce(func.nullif(entity.zalecana_wydajnosc, 0), per_part, per_instruction)
+
+
+def efficiency_totals(query_filter=None):
+    """
+    (parts checked, expected parts = hours x target rate) over the reports with
+    a target passing `query_filter` - the terms of efficiency(), so results of
+    several databases can be summed before dividing.
+    """
+    target = target_rate()
+    query = db.session.query(
+        func.sum(DaneRaportu.ilosc_detali_sprawdzonych),
+        func.sum(DaneRaportu.czas_pracy * target),
+    ).filter(target > 0, DaneRaportu.czas_pracy > 0)
+    if query_filter is not None:
+        query = query_filter(query)
+    parts, expected = query.one()
+    return parts or 0, expected or 0
+
+
+def efficiency(query_filter=None):
+    """
+    Overall efficiency % (parts checked / (hours x target rate)) over the reports
+    passing `query_filter` (a callable applied to the query), or None without targets.
+    """
+    parts, expected = efficiency_totals(query_filter)
+    return parts * 100.0 / expected if expected else None
+
+
+def _keys(snapshots):
+    return {(s.get('kod_detalu'), s.get('nr_instrukcji')) for s in snapshots if s}
+
+
+def _on_report_changed(sender, change, **kwargs):
+    try:
+        refresh_keys(_keys((change.before, change.after)))
+    except Exception as e:
+        print(f"Recommended rate refresh error: {e}")
+        db.session.rollback()
+
+
+def _on_mosys_enriched(sender, nr_list, **kwargs):
+    try:
+        keys = set()
+        for start in range(0, len(nr_list), 500):
+            keys.update(db.session.execute(
+                select(DaneRaportu.kod_detalu, DaneRaportu.nr_instrukcji).distinct()
+                .where(DaneRaportu.nr_niezgodnosci.in_(nr_list[start:start + 500]))
+            ))
+        refresh_keys(keys)
+    except Exception as e:
+        print(f"Recommended rate refresh error: {e}")
+        db.session.rollback()
+
+
+report_changed.connect(_on_report_changed)
+mosys_enriched.connect(_on_mosys_enriched)
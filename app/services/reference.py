@@ -0,0 +1,91 @@
+"""
+In-process cache of reference data (operators and departments).
+
+Form pages and validation read plain immutable copies from here instead of
+querying on every request. The cache is dropped on reference_changed, which
+operator and category writes send after commit; its version stamp doubles
+as the ETag of the JSON endpoint so browsers can cache selects too.
+"""
+import uuid
+from dataclasses import dataclass, asdict
+
+from sqlalchemy.orm import joinedload
+
+from app.models import Operator, KategoriaZrodlaDanych
+from app.services.cache import ResultCache
+from app.signals import reference_changed
+from app.site_routing import current_site
+
+# Distinguishes cache versions of different processes / restarts
+_INSTANCE = uuid.uuid4().hex[:8]
+
+_cache = ResultCache('reference')
+reference_changed.connect(_cache.invalidate)
+
+
+@dataclass(frozen=True)
+class DzialRef:
+    id: int
+    opis_kategorii: str
+    koszt_pracy: float
+
+
+@dataclass(frozen=True)
+class OperatorRef:
+    id: int
+    nr_operatora: int
+    imie_nazwisko: str
+    dzial_id: int
+    dzial: DzialRef
+
+
+def _dzial_ref(category):
+    return DzialRef(category.id, category.opis_kategorii, category.koszt_pracy) if category else None
+
+
+def _load():
+    operators = Operator.query.options(joinedload(Operator.dzial)).order_by(Operator.id).all()
+    categories = KategoriaZrodlaDanych.query.order_by(KategoriaZrodlaDanych.id).all()
+    data = {
+        'operators': tuple(
+            OperatorRef(op.id, op.nr_operatora, op.imie_nazwisko, op.dzial_id, _dzial_ref(op.dzial))
+            for op in operators
+        ),
+        'categories': tuple(_dzial_ref(category) for category in categories),
+    }
+    data['operator_ids'] = frozenset(op.id for op in data['operators'])
+    return data
+
+
+def _data():
+    return _cache.get_or_compute('all', _load)
+
+
+def get_operators():
+    """All operators (with their department), ordered by id."""
+    return _data()['operators']
+
+
+def get_operator_ids():
+    """Set of existing operator ids, for validating submitted reports."""
+    return _data()['operator_ids']
+
+
+def get_categories():
+    """All departments, ordered by id."""
+    return _data()['categories']
+
+
+def etag():
+    """ETag of the active site's current reference data (IDs differ between plant databases)."""
+    return f'ref-{_INSTANCE}-{current_site() or "default"}-{_cache.version}'
+
+
+def as_json():
+    """(etag, payload) - the tag is read first, so it is never newer than the data."""
+    tag = etag()
+    return tag, {
+        'version': tag,
+        'operators': [asdict(op) for op in get_operators()],
+        'dzialy': [asdict(category) for category in get_categories()],
+    }
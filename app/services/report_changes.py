@@ -0,0 +1,117 @@
+"""
+Change detection for report edits.
+
+Instead of deleting and re-inserting every defect on save, the edit view
+diffs the submitted form against the stored report and writes only what
+actually changed. The resulting ReportChange is broadcast via app.signals.
+"""
+from app import db
+from app.models import BrakiDefektyRaportu
+from app.services.defect_types import resolve_defect_types
+from app.signals import ReportChange
+
+REPORT_FIELDS = (
+    'nr_raportu', 'operator_id', 'nr_niezgodnosci', 'data_niezgodnosci',
+    'nr_zamowienia', 'kod_detalu', 'nr_instrukcji', 'selekcja_na_biezaco',
+    'ilosc_detali_sprawdzonych', 'zalecana_wydajnosc', 'czas_pracy',
+    'uwagi', 'uwagi_do_wydajnosci', 'data_selekcji'
+)
+
+
+def report_snapshot(report, defects=None):
+    """Plain-dict copy of a report (ORM object or values dict) and its defects."""
+    if isinstance(report, dict):
+        snapshot = {name: report.get(name) for name in REPORT_FIELDS}
+        snapshot['id'] = report.get('id')
+    else:
+        snapshot = {name: getattr(report, name) for name in REPORT_FIELDS}
+        snapshot['id'] = report.id
+        if defects is None:
+            defects = [(d.defekt, d.ilosc) for d in report.braki_defekty]
+    snapshot['defekty'] = list(defects or [])
+    snapshot['total_defects'] = sum(ilosc or 0 for _, ilosc in snapshot['defekty'])
+    return snapshot
+
+
+def _same(old, new):
+    # Forms submit '' for text fields stored as NULL - not a real change
+    if isinstance(old, (str, type(None))) and isinstance(new, (str, type(None))):
+        return (old or '') == (new or '')
+    return old == new
+
+
+def diff_fields(report, values):
+    """Return {field: (old, new)} for submitted values that differ from the report."""
+    return {
+        name: (getattr(report, name), value)
+        for name, value in values.items()
+        if not _same(getattr(report, name), value)
+    }
+
+
+def diff_defects(stored, submitted):
+    """
+    Match submitted (defekt, ilosc) pairs against stored defect rows by name.
+
+    Returns {'added': [(defekt, None, ilosc)], 'updated': [(row, old, new)],
+    'removed': [row]} - an empty diff means the defects are unchanged.
+    """
+    by_name = {}
+    for row in stored:
+        by_name.setdefault(row.defekt, []).append(row)
+
+    added, updated = [], []
+    for name, ilosc in submitted:
+        rows = by_name.get(name)
+        if rows:
+            row = rows.pop(0)
+            if row.ilosc != ilosc:
+                updated.append((row, row.ilosc, ilosc))
+        else:
+            added.append((name, None, ilosc))
+
+    removed = [row for rows in by_name.values() for row in rows]
+    return {'added': added, 'updated': updated, 'removed': removed}
+
+
+def apply_report_edit(report, values, submitted_defects):
+    """
+    Apply only the differences between the stored report and the submission.
+
+    Returns a ReportChange, or None when nothing changed (nothing is written).
+    The caller commits and broadcasts the change.
+    """
+    changes = diff_fields(report, values)
+    defect_diff = diff_defects(report.braki_defekty, submitted_defects)
+    if not changes and not any(defect_diff.values()):
+        return None
+
+    before = report_snapshot(report)
+
+    for name, (_, new) in changes.items():
+        setattr(report, name, new)
+
+    for row, _, new in defect_diff['updated']:
+        row.ilosc = new
+    for row in defect_diff['removed']:
+        report.braki_defekty.remove(row)
+    type_ids = resolve_defect_types([name for name, _, _ in defect_diff['added']])
+    for name, _, ilosc in defect_diff['added']:
+        report.braki_defekty.append(
+            BrakiDefektyRaportu(defekt=name, defekt_typ_id=type_ids.get(name), ilosc=ilosc)
+        )
+
+    defects = {
+        'added': defect_diff['added'],
+        'updated': [(row.defekt, old, new) for row, old, new in defect_diff['updated']],
+        'removed': [(row.defekt, row.ilosc, None) for row in defect_diff['removed']],
+    }
+    db.session.flush()
+    return ReportChange(
+        action='updated',
+        report_id=report.id,
+        before=before,
+        after=report_snapshot(report),
+        changes=changes,
+        defects=defects
+    )
@@ -0,0 +1,142 @@
+"""
+Daily rollup of reports (raporty_dzienne).
+
+One row per (data_selekcji, operator, kod_detalu, nr_zamowienia) with the
+number of reports, parts checked, hours and defects. Pivots at that grain
+or coarser read the rollup instead of scanning every report. Only the
+days touched by a change are re-aggregated; a full rebuild runs at
+startup when the rollup no longer matches dane_z_raportow group by group
+(e.g. after an import or sync script changed reports outside the app).
+Aggregation reads through an archive scope, so days whose reports were
+moved to the yearly archives keep their rollup rows.
+"""
+from datetime import date
+
+from sqlalchemy import delete, func, insert, literal, or_, select
+
+from app import db
+from app.models import DaneRaportu, BrakiDefektyRaportu, RaportDzienny
+from app.services import archive
+from app.signals import report_changed, mosys_enriched
+
+# Columns of dane_z_raportow kept in the rollup grain
+GRAIN = ('data_selekcji', 'operator_id', 'kod_detalu', 'nr_zamowienia')
+
+
+def _grouped(condition=None):
+    """SELECT of the rollup rows (grain, reports, parts, hours, defects) of the reports matching `condition`."""
+    braki = select(func.coalesce(func.sum(BrakiDefektyRaportu.ilosc), 0)).where(
+        BrakiDefektyRaportu.raport_id == DaneRaportu.id
+    ).scalar_subquery()
+    grain = [getattr(DaneRaportu, column) for column in GRAIN]
+    query = select(
+        *grain,
+        func.count(DaneRaportu.id),
+        func.coalesce(func.sum(DaneRaportu.ilosc_detali_sprawdzonych), 0),
+        func.coalesce(func.sum(DaneRaportu.czas_pracy), 0),
+        func.coalesce(func.sum(braki), 0),
+    ).group_by(*grain)
+    if condition is not None:
+        query = query.where(condition)
+    return query
+
+
+def _aggregate(condition=None):
+    """INSERT ... SELECT re-aggregating the reports matching `condition`."""
+    return insert(RaportDzienny).from_select(
+        [*GRAIN, 'raporty', 'ilosc_detali', 'czas_pracy', 'braki'], _grouped(condition)
+    )
+
+
+def _date_condition(column, dates):
+    dates = set(dates)
+    known = [d for d in dates if d is not None]
+    conditions = [column.in_(known)] if known else []
+    if None in dates:
+        conditions.append(column.is_(None))
+    return or_(*conditions)
+
+
+def refresh_dates(dates):
+    """Re-aggregate the rollup for the given data_selekcji values and commit."""
+    dates = set(dates)
+    if not dates:
+        return
+    known = [d for d in dates if d is not None]
+    with archive.scope(min(known, default=None), max(known, default=None)):
+        db.session.execute(delete(RaportDzienny).where(_date_condition(RaportDzienny.data_selekcji, dates)))
+        db.session.execute(_aggregate(_date_condition(DaneRaportu.data_selekcji, dates)))
+    db.session.commit()
+
+
+def rebuild():
+    """Rebuild the whole rollup and commit."""
+    with archive.scope():
+        db.session.execute(delete(RaportDzienny))
+        db.session.execute(_aggregate())
+    db.session.commit()
+
+
+def _any(query):
+    return db.session.execute(select(literal(1)).select_from(query.subquery()).limit(1)).first() is not None
+
+
+def _rounded(query):
+    """Hours rounded, so float sums compare equal."""
+    columns = list(query.selected_columns)
+    columns[len(GRAIN) + 2] = func.round(columns[len(GRAIN) + 2], 6)
+    return query.with_only_columns(*columns)
+
+
+def ensure_rollup():
+    """
+    Rebuild when any rollup row (grain, reports, parts, hours, defects) differs
+    from the reports (live + archived), e.g. after a script changed kod_detalu,
+    nr_zamowienia or czas_pracy. Returns True if rebuilt.
+    """
+    rolled = _rounded(select(
+        *[getattr(RaportDzienny, column) for column in GRAIN],
+        RaportDzienny.raporty, RaportDzienny.ilosc_detali, RaportDzienny.czas_pracy, RaportDzienny.braki,
+    ))
+    with archive.scope():
+        live = _rounded(_grouped())
+        stale = _any(live.except_(rolled)) or _any(rolled.except_(live))
+    if not stale:
+        db.session.rollback()
+        return False
+    rebuild()
+    return True
+
+
+def _parse_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+def _on_report_changed(sender, change, **kwargs):
+    dates = {_parse_date(snapshot.get('data_selekcji'))
+             for snapshot in (change.before, change.after) if snapshot}
+    try:
+        refresh_dates(dates)
+    except Exception as e:
+        print(f"Rollup refresh error: {e}")
+        db.session.rollback()
+
+
+def _on_mosys_enriched(sender, nr_list, **kwargs):
+    try:
+        dates = set()
+        for start in range(0, len(nr_list), 500):
+            dates.update(db.session.scalars(
+                select(DaneRaportu.data_selekcji).distinct()
+                .where(DaneRaportu.nr_niezgodnosci.in_(nr_list[start:start + 500]))
+            ))
+        refresh_dates(dates)
+    except Exception as e:
+        print(f"Rollup refresh error: {e}")
+        db.session.rollback()
+
+
+report_changed.connect(_on_report_changed)
+mosys_enriched.connect(_on_mosys_enriched)
@@ -0,0 +1,258 @@
+"""
+Multi-site (one database per plant) support.
+
+SITES_FILE is a JSON object of the plants served by this app:
+
+    {
+        "zaklad1": {"nazwa": "Zakład 1", "db": "/data/zaklad1/scrap_data.db",
+                    "mosys_dsn": "STAAMP_DB"},
+        "zaklad2": {"nazwa": "Zakład 2", "db": "/data/zaklad2/scrap_data.db",
+                    "mosys_dsn": "STAAMP_Z2", "mirror_db": "/data/zaklad2/mosys.db",
+                    "archive_dir": "/data/zaklad2/archive",
+                    "backup_dir": "/data/zaklad2/backups",
+                    "snapshot_dir": "/data/zaklad2/snapshot"}
+    }
+
+The first site (or DEFAULT_SITE) is the default database
+(SQLALCHEMY_DATABASE_URI); every other site is an SQLALCHEMY_BINDS entry of
+the same name, and db.session is routed to it while the site is active
+(app.site_routing). A request's site comes from ?site= or the cookie set by
+the selector. Each site keeps its own MOSYS DSN, MOSYS mirror (default: its
+own database), archive directory (default: archive/ next to its database),
+backup directory (default: backups/<key>/ next to its database), Parquet
+snapshot directory (default: snapshot/ next to its database) and
+in-process caches. Without a SITES_FILE the app serves one database as
+before and every helper here is a no-op.
+
+federated() runs a function for every site concurrently, each in its own
+thread, app context and session, so cross-plant views (app.services.kpis)
+merge per-site results instead of copying data into one database.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from flask import current_app, g, has_app_context, redirect, request, url_for
+
+from app import db
+from app.site_routing import current_site, using_site
+
+SITE_COOKIE = 'site'
+COOKIE_MAX_AGE = 365 * 24 * 3600
+
+
+def load_sites(path):
+    """{key: {'nazwa', 'db', 'mosys_dsn', 'mirror_db', 'archive_dir', 'backup_dir', 'snapshot_dir'}} from a sites file ({} if absent)."""
+    if not path or not Path(path).is_file():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    sites = {}
+    for key, site in raw.items():
+        if not site.get('db'):
+            raise ValueError(f'Site {key}: "db" is required')
+        sites[key] = {
+            'nazwa': site.get('nazwa') or key,
+            'db': str(Path(site['db'])),
+            'mosys_dsn': site.get('mosys_dsn'),
+            'mirror_db': site.get('mirror_db'),
+            'archive_dir': site.get('archive_dir'),
+            'backup_dir': site.get('backup_dir'),
+            'snapshot_dir': site.get('snapshot_dir'),
+        }
+    return sites
+
+
+def resolve_site(sites, key, default=None):
+    """
+    Settings of site `key` with the per-site defaults filled in: mirror_db,
+    archive_dir, backup_dir and snapshot_dir are None where the global
+    setting applies (MOSYS_MIRROR_DB, ARCHIVE_DIR, BACKUP_DIR, SNAPSHOT_DIR -
+    the default site unless configured). Other sites keep their mirror in
+    their own database and their archive in archive/, backups in
+    backups/<key>/ and snapshot in snapshot/ next to it, so nothing is
+    shared with another plant. Raises KeyError for unknown keys.
+    """
+    site = sites[key]
+    if default not in sites:
+        default = next(iter(sites))
+    own = key != default
+    folder = Path(site['db']).parent
+    return {
+        **site,
+        'key': key,
+        'mirror_db': site['mirror_db'] or (site['db'] if own else None),
+        'archive_dir': Path(site['archive_dir']) if site['archive_dir'] else (folder / 'archive' if own else None),
+        'backup_dir': Path(site['backup_dir']) if site['backup_dir'] else (folder / 'backups' / key if own else None),
+        'snapshot_dir': Path(site['snapshot_dir']) if site['snapshot_dir'] else (folder / 'snapshot' if own else None),
+    }
+
+
+def configured_site(key):
+    """resolve_site() from Config's SITES_FILE, for command-line scripts that run without the app."""
+    from app.config import Config
+    sites = load_sites(Config.SITES_FILE)
+    if key not in sites:
+        raise KeyError(f'Unknown site {key!r} (sites: {", ".join(sites) or "none"})')
+    return resolve_site(sites, key, Config.DEFAULT_SITE)
+
+
+def _uri(path):
+    return f'sqlite:///{Path(path).resolve()}'
+
+
+def _config():
+    return current_app.config
+
+
+def site_keys():
+    """Configured site keys in order, or [None] for a single-database app."""
+    return list(_config().get('SITES') or {}) or [None]
+
+
+def site_name(key):
+    sites = _config().get('SITES') or {}
+    return sites[key]['nazwa'] if key in sites else None
+
+
+def current_key():
+    """Key of the active site (the default site unless another one is active); None without sites."""
+    return current_site() or _config().get('DEFAULT_SITE')
+
+
+def _current():
+    sites = _config().get('SITES') or {}
+    key = current_key()
+    return resolve_site(sites, key, _config().get('DEFAULT_SITE')) if key in sites else {}
+
+
+def engine():
+    """Engine of the active site."""
+    return db.engines.get(current_site()) or db.engine
+
+
+def archive_dir():
+    """Archive directory of the active site (ARCHIVE_DIR for the default one unless configured)."""
+    return _current().get('archive_dir') or Path(_config().get('ARCHIVE_DIR', 'archive'))
+
+
+def backup_dir():
+    """Backup directory of the active site, or None for db_backup.BACKUP_DIR."""
+    return _current().get('backup_dir')
+
+
+def snapshot_dir():
+    """Parquet snapshot directory of the active site (SNAPSHOT_DIR for the default one unless configured)."""
+    return _current().get('snapshot_dir') or Path(_config().get('SNAPSHOT_DIR', 'snapshot'))
+
+
+def mosys_contexts(stack, site):
+    """Enter the MOSYS DSN and mirror database of a resolved `site` on `stack`."""
+    from mosys_mirror import use_mirror
+    stack.enter_context(use_mirror(site['mirror_db']))
+    if site.get('mosys_dsn'):
+        try:
+            from MOSYS_data_functions import use_dsn
+        except ImportError as e:
+            print(f"MOSYS DSN for site not set: {e}")
+            return
+        stack.enter_context(use_dsn(site['mosys_dsn']))
+
+
+@contextmanager
+def activate(key):
+    """
+    Make `key` the active site: db.session, MOSYS DSN, mirror and caches.
+    Needs an app context; the session is reset when the database changes, so
+    don't enter it with uncommitted work.
+    """
+    sites = _config().get('SITES') or {}
+    if key is None or key not in sites:
+        yield None
+        return
+    routed = None if key == _config().get('DEFAULT_SITE') else key
+    switching = routed != current_site()
+    if switching:
+        db.session.remove()
+    with ExitStack() as stack:
+        stack.enter_context(using_site(routed))
+        mosys_contexts(stack, resolve_site(sites, key, _config().get('DEFAULT_SITE')))
+        try:
+            yield key
+        finally:
+            if switching and has_app_context():
+                db.session.remove()
+
+
+def federated(func, keys=None):
+    """
+    func() run once per site, concurrently (FEDERATION_WORKERS threads).
+    Returns [(key, result, error)] in site order; a failing site reports its
+    error instead of failing the others.
+    """
+    keys = keys or site_keys()
+    if keys == [None]:
+        return [(None, func(), None)]
+    app = current_app._get_current_object()
+
+    def run(key):
+        with app.app_context(), activate(key):
+            try:
+                return key, func(), None
+            except Exception as e:
+                print(f"Federated query error ({key}): {e}")
+                db.session.rollback()
+                return key, None, str(e)
+
+    workers = max(1, min(len(keys), app.config.get('FEDERATION_WORKERS', 4)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='site') as pool:
+        return list(pool.map(run, keys))
+
+
+def init_app(app):
+    """Register the sites as binds (call before db.init_app) and select a site per request."""
+    config = app.config
+    sites = config.get('SITES') or load_sites(config.get('SITES_FILE'))
+    config['SITES'] = sites
+    if not sites:
+        return
+    default = config.get('DEFAULT_SITE')
+    if default not in sites:
+        default = next(iter(sites))
+    config['DEFAULT_SITE'] = default
+    config['SQLALCHEMY_DATABASE_URI'] = _uri(sites[default]['db'])
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({key: _uri(site['db']) for key, site in sites.items() if key != default})
+    config['SQLALCHEMY_BINDS'] = binds
+
+    @app.before_request
+    def select_site():
+        key = request.args.get('site') or request.cookies.get(SITE_COOKIE)
+        stack = ExitStack()
+        stack.enter_context(activate(key if key in sites else default))
+        g.site_context = stack
+
+    @app.teardown_request
+    def release_site(exception=None):
+        stack = g.pop('site_context', None)
+        if stack is not None:
+            stack.close()
+
+    @app.context_processor
+    def inject_sites():
+        return {
+            'sites': [(key, site['nazwa']) for key, site in sites.items()],
+            'current_site': current_key(),
+        }
+
+    def choose_site(key):
+        """Remember the chosen site in a cookie and go back to the page the selector was on."""
+        referrer = request.referrer
+        response = redirect(referrer if referrer and referrer.startswith(request.host_url)
+                            else url_for('main.index'))
+        if key in sites:
+            response.set_cookie(SITE_COOKIE, key, max_age=COOKIE_MAX_AGE, samesite='Lax')
+        return response
+
+    app.add_url_rule('/site/<key>', 'choose_site', choose_site)
@@ -0,0 +1,208 @@
+"""
+Columnar Parquet snapshot of the report data.
+
+Two datasets are written under SNAPSHOT_DIR, partitioned by the month of
+data_selekcji (hive layout, ``reports/year=2024/month=3/part-0.parquet``):
+
+- reports: dane_z_raportow joined with operator, department and the
+  report's total defects
+- defects: braki_defekty_raportow joined with the report dimensions
+
+Refresh is incremental: each partition has a fingerprint (checksum of its
+rows plus the reference tables) kept in manifest.json, and only partitions
+whose fingerprint changed are rewritten. Works on a plain sqlite3
+connection, so it can run outside the app (see export_snapshot.py).
+Requires pyarrow.
+"""
+import json
+import os
+import shutil
+import time
+import zlib
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = pq = None
+
+from app.config import Config
+
+MANIFEST = 'manifest.json'
+
+# Month key of a report; reports without a date land in year=0/month=0
+_OKRES = "COALESCE(substr(r.data_selekcji, 1, 7), '0000-00')"
+
+REPORTS_SQL = f'''
+    SELECT r.id, r.nr_raportu, r.data_selekcji,
+           r.operator_id, o.nr_operatora, o.imie_nazwisko AS operator,
+           o.dzial_id, d.opis_kategorii AS dzial, d.koszt_pracy,
+           r.nr_niezgodnosci, r.data_niezgodnosci, r.nr_zamowienia, r.kod_detalu,
+           r.nr_instrukcji, r.selekcja_na_biezaco,
+           r.ilosc_detali_sprawdzonych, r.czas_pracy, r.zalecana_wydajnosc,
+           COALESCE(b.total_defects, 0) AS total_defects
+    FROM dane_z_raportow r
+    LEFT JOIN operatorzy o ON o.id = r.operator_id
+    LEFT JOIN dzialy d ON d.id = o.dzial_id
+    LEFT JOIN (
+        SELECT raport_id, SUM(ilosc) AS total_defects
+        FROM braki_defekty_raportow GROUP BY raport_id
+    ) b ON b.raport_id = r.id
+    WHERE {_OKRES} = ?
+'''
+
+DEFECTS_SQL = f'''
+    SELECT b.id, b.raport_id, r.data_selekcji,
+           r.operator_id, o.dzial_id, d.opis_kategorii AS dzial,
+           r.kod_detalu, r.nr_zamowienia,
+           {{typ_id}} AS defekt_typ_id, {{nazwa}} AS defekt, b.ilosc
+    FROM braki_defekty_raportow b
+    JOIN dane_z_raportow r ON r.id = b.raport_id
+    LEFT JOIN operatorzy o ON o.id = r.operator_id
+    LEFT JOIN dzialy d ON d.id = o.dzial_id
+    {{typ_join}}
+    WHERE {_OKRES} = ?
+'''
+
+FINGERPRINT_SQL = {
+    # The per-report defect aggregate is included because reports carry total_defects
+    'reports': f'''
+        SELECT {_OKRES}, COUNT(*), SUM(row_crc(
+            r.id, r.nr_raportu, r.data_selekcji, r.operator_id, r.nr_niezgodnosci,
+            r.data_niezgodnosci, r.nr_zamowienia, r.kod_detalu, r.nr_instrukcji,
+            r.selekcja_na_biezaco, r.ilosc_detali_sprawdzonych, r.czas_pracy,
+            r.zalecana_wydajnosc, b.total_defects, b.defect_rows))
+        FROM dane_z_raportow r
+        LEFT JOIN (
+            SELECT raport_id, SUM(ilosc) AS total_defects, COUNT(id) AS defect_rows
+            FROM braki_defekty_raportow GROUP BY raport_id
+        ) b ON b.raport_id = r.id
+        GROUP BY 1
+    ''',
+    # Report columns are included because defect rows carry report dimensions
+    'defects': f'''
+        SELECT {_OKRES}, COUNT(*), SUM(row_crc(
+            b.id, b.raport_id, b.defekt, {{typ_id}}, b.ilosc,
+            r.data_selekcji, r.operator_id, r.kod_detalu, r.nr_zamowienia))
+        FROM braki_defekty_raportow b
+        JOIN dane_z_raportow r ON r.id = b.raport_id
+        GROUP BY 1
+    ''',
+}
+
+REFERENCE_SQL = '''
+    SELECT
+        (SELECT TOTAL(row_crc(id, nr_operatora, imie_nazwisko, dzial_id)) FROM operatorzy),
+        (SELECT TOTAL(row_crc(id, opis_kategorii, koszt_pracy)) FROM dzialy)
+        {defect_types}
+'''
+
+
+def _row_crc(*values):
+    return zlib.crc32('\x1f'.join('' if v is None else str(v) for v in values).encode('utf-8'))
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError('Eksport snapshotu wymaga pakietu pyarrow (pip install pyarrow).')
+
+
+def _has_defect_types(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(braki_defekty_raportow)')}
+    return 'defekt_typ_id' in columns
+
+
+def _partition_dir(root, dataset, okres):
+    year, month = okres.split('-')
+    return Path(root) / dataset / f'year={int(year)}' / f'month={int(month)}'
+
+
+def _load_manifest(root):
+    path = Path(root) / MANIFEST
+    if path.exists():
+        return json.loads(path.read_text(encoding='utf-8'))
+    return {}
+
+
+def _save_manifest(root, manifest):
+    path = Path(root) / MANIFEST
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+def _to_table(df):
+    for column in ('data_selekcji', 'data_niezgodnosci'):
+        if column in df:
+            df[column] = pd.to_datetime(df[column], errors='coerce').dt.date
+    if 'selekcja_na_biezaco' in df:
+        df['selekcja_na_biezaco'] = df['selekcja_na_biezaco'].astype('boolean')
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _write_partition(root, dataset, okres, df):
+    directory = _partition_dir(root, dataset, okres)
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / 'part-0.parquet'
+    tmp = directory / 'part-0.parquet.tmp'
+    pq.write_table(_to_table(df), tmp, compression='zstd')
+    os.replace(tmp, target)
+
+
+def export_snapshot(conn, root=None, full=False):
+    """
+    Bring the Parquet snapshot in `root` up to date with the database.
+
+    `conn` is a sqlite3 connection. Returns per-dataset counts:
+    {'reports': {'written': n, 'unchanged': n, 'removed': n, 'rows': n}, ...}
+    """
+    _require_pyarrow()
+    root = Path(root or Config.SNAPSHOT_DIR)
+    root.mkdir(parents=True, exist_ok=True)
+    conn.create_function('row_crc', -1, _row_crc, deterministic=True)
+
+    if _has_defect_types(conn):
+        typ_id, nazwa = 'b.defekt_typ_id', 'COALESCE(t.nazwa, b.defekt)'
+        typ_join = 'LEFT JOIN defect_types t ON t.id = b.defekt_typ_id'
+        defect_types = ', (SELECT TOTAL(row_crc(id, nazwa)) FROM defect_types)'
+    else:
+        typ_id, nazwa, typ_join, defect_types = 'NULL', 'b.defekt', '', ''
+
+    reference = conn.execute(REFERENCE_SQL.format(defect_types=defect_types)).fetchone()
+    queries = {
+        'reports': REPORTS_SQL,
+        'defects': DEFECTS_SQL.format(typ_id=typ_id, nazwa=nazwa, typ_join=typ_join),
+    }
+
+    manifest = {} if full else _load_manifest(root)
+    summary = {}
+    for dataset, sql in queries.items():
+        started = time.monotonic()
+        if full:
+            shutil.rmtree(root / dataset, ignore_errors=True)
+        previous = manifest.get(dataset, {})
+        current = {}
+        stats = {'written': 0, 'unchanged': 0, 'removed': 0, 'rows': 0}
+        for okres, count, checksum in conn.execute(FINGERPRINT_SQL[dataset].format(typ_id=typ_id)).fetchall():
+            fingerprint = f'{count}:{checksum}:{":".join(str(v) for v in reference)}'
+            current[okres] = fingerprint
+            stats['rows'] += count
+            if previous.get(okres) == fingerprint and _partition_dir(root, dataset, okres).exists():
+                stats['unchanged'] += 1
+                continue
+            _write_partition(root, dataset, okres, pd.read_sql(sql, conn, params=(okres,)))
+            stats['written'] += 1
+
+        for okres in set(previous) - set(current):
+            shutil.rmtree(_partition_dir(root, dataset, okres), ignore_errors=True)
+            stats['removed'] += 1
+
+        manifest[dataset] = current
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        summary[dataset] = stats
+
+    _save_manifest(root, manifest)
+    return summary
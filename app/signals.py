@@ -0,0 +1,54 @@
+"""
+In-process change notifications.
+
+Routes send these after a successful commit, so caches and aggregates can
+update incrementally instead of recomputing everything. Receivers get the
+app as sender and a ``change`` keyword argument.
+"""
+from dataclasses import dataclass, field
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Sent with change=ReportChange(...) after a report is created, edited or deleted
+report_changed = _signals.signal('report-changed')
+
+# Sent with table='operatorzy' or 'dzialy' after an operator/category write
+reference_changed = _signals.signal('reference-changed')
+
+# Sent with nr_list=[...] after MOSYS data (nr_zamowienia, kod_detalu, ...) was stored for those NCs
+mosys_enriched = _signals.signal('mosys-enriched')
+
+
+@dataclass
+class ReportChange:
+    """One committed write to a report (dane_z_raportow + its defects)."""
+    action: str                 # 'created', 'updated' or 'deleted'
+    report_id: int
+    before: dict = None         # snapshot before the write (None when created)
+    after: dict = None          # snapshot after the write (None when deleted)
+    changes: dict = field(default_factory=dict)   # field -> (old, new)
+    defects: dict = field(default_factory=dict)   # 'added'/'updated'/'removed' -> [(defekt, old, new)]
+
+
+def send_report_changes(changes):
+    """Broadcast committed report changes to all receivers."""
+    from flask import current_app
+    app = current_app._get_current_object()
+    for change in changes:
+        report_changed.send(app, change=change)
+
+
+def send_reference_change(table):
+    """Broadcast a committed write to operators or categories."""
+    from flask import current_app
+    reference_changed.send(current_app._get_current_object(), table=table)
+
+
+def send_mosys_enriched(nr_list):
+    """Broadcast that MOSYS details were committed for these NC numbers."""
+    from flask import current_app
+    nr_list = list(nr_list)
+    if nr_list:
+        mosys_enriched.send(current_app._get_current_object(), nr_list=nr_list)
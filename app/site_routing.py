@@ -0,0 +1,47 @@
+"""
+Per-site engine routing.
+
+Each plant (site) has its own scrap_data.db, registered as an
+SQLALCHEMY_BINDS entry named after the site (see app.services.sites); the
+default site uses SQLALCHEMY_DATABASE_URI. The active site is a context
+variable set per request, per background job and per federated worker, and
+SiteSession sends every statement of db.session to that site's engine, so
+models and queries stay unchanged.
+
+This module does not import the app, so `db` can be created with
+SiteSession before anything else is loaded.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask_sqlalchemy.session import Session
+
+# Bind key of the active site; None means the default database
+_site = ContextVar('site', default=None)
+
+
+def current_site():
+    """Bind key of the active site, or None for the default database."""
+    return _site.get()
+
+
+@contextmanager
+def using_site(site):
+    """Route db.session to `site` (None = default database) inside the block."""
+    token = _site.set(site)
+    try:
+        yield site
+    finally:
+        _site.reset(token)
+
+
+class SiteSession(Session):
+    """db.session that uses the engine of the active site unless a bind is given explicitly."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        site = _site.get()
+        if bind is None and site is not None:
+            engine = self._db.engines.get(site)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,56 @@
+"""
+Move old reports out of the live tables into per-year archive databases.
+
+Usage:
+    python archive_reports.py                     # older than ARCHIVE_AFTER_DAYS
+    python archive_reports.py --before 2025-01-01 # explicit cutoff (exclusive)
+    python archive_reports.py --vacuum            # reclaim the freed space afterwards
+    python archive_reports.py --site zaklad2      # another plant's database and archive (sites.json)
+
+Archived reports stay visible in the dashboard, report views and the daily
+rollup; they can no longer be edited.
+"""
+import argparse
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+sys.path.insert(0, '.')
+
+from app import create_app, db
+from app.services import sites
+from app.services.archive import archive_reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive old reports.')
+    parser.add_argument('--before', help='cutoff date YYYY-MM-DD (reports selected before it are archived)')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM the live database afterwards')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    # Creates the schema and triggers the archive relies on
+    app = create_app()
+    if args.site and args.site not in app.config['SITES']:
+        parser.error(f"Unknown site {args.site!r} (sites: {', '.join(app.config['SITES']) or 'none'})")
+    with app.app_context(), sites.activate(args.site):
+        database = sites.engine().url.database
+        archive_dir = sites.archive_dir()
+        if args.before:
+            cutoff = datetime.strptime(args.before, '%Y-%m-%d').date()
+        else:
+            cutoff = date.today() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+        for engine in db.engines.values():
+            engine.dispose()
+
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        summary = archive_reports(conn, cutoff, archive_dir)
+        if args.vacuum and summary:
+            conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+    if not summary:
+        print(f"No reports before {cutoff.isoformat()}")
+    for year, reports, defects in summary:
+        print(f"{year}: {reports} reports, {defects} defect rows archived")
@@ -0,0 +1,75 @@
+"""
+Hot backups of scrap_data.db (see db_backup.py). Safe to run while run.py is up.
+
+Usage:
+    python backup_database.py                       # one backup, then apply retention
+    python backup_database.py --loop 3600           # backup every hour
+    python backup_database.py --list                # list backups
+    python backup_database.py --verify PATH         # integrity check + trial restore
+    python backup_database.py --restore PATH        # restore (current state is snapshotted first)
+    python backup_database.py --prune [--dry-run]   # apply retention only
+    python backup_database.py --site zaklad2 ...    # another plant's database and backups (sites.json)
+"""
+import argparse
+import sys
+import time
+sys.path.insert(0, '.')
+
+from db_backup import create_backup, list_backups, prune, restore_backup, verify_backup
+
+
+def run_once(label, db_path=None, backup_dir=None):
+    try:
+        info = create_backup(label, db_path=db_path, backup_dir=backup_dir)
+    except Exception as e:
+        print(f"Backup failed: {e}")
+        return False
+    print(f"Backup {info['path']}: {info['size'] // 1024} KB in {info['seconds']}s "
+          f"({info['steps']} steps, {info['restarts']} restarts)")
+    for path in prune(backup_dir):
+        print(f"  removed {path}")
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Back up, verify and restore scrap_data.db.')
+    parser.add_argument('--label', default='manual', help='label in the backup file name')
+    parser.add_argument('--loop', type=int, metavar='SECONDS', help='repeat every SECONDS')
+    parser.add_argument('--list', action='store_true', help='list backups')
+    parser.add_argument('--verify', metavar='PATH', help='verify a backup')
+    parser.add_argument('--restore', metavar='PATH', help='restore a backup into scrap_data.db')
+    parser.add_argument('--prune', action='store_true', help='only apply the retention policy')
+    parser.add_argument('--dry-run', action='store_true', help='with --prune: show what would be removed')
+    parser.add_argument('--site', help='site key from the sites file (default: SCRAP_DB)')
+    args = parser.parse_args()
+
+    db_path = backup_dir = None
+    if args.site:
+        from app.services.sites import configured_site
+        try:
+            site = configured_site(args.site)
+        except KeyError as e:
+            parser.error(e.args[0])
+        db_path, backup_dir = site['db'], site['backup_dir']
+
+    if args.list:
+        for backup in list_backups(backup_dir):
+            print(f"{backup['created']:%Y-%m-%d %H:%M:%S}  {backup['label']:<16} "
+                  f"{backup['size'] // 1024:>8} KB  {backup['path']}")
+    elif args.verify:
+        result = verify_backup(args.verify)
+        print(f"{'OK' if result['ok'] else 'FAILED'}: integrity {result['integrity']}, rows {result['counts']}")
+        sys.exit(0 if result['ok'] else 1)
+    elif args.restore:
+        result = restore_backup(args.restore, db_path=db_path, backup_dir=backup_dir)
+        print(f"Restored {args.restore}: rows {result['counts']}")
+        print(f"Previous state saved as {result['snapshot']}")
+    elif args.prune:
+        for path in prune(backup_dir, dry_run=args.dry_run):
+            print(f"{'would remove' if args.dry_run else 'removed'} {path}")
+    else:
+        ok = run_once(args.label, db_path, backup_dir)
+        while args.loop:
+            time.sleep(args.loop)
+            ok = run_once(args.label, db_path, backup_dir)
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,82 @@
+"""
+Compare memory use of get_pervasive (full DataFrame) and iter_pervasive
+(fetchmany batches) on a NOTCOJAN pull.
+
+Each mode runs in its own process so peak RSS is not shared between them.
+
+Usage:
+    python benchmark_mosys_streaming.py                 # NOTCOJAN since 20230101
+    python benchmark_mosys_streaming.py --since 20250101 --chunksize 2000
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, '.')
+
+QUERY = '''
+    SELECT NOTCOJAN.NUMERO_NC, NOTCOJAN.DATA, NOTCOJAN.ORA, NOTCOJAN.COMMESSA,
+    NOTCOJAN.NOTE_01, NOTCOJAN.NOTE_02, NOTCOJAN.NOTE_03, NOTCOJAN.NOTE_04, NOTCOJAN.NOTE_05,
+    NOTCOJAN.NOTE_06, NOTCOJAN.NOTE_07, NOTCOJAN.NOTE_08, NOTCOJAN.NOTE_09, NOTCOJAN.NOTE_10,
+    NOTCOJAN.TIPO_NOTA
+    FROM STAAMPDB.NOTCOJAN NOTCOJAN
+    WHERE NOTCOJAN.DATA >= ?
+'''
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if it can't be read."""
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
+
+def run_mode(mode, since, chunksize, results):
+    from MOSYS_data_functions import get_pervasive, iter_pervasive
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = 0
+    if mode == 'dataframe':
+        rows = len(get_pervasive(QUERY, (since,)))
+    else:
+        for batch in iter_pervasive(QUERY, (since,), chunksize=chunksize):
+            rows += len(batch)
+    _, peak = tracemalloc.get_traced_memory()
+    results[mode] = {
+        'rows': rows,
+        'seconds': time.perf_counter() - started,
+        'python_peak_mb': peak / 1024 / 1024,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark streaming MOSYS reads.')
+    parser.add_argument('--since', default='20230101', help='NOTCOJAN.DATA lower bound (YYYYMMDD)')
+    parser.add_argument('--chunksize', type=int, default=5000)
+    args = parser.parse_args()
+
+    manager = multiprocessing.Manager()
+    results = manager.dict()
+    for mode in ('dataframe', 'stream'):
+        process = multiprocessing.Process(target=run_mode, args=(mode, args.since, args.chunksize, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"{mode}: failed (exit code {process.exitcode})")
+
+    print(f"{'mode':<10} {'rows':>10} {'seconds':>9} {'py peak MB':>11} {'peak RSS MB':>12}")
+    for mode, r in results.items():
+        rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else 'n/a'
+        print(f"{mode:<10} {r['rows']:>10} {r['seconds']:>9.2f} {r['python_peak_mb']:>11.1f} {rss:>12}")
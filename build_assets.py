@@ -0,0 +1,97 @@
+"""
+Build the purged, minified, fingerprinted Tailwind CSS (see app/services/assets.py).
+
+Needs the Tailwind CLI, but no internet access at build or run time: use the
+standalone executable (tailwindcss-<platform> from the Tailwind CSS v3
+GitHub releases, copied to the build machine once) or a local
+`npm install -D tailwindcss@3`.
+
+Usage:
+    python build_assets.py                       # tailwindcss on PATH or in node_modules
+    python build_assets.py --tailwind ./tailwindcss-linux-x64
+
+Writes app/static/dist/app.<hash>.css with .gz (and .br when the brotli
+package is installed) copies and updates dist/manifest.json; older builds
+are removed. Re-run after changing classes in the templates.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+ROOT = Path(__file__).resolve().parent
+SOURCE = ROOT / 'assets' / 'app.css'
+CONFIG = ROOT / 'tailwind.config.js'
+DIST_DIR = ROOT / 'app' / 'static' / 'dist'
+MANIFEST = DIST_DIR / 'manifest.json'
+
+
+def find_tailwind(explicit=None):
+    """Command that runs the Tailwind CLI, or None."""
+    candidates = [explicit, os.environ.get('TAILWIND_BIN'), shutil.which('tailwindcss'),
+                  str(ROOT / 'node_modules' / '.bin' / 'tailwindcss')]
+    for candidate in candidates:
+        if candidate and Path(candidate).is_file():
+            return [candidate]
+    return None
+
+
+def compile_css(tailwind):
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / 'app.css'
+        subprocess.run(tailwind + ['-c', str(CONFIG), '-i', str(SOURCE), '-o', str(output), '--minify'],
+                       check=True, cwd=ROOT)
+        return output.read_bytes()
+
+
+def write_fingerprinted(name, data):
+    """Write name.<hash>.ext plus compressed copies; returns the file name."""
+    stem, ext = os.path.splitext(name)
+    built = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    DIST_DIR.mkdir(parents=True, exist_ok=True)
+    (DIST_DIR / built).write_bytes(data)
+    (DIST_DIR / f'{built}.gz').write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        (DIST_DIR / f'{built}.br').write_bytes(brotli.compress(data, quality=11))
+    return built
+
+
+def remove_stale(name, keep):
+    stem, ext = os.path.splitext(name)
+    for path in DIST_DIR.glob(f'{stem}.*{ext}*'):
+        if not path.name.startswith(keep):
+            path.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the Tailwind CSS bundle.')
+    parser.add_argument('--tailwind', help='path to the Tailwind CLI executable')
+    args = parser.parse_args()
+
+    tailwind = find_tailwind(args.tailwind)
+    if tailwind is None:
+        print('Tailwind CLI not found: pass --tailwind PATH, set TAILWIND_BIN '
+              'or run `npm install -D tailwindcss@3`.')
+        sys.exit(1)
+
+    css = compile_css(tailwind)
+    built = write_fingerprinted('app.css', css)
+    manifest = json.loads(MANIFEST.read_text(encoding='utf-8')) if MANIFEST.exists() else {}
+    manifest['app.css'] = built
+    MANIFEST.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    remove_stale('app.css', built)
+
+    gz = (DIST_DIR / f'{built}.gz').stat().st_size
+    print(f"Built {built}: {len(css) // 1024} KB, gzip {gz // 1024} KB"
+          + (f", brotli {(DIST_DIR / f'{built}.br').stat().st_size // 1024} KB" if brotli else ''))
@@ -0,0 +1,250 @@
+"""
+Hot backups of scrap_data.db with the SQLite online backup API.
+
+create_backup() copies the live database into BACKUP_DIR while the app
+keeps running: pages are copied BACKUP_PAGES at a time with a short pause
+between steps, so writers only wait for one step, never for the whole
+copy. SQLite restarts a stepped backup when another connection writes to
+the source; after BACKUP_MAX_RESTARTS restarts the copy is finished in a
+single step instead. Every backup is integrity-checked before it is
+renamed into place, so a file listed by list_backups() is usable.
+
+snapshot_before() is called by import_excel_data.py, the migrate_*.py
+scripts and the startup schema upgrade; prune() applies the retention
+policy; restore_backup() verifies a backup, snapshots the current state
+and copies the backup back into the live database. See backup_database.py
+for the command line.
+
+Archive files (archive/raporty_<year>.db) are not part of a backup: they
+don't change after archiving.
+"""
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+DB_PATH = os.environ.get('SCRAP_DB', str(Path(__file__).resolve().parent / 'scrap_data.db'))
+BACKUP_DIR = os.environ.get('SCRAP_BACKUP_DIR', str(Path(__file__).resolve().parent / 'backups'))
+
+# Pages copied per step, and pause between steps (seconds) so writers get the lock
+BACKUP_PAGES = int(os.environ.get('SCRAP_BACKUP_PAGES', 256))
+BACKUP_PAUSE = float(os.environ.get('SCRAP_BACKUP_PAUSE', 0.005))
+BACKUP_MAX_RESTARTS = 5
+
+# Retention: the newest KEEP_LAST backups, plus the newest of each of the
+# last KEEP_DAILY days, KEEP_WEEKLY ISO weeks and KEEP_MONTHLY months
+KEEP_LAST = int(os.environ.get('SCRAP_BACKUP_KEEP_LAST', 10))
+KEEP_DAILY = int(os.environ.get('SCRAP_BACKUP_KEEP_DAILY', 7))
+KEEP_WEEKLY = int(os.environ.get('SCRAP_BACKUP_KEEP_WEEKLY', 4))
+KEEP_MONTHLY = int(os.environ.get('SCRAP_BACKUP_KEEP_MONTHLY', 12))
+
+# Row counts compared by verify/restore
+CHECKED_TABLES = ('dane_z_raportow', 'braki_defekty_raportow', 'operatorzy', 'dzialy')
+
+FILE_PATTERN = re.compile(r'^scrap_data-(\d{8}-\d{6})-([a-z0-9-]+)\.db$')
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _backup_file(label, now=None):
+    label = re.sub(r'[^a-z0-9-]+', '-', label.lower()).strip('-') or 'manual'
+    return f"scrap_data-{(now or datetime.now()).strftime('%Y%m%d-%H%M%S')}-{label}.db"
+
+
+def _copy(source, target, pages, pause):
+    """Stepped copy of source into target; falls back to one step when writers keep restarting it."""
+    state = {'remaining': None, 'restarts': 0, 'steps': 0}
+
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > BACKUP_MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except _Restarted:
+        source.backup(target)
+        state['steps'] += 1
+    return state
+
+
+def check_database(path):
+    """{'ok', 'integrity', 'counts'} of a database file, opened read-only."""
+    conn = sqlite3.connect(f'file:{Path(path).as_posix()}?mode=ro', uri=True)
+    try:
+        integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in CHECKED_TABLES if table in tables}
+    finally:
+        conn.close()
+    return {'ok': integrity == 'ok', 'integrity': integrity, 'counts': counts}
+
+
+def create_backup(label='manual', db_path=None, backup_dir=None, pages=None, pause=None):
+    """
+    Hot backup of the database into backup_dir. Returns a dict with path,
+    size, seconds, steps, restarts and the row counts of the copy.
+    Raises RuntimeError when the copy fails its integrity check and
+    FileExistsError rather than replace an existing backup.
+    """
+    db_path = db_path or DB_PATH
+    backup_dir = Path(backup_dir or BACKUP_DIR)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    path = backup_dir / _backup_file(label)
+    if path.exists():
+        raise FileExistsError(f'Backup already exists: {path}')
+    partial = path.with_name(path.name + '.partial')
+
+    started = time.monotonic()
+    source = sqlite3.connect(db_path, timeout=30)
+    target = sqlite3.connect(partial)
+    try:
+        state = _copy(source, target, pages or BACKUP_PAGES, BACKUP_PAUSE if pause is None else pause)
+    finally:
+        target.close()
+        source.close()
+
+    check = check_database(partial)
+    if not check['ok']:
+        partial.unlink()
+        raise RuntimeError(f'Backup failed integrity check: {check["integrity"]}')
+    # A hard link never replaces an existing file (another backup finished in the same second)
+    try:
+        os.link(partial, path)
+    finally:
+        partial.unlink()
+    return {
+        'path': str(path),
+        'size': path.stat().st_size,
+        'seconds': round(time.monotonic() - started, 3),
+        'steps': state['steps'],
+        'restarts': state['restarts'],
+        'counts': check['counts'],
+    }
+
+
+def snapshot_before(action, db_path=None, backup_dir=None):
+    """Backup labelled pre-<action>, taken before an import or migration; raises if it fails."""
+    db_path = db_path or DB_PATH
+    if not Path(db_path).exists():
+        return None
+    info = create_backup(f'pre-{action}', db_path=db_path, backup_dir=backup_dir)
+    print(f"Snapshot before {action}: {info['path']} ({info['size'] // 1024} KB, {info['seconds']}s)")
+    return info
+
+
+def list_backups(backup_dir=None):
+    """Finished backups, newest first: [{'path', 'name', 'created', 'label', 'size'}]."""
+    backup_dir = Path(backup_dir or BACKUP_DIR)
+    if not backup_dir.is_dir():
+        return []
+    backups = []
+    for path in backup_dir.glob('scrap_data-*.db'):
+        match = FILE_PATTERN.match(path.name)
+        if not match:
+            continue
+        backups.append({
+            'path': str(path),
+            'name': path.name,
+            'created': datetime.strptime(match.group(1), '%Y%m%d-%H%M%S'),
+            'label': match.group(2),
+            'size': path.stat().st_size,
+        })
+    return sorted(backups, key=lambda b: b['created'], reverse=True)
+
+
+def _retained(backups, keep_last, keep_daily, keep_weekly, keep_monthly):
+    """Names of the backups kept by the retention policy (backups newest first)."""
+    keep = {b['name'] for b in backups[:keep_last]}
+    for limit, period in ((keep_daily, lambda d: d.date()),
+                          (keep_weekly, lambda d: d.isocalendar()[:2]),
+                          (keep_monthly, lambda d: (d.year, d.month))):
+        seen = []
+        for backup in backups:
+            key = period(backup['created'])
+            if key in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.append(key)
+            keep.add(backup['name'])
+    return keep
+
+
+def prune(backup_dir=None, keep_last=None, keep_daily=None, keep_weekly=None, keep_monthly=None, dry_run=False):
+    """Delete backups outside the retention policy. Returns the removed paths."""
+    backups = list_backups(backup_dir)
+    keep = _retained(
+        backups,
+        KEEP_LAST if keep_last is None else keep_last,
+        KEEP_DAILY if keep_daily is None else keep_daily,
+        KEEP_WEEKLY if keep_weekly is None else keep_weekly,
+        KEEP_MONTHLY if keep_monthly is None else keep_monthly,
+    )
+    removed = [b['path'] for b in backups if b['name'] not in keep]
+    if not dry_run:
+        for path in removed:
+            Path(path).unlink()
+    return removed
+
+
+def verify_backup(path):
+    """
+    Integrity check of a backup plus a trial restore into a temporary file,
+    so a backup is known to restore before it is needed.
+    """
+    check = check_database(path)
+    if not check['ok']:
+        return check
+    trial = Path(path).with_name(Path(path).name + '.verify')
+    try:
+        source = sqlite3.connect(f'file:{Path(path).as_posix()}?mode=ro', uri=True)
+        target = sqlite3.connect(trial)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        restored = check_database(trial)
+    finally:
+        trial.unlink(missing_ok=True)
+    check['ok'] = restored['ok'] and restored['counts'] == check['counts']
+    return check
+
+
+def restore_backup(path, db_path=None, backup_dir=None):
+    """
+    Copy a verified backup over the live database (online; open connections
+    see the restored data) after snapshotting the current state as
+    pre-restore. Returns {'snapshot', 'counts'}. Raises RuntimeError if the
+    backup or the restored database doesn't verify.
+    """
+    db_path = db_path or DB_PATH
+    check = verify_backup(path)
+    if not check['ok']:
+        raise RuntimeError(f'Backup {path} does not verify: {check["integrity"]}')
+    snapshot = snapshot_before('restore', db_path=db_path, backup_dir=backup_dir)
+
+    source = sqlite3.connect(f'file:{Path(path).as_posix()}?mode=ro', uri=True)
+    target = sqlite3.connect(db_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    restored = check_database(db_path)
+    if not restored['ok'] or restored['counts'] != check['counts']:
+        raise RuntimeError(f'Restored database does not match the backup '
+                           f'(snapshot of the previous state: {snapshot and snapshot["path"]})')
+    return {'snapshot': snapshot and snapshot['path'], 'counts': restored['counts']}
@@ -0,0 +1,48 @@
+"""
+Export report data to the partitioned Parquet snapshot used for analytics.
+
+Usage:
+    python export_snapshot.py            # rewrite only changed month partitions
+    python export_snapshot.py --full     # rebuild the whole snapshot
+    python export_snapshot.py --dir PATH # write somewhere other than SNAPSHOT_DIR
+    python export_snapshot.py --site zaklad2  # another plant's database, archive and snapshot (sites.json)
+"""
+import argparse
+import sqlite3
+import sys
+sys.path.insert(0, '.')
+
+from app.config import Config
+from app.services.archive import include_archives
+from app.services.snapshot import export_snapshot
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export report data to Parquet.')
+    parser.add_argument('--full', action='store_true', help='rebuild every partition')
+    parser.add_argument('--dir', help='snapshot directory')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    db_path, archive_dir, snapshot_dir = 'scrap_data.db', Config.ARCHIVE_DIR, None
+    if args.site:
+        from app.services.sites import configured_site
+        try:
+            site = configured_site(args.site)
+        except KeyError as e:
+            parser.error(e.args[0])
+        db_path = site['db']
+        archive_dir = site['archive_dir'] or archive_dir
+        snapshot_dir = site['snapshot_dir']
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # Archived years stay in the snapshot
+        include_archives(conn, archive_dir)
+        summary = export_snapshot(conn, args.dir or snapshot_dir, full=args.full)
+    finally:
+        conn.close()
+
+    for dataset, stats in summary.items():
+        print(f"{dataset}: {stats['rows']} rows, {stats['written']} partitions written, "
+              f"{stats['unchanged']} unchanged, {stats['removed']} removed ({stats['seconds']}s)")
@@ -6,7 +6,14 @@ Reads from dane.xlsx sheets:
 """
 import pandas as pd
 import sqlite3
+import sys
 from datetime import datetime
+sys.path.insert(0, '.')
+
+from db_backup import snapshot_before
+
+# Undo point: the import below replaces both report tables
+snapshot_before('import', db_path='scrap_data.db')
 
 # Connect to database
 conn = sqlite3.connect('scrap_data.db')
@@ -30,6 +37,10 @@ print("\n>>> Clearing existing data from braki_defekty_raportow...")
 cursor.execute("DELETE FROM braki_defekty_raportow")
 print(">>> Clearing existing data from dane_z_raportow...")
 cursor.execute("DELETE FROM dane_z_raportow")
+# Report numbers are re-seeded from the imported data on next allocation
+cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sekwencje'")
+if cursor.fetchone():
+    cursor.execute("DELETE FROM sekwencje WHERE nazwa = 'nr_raportu'")
 conn.commit()
 
 # Insert dane_z_raportow
@@ -94,6 +105,13 @@ for idx, row in df_defekty.iterrows():
 conn.commit()
 print(f"Inserted {len(df_defekty)} rows into braki_defekty_raportow")
 
+# Map defect names to the defect_types dictionary (if the migration has been applied)
+cursor.execute("PRAGMA table_info(braki_defekty_raportow)")
+if 'defekt_typ_id' in [col[1] for col in cursor.fetchall()]:
+    from app.services.defect_types import intern_defect_names
+    print(f"Interned {intern_defect_names(conn)} distinct defect names")
+    conn.commit()
+
 # ===== Verify data =====
 print("\n" + "=" * 60)
 print("VERIFICATION")
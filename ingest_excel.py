@@ -0,0 +1,106 @@
+"""
+Import report workbooks (e.g. monthly files from several plants) without
+replacing existing data. See app/services/excel_ingest.py.
+
+Usage:
+    python ingest_excel.py plant_a_2025-01.xlsx plant_b_2025-01.xlsx
+    python ingest_excel.py imports/*.xlsx --workers 4
+    python ingest_excel.py imports/*.xlsx --dry-run --rejects rejects.csv
+    python ingest_excel.py imports/*.xlsx --site zaklad2  # another plant's database (sites.json)
+
+Rows already present (same id or nr_raportu, live or archived) are
+reported as rejected, so a workbook can be imported twice safely.
+"""
+import argparse
+import csv
+import sqlite3
+import sys
+import time
+sys.path.insert(0, '.')
+
+from app.config import Config
+from app.services.archive import include_archives
+from app.services.excel_ingest import ENGINE, existing_keys, merge, parse_workbooks, write
+from db_backup import snapshot_before
+
+DB_PATH = 'scrap_data.db'
+
+
+def refresh_derived(report_ids, site=None):
+    """Rollup, anomaly statistics and recommended rates for the imported reports of `site`."""
+    from app import create_app
+    from app.services import anomalies, recommended_rates, sites
+
+    # create_app rebuilds the daily rollup when its totals no longer match
+    app = create_app()
+    with app.app_context(), sites.activate(site):
+        anomalies.observe_reports(sorted(report_ids))
+        recommended_rates.rebuild()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import report workbooks in parallel.')
+    parser.add_argument('files', nargs='+', help='.xlsx workbooks')
+    parser.add_argument('--workers', type=int, help='parser processes (default: CPU count)')
+    parser.add_argument('--dry-run', action='store_true', help='parse and validate only')
+    parser.add_argument('--rejects', metavar='CSV', help='write rejected rows to a CSV file')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    db_path, archive_dir, backup_dir = DB_PATH, Config.ARCHIVE_DIR, None
+    if args.site:
+        from app.services.sites import configured_site
+        try:
+            site = configured_site(args.site)
+        except KeyError as e:
+            parser.error(e.args[0])
+        db_path = site['db']
+        archive_dir = site['archive_dir'] or archive_dir
+        backup_dir = site['backup_dir']
+
+    started = time.monotonic()
+    results = parse_workbooks(args.files, workers=args.workers)
+    parsed_in = time.monotonic() - started
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        include_archives(conn, archive_dir)
+        existing = existing_keys(conn)
+    finally:
+        conn.close()
+    reports, defects, stats, rejects = merge(results, existing)
+
+    print(f"Parsed {len(args.files)} files ({len(results)} sheets, engine {ENGINE}) in {parsed_in:.1f}s")
+    for file_stats in stats:
+        print(f"  {file_stats.path}: {file_stats.read} rows in {file_stats.seconds:.2f}s "
+              f"({file_stats.rows_per_second:,.0f} rows/s), {file_stats.accepted} accepted, "
+              f"{file_stats.rejected} rejected")
+
+    if args.rejects:
+        with open(args.rejects, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['plik', 'arkusz', 'wiersz', 'powod'])
+            writer.writerows(rejects)
+        print(f"Rejected rows written to {args.rejects}")
+    else:
+        for path, sheet, number, reason in rejects[:20]:
+            print(f"  rejected {path} [{sheet}] row {number}: {reason}")
+        if len(rejects) > 20:
+            print(f"  ... {len(rejects) - 20} more (use --rejects)")
+
+    if args.dry_run or not reports:
+        print(f"Nothing written ({len(reports)} reports, {len(defects)} defects accepted)")
+        sys.exit(0)
+
+    snapshot_before('import', db_path=db_path, backup_dir=backup_dir)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        written_at = time.monotonic()
+        report_ids = write(conn, reports, defects)
+        print(f"Wrote {len(report_ids)} reports and {len(defects)} defects "
+              f"in {time.monotonic() - written_at:.2f}s")
+    finally:
+        conn.close()
+
+    refresh_derived(report_ids, args.site)
+    print(f"Done in {time.monotonic() - started:.1f}s")
@@ -3,8 +3,13 @@ Migration script to add MOSYS data columns to dane_z_raportow table.
 Run with Flask server stopped.
 """
 import sqlite3
+import sys
+sys.path.insert(0, '.')
+
+from db_backup import snapshot_before
 
 def migrate():
+    snapshot_before('migration', db_path='scrap_data.db')
     conn = sqlite3.connect('scrap_data.db')
     cursor = conn.cursor()
     
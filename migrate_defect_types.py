@@ -0,0 +1,88 @@
+"""
+Migration script to intern free-text defect names into the defect_types dictionary.
+
+Creates defect_types / defect_type_aliases, adds braki_defekty_raportow.defekt_typ_id,
+maps every existing defect string to an integer type ID and swaps the string-based
+covering index for one on defekt_typ_id. Safe to run repeatedly.
+Run with Flask server stopped.
+
+Usage:
+    python migrate_defect_types.py
+    python migrate_defect_types.py --site zaklad2  # another plant's database (sites.json)
+"""
+import argparse
+import os
+import sqlite3
+import sys
+sys.path.insert(0, '.')
+
+from app.services.defect_types import intern_defect_names
+from db_backup import snapshot_before
+
+DB_PATH = 'scrap_data.db'
+
+
+def migrate(db_path=DB_PATH, backup_dir=None):
+    snapshot_before('migration', db_path=db_path, backup_dir=backup_dir)
+    size_before = os.path.getsize(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS defect_types (
+            id INTEGER NOT NULL PRIMARY KEY,
+            nazwa VARCHAR NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS defect_type_aliases (
+            id INTEGER NOT NULL PRIMARY KEY,
+            alias VARCHAR NOT NULL UNIQUE,
+            defekt_typ_id INTEGER NOT NULL REFERENCES defect_types (id)
+        )
+    ''')
+
+    cursor.execute("PRAGMA table_info(braki_defekty_raportow)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'defekt_typ_id' not in columns:
+        cursor.execute('ALTER TABLE braki_defekty_raportow ADD COLUMN defekt_typ_id INTEGER REFERENCES defect_types (id)')
+        print('Added defekt_typ_id column')
+    else:
+        print('defekt_typ_id column already exists')
+
+    interned = intern_defect_names(conn)
+    print(f'Interned {interned} distinct defect names')
+
+    cursor.execute('DROP INDEX IF EXISTS ix_braki_raport_defekt_ilosc')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ix_braki_raport_typ_ilosc
+        ON braki_defekty_raportow (raport_id, defekt_typ_id, ilosc)
+    ''')
+    conn.commit()
+
+    cursor.execute('SELECT COUNT(*) FROM defect_types')
+    print(f'defect_types: {cursor.fetchone()[0]} rows')
+    cursor.execute('SELECT COUNT(*) FROM braki_defekty_raportow WHERE defekt_typ_id IS NULL')
+    print(f'Defect rows without type: {cursor.fetchone()[0]}')
+
+    # Reclaim pages freed by the dropped string index
+    cursor.execute('VACUUM')
+    conn.close()
+    print(f'Database size: {size_before / 1024:.0f} KB -> {os.path.getsize(db_path) / 1024:.0f} KB')
+    print('Migration complete!')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Intern defect names into defect_types.')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    if args.site:
+        from app.services.sites import configured_site
+        try:
+            site = configured_site(args.site)
+        except KeyError as e:
+            parser.error(e.args[0])
+        migrate(site['db'], site['backup_dir'])
+    else:
+        migrate()
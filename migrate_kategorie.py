@@ -5,10 +5,12 @@ This script handles the SQLite limitation of not supporting direct column renami
 
 from sqlalchemy import create_engine, text, inspect
 from database.models import DATABASE_URL
+from db_backup import snapshot_before
 
 def migrate_dzialy_table():
     """Migrates the dzialy table to use opis_kategorii instead of nazwa_dzial."""
     engine = create_engine(DATABASE_URL)
+    snapshot_before('migration', db_path=engine.url.database)
 
     with engine.connect() as connection:
         inspector = inspect(engine)
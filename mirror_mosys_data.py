@@ -0,0 +1,51 @@
+"""
+Sync job for the local MOSYS mirror (see mosys_mirror.py).
+
+Usage:
+    python mirror_mosys_data.py            # one incremental sync
+    python mirror_mosys_data.py --full     # re-pull everything since MOSYS_MIRROR_START
+    python mirror_mosys_data.py --loop 300 # incremental sync every 300 seconds
+    python mirror_mosys_data.py --site zaklad2  # another plant's DSN and mirror (sites.json)
+"""
+import argparse
+import sys
+import time
+from contextlib import ExitStack
+sys.path.insert(0, '.')
+
+from mosys_mirror import sync_mirror, mirror_stats
+
+
+def run_once(full=False):
+    started = time.monotonic()
+    try:
+        result = sync_mirror(full=full)
+    except Exception as e:
+        print(f"Mirror sync failed: {e}")
+        return False
+    print(f"Mirrored NOTCOJAN: {result['NOTCOJAN']} rows, COLLAUDO: {result['COLLAUDO']} rows "
+          f"in {time.monotonic() - started:.1f}s")
+    for tabela, stats in mirror_stats().items():
+        print(f"  {tabela}: {stats['rows']} rows, watermark {stats['watermark']}, last sync {stats['last_sync']}")
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sync local MOSYS mirror tables.')
+    parser.add_argument('--full', action='store_true', help='re-pull all NOTCOJAN rows')
+    parser.add_argument('--loop', type=int, metavar='SECONDS', help='repeat every SECONDS')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    with ExitStack() as stack:
+        if args.site:
+            from app.services.sites import configured_site, mosys_contexts
+            try:
+                mosys_contexts(stack, configured_site(args.site))
+            except KeyError as e:
+                parser.error(e.args[0])
+        ok = run_once(full=args.full)
+        while args.loop:
+            time.sleep(args.loop)
+            ok = run_once()
+    sys.exit(0 if ok else 1)
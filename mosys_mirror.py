@@ -0,0 +1,379 @@
+"""
+Local read replica of the MOSYS tables used by this app.
+
+NOTCOJAN (NC notes, incl. DATA/COMMESSA) and COLLAUDO (COMMESSA -> ARTICOLO)
+are copied into mosys_* tables of the local SQLite database, so NC details,
+part numbers and NC history can be answered by indexed local lookups when
+STAAMP is slow or down. See MOSYS_SOURCE_ORDER in MOSYS_data_functions.py
+for the mirror/live fallback order, and mirror_mosys_data.py for the sync job.
+"""
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+MIRROR_DB_PATH = os.environ.get(
+    'MOSYS_MIRROR_DB', str(Path(__file__).resolve().parent / 'scrap_data.db')
+)
+
+# Mirror used in the current context instead of MIRROR_DB_PATH (see use_mirror)
+_mirror_db = ContextVar('mosys_mirror_db', default=None)
+
+# First NOTCOJAN.DATA pulled by an initial (full) sync, YYYYMMDD
+MIRROR_START = os.environ.get('MOSYS_MIRROR_START', '20230101')
+
+# Commesse per COLLAUDO IN (...) query
+COLLAUDO_CHUNK = 500
+
+# NOTCOJAN rows fetched and inserted per batch
+STREAM_CHUNK = 5000
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS mosys_notcojan (
+        id INTEGER PRIMARY KEY,
+        numero_nc TEXT NOT NULL,
+        data TEXT,
+        ora TEXT,
+        commessa TEXT,
+        tekst TEXT,
+        tipo_nota TEXT
+    );
+    CREATE INDEX IF NOT EXISTS ix_mosys_notcojan_nc ON mosys_notcojan (numero_nc, data, ora);
+    CREATE INDEX IF NOT EXISTS ix_mosys_notcojan_data ON mosys_notcojan (data);
+    CREATE INDEX IF NOT EXISTS ix_mosys_notcojan_commessa ON mosys_notcojan (commessa);
+
+    CREATE TABLE IF NOT EXISTS mosys_collaudo (
+        commessa TEXT PRIMARY KEY,
+        articolo TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS mosys_mirror_stan (
+        tabela TEXT PRIMARY KEY,
+        watermark TEXT,
+        last_sync TEXT,
+        rows_synced INTEGER,
+        duration REAL,
+        last_error TEXT
+    );
+'''
+
+
+_initialized = set()
+
+
+@contextmanager
+def use_mirror(db_path):
+    """Read and sync another mirror database (e.g. another plant's) in this context."""
+    token = _mirror_db.set(db_path or None)
+    try:
+        yield
+    finally:
+        _mirror_db.reset(token)
+
+
+def connect(db_path=None):
+    """Open the mirror database, creating the mirror tables on first use."""
+    db_path = str(db_path or _mirror_db.get() or MIRROR_DB_PATH)
+    conn = sqlite3.connect(db_path, timeout=30)
+    if db_path not in _initialized:
+        conn.executescript(SCHEMA)
+        _initialized.add(db_path)
+    return conn
+
+
+def _save_state(conn, tabela, **values):
+    conn.execute('INSERT OR IGNORE INTO mosys_mirror_stan (tabela) VALUES (?)', (tabela,))
+    if not values:
+        return
+    assignments = ', '.join(f'{key} = ?' for key in values)
+    conn.execute(f'UPDATE mosys_mirror_stan SET {assignments} WHERE tabela = ?',
+                 (*values.values(), tabela))
+
+
+def _mosys_date_key(value):
+    """NOTCOJAN.DATA as a sortable YYYYMMDD string."""
+    if value is None:
+        return None
+    text = str(value).strip().replace('-', '')
+    return text[:8] if text else None
+
+
+def sync_notcojan(conn, full=False):
+    """
+    Pull NOTCOJAN rows with DATA >= last mirrored day (or MIRROR_START when full).
+
+    The last mirrored day is re-pulled and replaced, so notes added later the
+    same day are not missed. Returns the number of rows written.
+    """
+    from MOSYS_data_functions import iter_pervasive, join_notes
+
+    watermark = None
+    if not full:
+        row = conn.execute("SELECT watermark FROM mosys_mirror_stan WHERE tabela = 'NOTCOJAN'").fetchone()
+        watermark = row[0] if row else None
+    since = watermark or MIRROR_START
+
+    query = '''
+        SELECT NOTCOJAN.NUMERO_NC, NOTCOJAN.DATA, NOTCOJAN.ORA, NOTCOJAN.COMMESSA,
+        NOTCOJAN.NOTE_01, NOTCOJAN.NOTE_02, NOTCOJAN.NOTE_03, NOTCOJAN.NOTE_04, NOTCOJAN.NOTE_05,
+        NOTCOJAN.NOTE_06, NOTCOJAN.NOTE_07, NOTCOJAN.NOTE_08, NOTCOJAN.NOTE_09, NOTCOJAN.NOTE_10,
+        NOTCOJAN.TIPO_NOTA
+        FROM STAAMPDB.NOTCOJAN NOTCOJAN
+        WHERE NOTCOJAN.DATA >= ?
+    '''
+
+    if full:
+        conn.execute('DELETE FROM mosys_notcojan')
+    else:
+        conn.execute('DELETE FROM mosys_notcojan WHERE data >= ?', (since,))
+
+    # Streamed in batches (inside the caller's transaction), so a full sync runs in constant memory
+    written = 0
+    max_data = watermark
+    for batch in iter_pervasive(query, (since,), chunksize=STREAM_CHUNK):
+        rows = []
+        for record in batch:
+            data = _mosys_date_key(record['DATA'])
+            rows.append((
+                record['NUMERO_NC'], data, str(record.get('ORA') or ''),
+                record.get('COMMESSA'), join_notes(record), record.get('TIPO_NOTA')
+            ))
+            if data and (max_data is None or data > max_data):
+                max_data = data
+        conn.executemany('''
+            INSERT INTO mosys_notcojan (numero_nc, data, ora, commessa, tekst, tipo_nota)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        written += len(rows)
+
+    _save_state(conn, 'NOTCOJAN', watermark=max_data or since)
+    return written
+
+
+def sync_collaudo(conn):
+    """Fetch ARTICOLO for every mirrored COMMESSA not yet in mosys_collaudo. Returns rows written."""
+    from MOSYS_data_functions import get_pervasive
+
+    commesse = [row[0] for row in conn.execute('''
+        SELECT DISTINCT n.commessa FROM mosys_notcojan n
+        LEFT JOIN mosys_collaudo c ON c.commessa = n.commessa
+        WHERE n.commessa IS NOT NULL AND n.commessa != '' AND c.commessa IS NULL
+    ''')]
+
+    written = 0
+    for start in range(0, len(commesse), COLLAUDO_CHUNK):
+        chunk = commesse[start:start + COLLAUDO_CHUNK]
+        placeholders = ','.join(['?' for _ in chunk])
+        df = get_pervasive(f'''
+            SELECT COLLAUDO.COMMESSA, COLLAUDO.ARTICOLO
+            FROM STAAMPDB.COLLAUDO COLLAUDO
+            WHERE COLLAUDO.COMMESSA IN ({placeholders})
+        ''', tuple(chunk))
+        pairs = list(zip(df['COMMESSA'], df['ARTICOLO']))
+        conn.executemany('INSERT OR REPLACE INTO mosys_collaudo (commessa, articolo) VALUES (?, ?)', pairs)
+        written += len(pairs)
+
+    _save_state(conn, 'COLLAUDO')
+    return written
+
+
+def sync_mirror(full=False, db_path=None):
+    """Run one incremental (or full) mirror sync. Returns {'NOTCOJAN': rows, 'COLLAUDO': rows}."""
+    conn = connect(db_path)
+    result = {}
+    try:
+        for tabela, sync in (('NOTCOJAN', lambda: sync_notcojan(conn, full)),
+                             ('COLLAUDO', lambda: sync_collaudo(conn))):
+            started = time.monotonic()
+            try:
+                result[tabela] = sync()
+                _save_state(conn, tabela,
+                            last_sync=datetime.now().isoformat(timespec='seconds'),
+                            rows_synced=result[tabela],
+                            duration=round(time.monotonic() - started, 3),
+                            last_error=None)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                _save_state(conn, tabela, last_error=str(e))
+                conn.commit()
+                raise
+    finally:
+        conn.close()
+    return result
+
+
+def mirror_batch_details(nr_list, db_path=None):
+    """
+    NC details from the mirror, same shape as get_batch_niezgodnosc_details.
+    Uses the first (opening) NOTCOJAN row of each NC. NCs not mirrored are omitted;
+    kod_detalu is None when the order has no mirrored COLLAUDO row, and
+    get_batch_niezgodnosc_details leaves those NCs to live MOSYS.
+    """
+    if not nr_list:
+        return {}
+    conn = connect(db_path)
+    try:
+        result = {}
+        for start in range(0, len(nr_list), 500):
+            chunk = nr_list[start:start + 500]
+            placeholders = ','.join(['?' for _ in chunk])
+            rows = conn.execute(f'''
+                SELECT n.numero_nc, n.data, n.commessa, c.articolo
+                FROM mosys_notcojan n
+                LEFT JOIN mosys_collaudo c ON c.commessa = n.commessa
+                WHERE n.numero_nc IN ({placeholders})
+                ORDER BY n.numero_nc, n.data, n.ora
+            ''', chunk).fetchall()
+            for numero_nc, data, commessa, articolo in rows:
+                if numero_nc in result:
+                    continue
+                result[numero_nc] = {
+                    'data_niezgodnosci': datetime.strptime(data, '%Y%m%d').date() if data else None,
+                    'nr_zamowienia': commessa,
+                    'kod_detalu': articolo
+                }
+        return result
+    finally:
+        conn.close()
+
+
+def mirror_part_number(nr_zamowienia, db_path=None):
+    """ARTICOLO for a COMMESSA from the mirror, or None."""
+    conn = connect(db_path)
+    try:
+        row = conn.execute('SELECT articolo FROM mosys_collaudo WHERE commessa = ?', (nr_zamowienia,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def mirror_nc_history(nr_niezgodnosci, db_path=None, allow_stale=False):
+    """
+    NC history from the mirror, same shape as get_nc_history.
+
+    Returns [] when the mirror is older than MOSYS_MIRROR_MAX_AGE seconds
+    (default 1 h), so fresher live data is tried next. With allow_stale
+    (live MOSYS unreachable) the old rows are returned, each marked
+    'stale': True.
+    """
+    from MOSYS_data_functions import format_ora
+
+    conn = connect(db_path)
+    try:
+        max_age = float(os.environ.get('MOSYS_MIRROR_MAX_AGE', 3600))
+        age = _age_seconds(conn, 'NOTCOJAN')
+        stale = age is None or age > max_age
+        if stale and not allow_stale:
+            return []
+        rows = conn.execute('''
+            SELECT data, ora, tekst, tipo_nota FROM mosys_notcojan
+            WHERE numero_nc = ?
+            ORDER BY data, ora
+        ''', (nr_niezgodnosci,)).fetchall()
+        history = [{
+            'data_wpisu': datetime.strptime(data, '%Y%m%d').date() if data else None,
+            'godzina_wpisu': format_ora(ora),
+            'tekst_wpisu': tekst,
+            'typ_uwagi': tipo_nota or ''
+        } for data, ora, tekst, tipo_nota in rows]
+        if stale:
+            for entry in history:
+                entry['stale'] = True
+        return history
+    finally:
+        conn.close()
+
+
+def mirror_new_keys(after=(0, 0), db_path=None):
+    """
+    NC numbers and ARTICOLO codes mirrored since the given (notcojan, collaudo)
+    rowids: ({numero_nc}, {articolo}, new rowids). Rows re-pulled by a sync get
+    new rowids, so passing the returned rowids back picks up only new keys.
+    """
+    conn = connect(db_path)
+    try:
+        result, upto = [], []
+        for table, column, since in (('mosys_notcojan', 'numero_nc', after[0]),
+                                     ('mosys_collaudo', 'articolo', after[1])):
+            last = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+            result.append({row[0] for row in conn.execute(
+                f'SELECT DISTINCT {column} FROM {table} WHERE rowid > ? AND rowid <= ? AND {column} IS NOT NULL',
+                (since, last)
+            ) if row[0]})
+            upto.append(max(last, since))
+        return result[0], result[1], tuple(upto)
+    finally:
+        conn.close()
+
+
+def mirror_nc_summaries(after=0, db_path=None):
+    """
+    Per-NC summary of the notes of every NC with a note mirrored after the
+    given mosys_notcojan rowid, in one grouped query: ([(numero_nc, first
+    DATA, last DATA, notes, opening COMMESSA, its ARTICOLO, last rowid)],
+    last rowid of the table). DATA values stay YYYYMMDD strings.
+    """
+    conn = connect(db_path)
+    try:
+        last = conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM mosys_notcojan').fetchone()[0]
+        rows = conn.execute('''
+            SELECT s.numero_nc, s.prima, s.ultima, s.note, s.commessa, c.articolo, s.ultimo_id
+            FROM (
+                SELECT n.numero_nc,
+                       MIN(NULLIF(n.data, '')) AS prima,
+                       MAX(NULLIF(n.data, '')) AS ultima,
+                       COUNT(*) AS note,
+                       MAX(n.rowid) AS ultimo_id,
+                       (SELECT o.commessa FROM mosys_notcojan o
+                        WHERE o.numero_nc = n.numero_nc AND o.commessa IS NOT NULL AND o.commessa != ''
+                        ORDER BY o.data, o.ora LIMIT 1) AS commessa
+                FROM mosys_notcojan n
+                WHERE n.numero_nc IN (
+                    SELECT numero_nc FROM mosys_notcojan WHERE rowid > ? AND rowid <= ?
+                )
+                GROUP BY n.numero_nc
+            ) s
+            LEFT JOIN mosys_collaudo c ON c.commessa = s.commessa
+        ''', (after, last)).fetchall()
+        return rows, last
+    finally:
+        conn.close()
+
+
+def _age_seconds(conn, tabela):
+    row = conn.execute('SELECT last_sync FROM mosys_mirror_stan WHERE tabela = ?', (tabela,)).fetchone()
+    if not row or not row[0]:
+        return None
+    return (datetime.now() - datetime.fromisoformat(row[0])).total_seconds()
+
+
+def mirror_stats(db_path=None):
+    """Staleness and size of each mirrored table, for monitoring."""
+    conn = connect(db_path)
+    try:
+        counts = {
+            'NOTCOJAN': conn.execute('SELECT COUNT(*) FROM mosys_notcojan').fetchone()[0],
+            'COLLAUDO': conn.execute('SELECT COUNT(*) FROM mosys_collaudo').fetchone()[0],
+        }
+        stats = {}
+        for tabela, rows in counts.items():
+            state = conn.execute('''
+                SELECT watermark, last_sync, rows_synced, duration, last_error
+                FROM mosys_mirror_stan WHERE tabela = ?
+            ''', (tabela,)).fetchone() or (None,) * 5
+            stats[tabela] = {
+                'rows': rows,
+                'watermark': state[0],
+                'last_sync': state[1],
+                'age_seconds': _age_seconds(conn, tabela),
+                'last_rows_synced': state[2],
+                'last_duration': state[3],
+                'last_error': state[4],
+            }
+        return stats
+    finally:
+        conn.close()
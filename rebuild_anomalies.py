@@ -0,0 +1,32 @@
+"""
+Recompute scrap-rate statistics and alarms from all reports.
+
+Run after importing historical reports or changing the ANOMALY_* settings;
+new reports are picked up incrementally by the running app.
+
+Usage:
+    python rebuild_anomalies.py
+    python rebuild_anomalies.py --site zaklad2  # another plant's database (sites.json)
+"""
+import argparse
+import sys
+import time
+sys.path.insert(0, '.')
+
+from app import create_app
+from app.services import sites
+from app.services.anomalies import rebuild
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute scrap-rate statistics and alarms.')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    app = create_app()
+    if args.site and args.site not in app.config['SITES']:
+        parser.error(f"Unknown site {args.site!r} (sites: {', '.join(app.config['SITES']) or 'none'})")
+    with app.app_context(), sites.activate(args.site):
+        start = time.perf_counter()
+        series, alarms = rebuild()
+        print(f"{series} series, {alarms} alarms ({time.perf_counter() - start:.1f}s)")
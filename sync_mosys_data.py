@@ -1,71 +1,108 @@
 """
 Sync script to populate MOSYS data columns in local database.
 Fetches data_niezgodnosci, nr_zamowienia, and kod_detalu from MOSYS/STAAMP database.
+
+NC numbers are read and synced in windows of WINDOW keys (keyset-paginated),
+so memory use does not grow with the number of reports.
+
+Usage:
+    python sync_mosys_data.py
+    python sync_mosys_data.py --site zaklad2  # another plant's database, DSN and mirror (sites.json)
 """
+import argparse
+import asyncio
 import sqlite3
 import sys
+from contextlib import ExitStack
 sys.path.insert(0, '.')
 
-from MOSYS_data_functions import get_batch_niezgodnosc_details
+from MOSYS_data_functions import AsyncMosysClient, ASYNC_BATCH_SIZE, ASYNC_MAX_CONCURRENCY
+
+# One window keeps every concurrent MOSYS batch busy once
+WINDOW = ASYNC_BATCH_SIZE * ASYNC_MAX_CONCURRENCY
+
 
+def iter_pending_nrs(conn, window=WINDOW):
+    """Yield lists of distinct nr_niezgodnosci still missing MOSYS data, in key order."""
+    last = ''
+    while True:
+        rows = conn.execute('''
+            SELECT DISTINCT nr_niezgodnosci
+            FROM dane_z_raportow
+            WHERE nr_niezgodnosci > ?
+            AND (data_niezgodnosci IS NULL OR nr_zamowienia IS NULL OR kod_detalu IS NULL)
+            ORDER BY nr_niezgodnosci
+            LIMIT ?
+        ''', (last, window)).fetchall()
+        if not rows:
+            return
+        yield [row[0] for row in rows]
+        last = rows[-1][0]
+
+
+def store_window(conn, mosys_data):
+    """Write one window of MOSYS details. Returns the number of updated rows."""
+    cursor = conn.executemany('''
+        UPDATE dane_z_raportow
+        SET data_niezgodnosci = ?,
+            nr_zamowienia = ?,
+            kod_detalu = ?
+        WHERE nr_niezgodnosci = ?
+    ''', [
+        (data.get('data_niezgodnosci'), data.get('nr_zamowienia'), data.get('kod_detalu'), nr)
+        for nr, data in mosys_data.items()
+    ])
+    conn.commit()
+    return cursor.rowcount
 
-def sync_mosys_data():
+
+async def sync_windows(conn):
+    """Fetch each window concurrently (see AsyncMosysClient) and store it before reading the next."""
+    client = AsyncMosysClient()
+    totals = {'nrs': 0, 'fetched': 0, 'updated': 0}
+    for nr_list in iter_pending_nrs(conn):
+        mosys_data = await client.get_batch_niezgodnosc_details(nr_list)
+        totals['nrs'] += len(nr_list)
+        totals['fetched'] += len(mosys_data)
+        totals['updated'] += store_window(conn, mosys_data)
+        print(f"  {totals['nrs']} NC numbers processed, {totals['fetched']} found in MOSYS")
+    return totals
+
+
+def sync_mosys_data(db_path='scrap_data.db'):
     """Sync MOSYS data to local database for all reports missing this data."""
     
-    conn = sqlite3.connect('scrap_data.db')
-    cursor = conn.cursor()
-    
-    # Get all unique nr_niezgodnosci that need MOSYS data
-    cursor.execute('''
-        SELECT DISTINCT nr_niezgodnosci 
-        FROM dane_z_raportow 
-        WHERE nr_niezgodnosci IS NOT NULL 
-        AND nr_niezgodnosci != ''
-        AND (data_niezgodnosci IS NULL OR nr_zamowienia IS NULL OR kod_detalu IS NULL)
-    ''')
-    
-    rows = cursor.fetchall()
-    nr_list = [row[0] for row in rows]
-    
-    if not nr_list:
-        print("No records need MOSYS data sync.")
-        conn.close()
-        return
-    
-    print(f"Found {len(nr_list)} unique nr_niezgodnosci to sync...")
-    
-    # Fetch data from MOSYS in batch
+    conn = sqlite3.connect(db_path)
     try:
-        mosys_data = get_batch_niezgodnosc_details(nr_list)
-        print(f"Fetched data for {len(mosys_data)} records from MOSYS")
+        totals = asyncio.run(sync_windows(conn))
     except Exception as e:
         print(f"Error fetching MOSYS data: {e}")
-        conn.close()
         return
+    finally:
+        conn.close()
     
-    # Update local database
-    updated = 0
-    for nr_niezgodnosci, data in mosys_data.items():
-        cursor.execute('''
-            UPDATE dane_z_raportow
-            SET data_niezgodnosci = ?,
-                nr_zamowienia = ?,
-                kod_detalu = ?
-            WHERE nr_niezgodnosci = ?
-        ''', (
-            data.get('data_niezgodnosci'),
-            data.get('nr_zamowienia'),
-            data.get('kod_detalu'),
-            nr_niezgodnosci
-        ))
-        updated += cursor.rowcount
-    
-    conn.commit()
-    conn.close()
+    if not totals['nrs']:
+        print("No records need MOSYS data sync.")
+        return
     
-    print(f"Updated {updated} records in local database.")
+    print(f"Fetched data for {totals['fetched']} of {totals['nrs']} nr_niezgodnosci from MOSYS")
+    print(f"Updated {totals['updated']} records in local database.")
     print("Sync complete!")
 
 
 if __name__ == '__main__':
-    sync_mosys_data()
+    parser = argparse.ArgumentParser(description='Fill in MOSYS data of reports.')
+    parser.add_argument('--site', help='site key from the sites file (default: the default database)')
+    args = parser.parse_args()
+
+    with ExitStack() as stack:
+        if args.site:
+            from app.services.sites import configured_site, mosys_contexts
+            try:
+                site = configured_site(args.site)
+            except KeyError as e:
+                parser.error(e.args[0])
+            mosys_contexts(stack, site)
+            sync_mosys_data(site['db'])
+        else:
+            sync_mosys_data()
@@ -0,0 +1,31 @@
+// Tailwind build of the templates (python build_assets.py); keep the theme in
+// sync with the CDN fallback config in app/templates/base.html.
+module.exports = {
+    content: ['./app/templates/**/*.html'],
+    theme: {
+        extend: {
+            fontFamily: {
+                sans: ['Inter', 'system-ui', 'sans-serif'],
+            },
+            colors: {
+                primary: {
+                    50: '#eff6ff',
+                    100: '#dbeafe',
+                    200: '#bfdbfe',
+                    300: '#93c5fd',
+                    400: '#60a5fa',
+                    500: '#3b82f6',
+                    600: '#2563eb',
+                    700: '#1d4ed8',
+                    800: '#1e40af',
+                    900: '#1e3a8a',
+                },
+                accent: {
+                    400: '#34d399',
+                    500: '#10b981',
+                    600: '#059669',
+                }
+            }
+        }
+    }
+}